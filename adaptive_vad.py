@@ -0,0 +1,171 @@
+import math
+from collections import deque
+import numpy as np
+
+LOGIT_RANGE = 10
+LOGIT_BINS = 80
+
+
+def logit(p):
+    p = min(max(p, 1e-6), 1 - 1e-6)
+    return math.log(p / (1 - p))
+
+
+def sigmoid(x):
+    return 1 / (1 + math.exp(-x))
+
+
+class AdaptiveVad:
+    """
+    Adapts a VadEngine's start/end thresholds and minimum silence to the room.
+
+    Three statistics are tracked online in constant memory:
+
+    - The noise floor: the level of the quietest audio, falling within about
+      a second and rising by at most `floor_rise_db` per second, so steady
+      noise such as fans or an organ is followed but speech is not. A segment
+      only starts on audio at least `snr_db` above it.
+    - The speech probabilities seen while no segment is open, as a histogram
+      of their logits that forgets with a time constant of `memory_sec`. The
+      start threshold is kept `margin` logits above their `quantile`, never
+      below the configured threshold, so a room that keeps producing
+      near-threshold probabilities needs a clearer voice to start a segment.
+      The end threshold keeps the configured hysteresis below it, but stays
+      above the median idle probability so segments can still end over
+      constant background sound.
+    - The pauses inside segments. Once `min_pauses` were seen, the silence
+      that ends a segment becomes `pause_factor` times their 95th percentile,
+      between `min_silence_floor_sec` and the configured silence.
+
+    Thresholds are recomputed every `update_sec` and significant changes are
+    logged, as are the starts rejected for a low signal-to-noise ratio.
+
+    Args:
+        log: Logger for the decisions; None disables logging
+        min_silence_floor_sec: Shortest silence that may end a segment
+        snr_db: Level above the noise floor needed to start a segment
+        quantile: Quantile of the idle probabilities the start threshold follows
+        margin: Logits between that quantile and the start threshold
+        max_threshold: Highest start threshold
+        memory_sec: Time constant of the idle probability histogram
+        warmup_sec: Idle audio needed before the thresholds adapt
+        floor_rise_db: Fastest rise of the noise floor in dB per second
+        min_pauses: Pauses needed before the silence adapts
+        pause_factor: Silence as a multiple of the 95th percentile pause
+        update_sec: Seconds between threshold updates
+    """
+
+    def __init__(self, log=None, min_silence_floor_sec=5, snr_db=6, quantile=0.99, margin=1.0, max_threshold=0.9999, memory_sec=600, warmup_sec=30, floor_rise_db=0.5, min_pauses=10, pause_factor=1.5, update_sec=5):
+        self.log = log
+        self.min_silence_floor_sec = min_silence_floor_sec
+        self.snr_db = snr_db
+        self.quantile = quantile
+        self.margin = margin
+        self.max_logit = logit(max_threshold)
+        self.memory_sec = memory_sec
+        self.warmup_sec = warmup_sec
+        self.floor_rise_db = floor_rise_db
+        self.min_pauses = min_pauses
+        self.pause_factor = pause_factor
+        self.update_sec = update_sec
+        self.histogram = np.zeros(LOGIT_BINS)
+        self.pauses = deque(maxlen=200)
+        self.pause = 0.0
+        self.idle_seconds = 0.0
+        self.since_update = 0.0
+        self.noise_floor_db = None
+        self.level_db = None
+        self.rejected = False
+        self.rejected_starts = 0
+        self.engine = None
+
+    def attach(self, engine):
+        """Take the engine's configured values as the starting point and limits."""
+        self.engine = engine
+        self.sampling_rate = engine.sampling_rate
+        self.base_logit = logit(engine.threshold)
+        self.hysteresis = self.base_logit - logit(engine.end_threshold)
+        self.max_silence_sec = engine.min_silence_samples / engine.sampling_rate
+        self.start_logit = self.base_logit
+        self.end_logit = logit(engine.end_threshold)
+        self.min_silence_sec = self.max_silence_sec
+
+    def update(self, batch, probability, triggered):
+        """Account for one model call; called by the engine before it decides."""
+        seconds = len(batch) / self.sampling_rate
+        self.track_noise_floor(float(np.dot(batch, batch)) / len(batch), seconds)
+        if triggered:
+            self.track_pause(probability, seconds)
+        else:
+            self.pause = 0.0
+            self.idle_seconds += seconds
+            self.histogram *= math.exp(-seconds / self.memory_sec)
+            index = int((min(max(logit(probability), -LOGIT_RANGE), LOGIT_RANGE - 1e-9) + LOGIT_RANGE) * LOGIT_BINS / (2 * LOGIT_RANGE))
+            self.histogram[index] += 1
+            if probability < self.engine.threshold:
+                self.rejected = False
+        self.since_update += seconds
+        if self.since_update >= self.update_sec:
+            self.since_update = 0.0
+            self.adapt()
+
+    def track_noise_floor(self, mean_square, seconds):
+        level = max(10 * math.log10(mean_square + 1e-12), -100)
+        self.level_db = level
+        if self.noise_floor_db is None:
+            self.noise_floor_db = level
+        elif level < self.noise_floor_db:
+            self.noise_floor_db += (level - self.noise_floor_db) * min(1.0, seconds)
+        else:
+            self.noise_floor_db += min(level - self.noise_floor_db, self.floor_rise_db * seconds)
+
+    def track_pause(self, probability, seconds):
+        if probability < self.engine.end_threshold:
+            self.pause += seconds
+        elif probability >= self.engine.threshold and self.pause:
+            self.pauses.append(self.pause)
+            self.pause = 0.0
+
+    def allows_start(self):
+        """Whether a batch above the start threshold may open a segment."""
+        snr = self.level_db - self.noise_floor_db
+        if snr >= self.snr_db:
+            return True
+        self.rejected_starts += 1
+        if not self.rejected and self.log:
+            self.log.info(f"Ignored speech start only {snr:.1f} dB above the noise floor", noise_floor_db=round(self.noise_floor_db, 1), level_db=round(self.level_db, 1))
+        self.rejected = True
+        return False
+
+    def idle_quantile(self, q):
+        counts = np.cumsum(self.histogram)
+        index = min(int(np.searchsorted(counts, q * counts[-1])), LOGIT_BINS - 1)
+        return (index + 1) * 2 * LOGIT_RANGE / LOGIT_BINS - LOGIT_RANGE
+
+    def adapt(self):
+        if self.idle_seconds >= self.warmup_sec and self.histogram.sum():
+            start_logit = min(max(self.base_logit, self.idle_quantile(self.quantile) + self.margin), self.max_logit)
+            end_logit = min(max(start_logit - self.hysteresis, self.idle_quantile(0.5) + self.margin), start_logit - min(self.hysteresis, self.margin))
+            if abs(start_logit - self.start_logit) >= 0.25 or abs(end_logit - self.end_logit) >= 0.25:
+                self.start_logit, self.end_logit = start_logit, end_logit
+                self.engine.threshold, self.engine.end_threshold = sigmoid(start_logit), sigmoid(end_logit)
+                self.report(f"Adapted VAD thresholds to start {self.engine.threshold:.4f}, end {self.engine.end_threshold:.4f}")
+        if len(self.pauses) >= self.min_pauses:
+            silence = self.pause_factor * float(np.percentile(self.pauses, 95))
+            silence = min(max(silence, self.min_silence_floor_sec), self.max_silence_sec)
+            if abs(silence - self.min_silence_sec) >= 0.5:
+                self.min_silence_sec = silence
+                self.engine.min_silence_samples = silence * self.sampling_rate
+                self.report(f"Adapted silence before a segment ends to {silence:.1f}s from {len(self.pauses)} pauses")
+
+    def report(self, message):
+        if self.log:
+            self.log.info(message, **self.state())
+
+    def state(self):
+        return {
+            'threshold': round(self.engine.threshold, 4),
+            'end_threshold': round(self.engine.end_threshold, 4),
+            'min_silence_sec': round(self.min_silence_sec, 1),
+            'noise_floor_db': None if self.noise_floor_db is None else round(self.noise_floor_db, 1),
+        }
@@ -1,24 +1,37 @@
 #!/usr/bin/env python3
 
-import torch
-torch.set_num_threads(1)
 import numpy as np
 import pyaudio
 import os
 import argparse
+import json
+import signal
 import threading
 import queue
-import wave
 import datetime
 import time
 from datetime import datetime
-from torchaudio import functional
-from helpers import create_folder_if_not_exists, from_json, int2float
-from file_uploader import upload as upload_file
-from log import log_message
-from collections import deque
+from file_uploader import MinioUploader
+from upload_queue import UploadQueue
+from spool import Spool
+from catalog import Catalog
+from log import Logger, log_message
+from metrics import REGISTRY
+from status_update import StatusReporter
+from ring_buffer import RingBuffer
 from math import floor
-import ptz
+from capture import CallbackCapture, MultiDeviceSource
+from resampler import StreamingResampler
+from dsp_context import DspContext
+from segment_writer import SegmentWriter
+from encoder import SegmentEncoder, encoded_filename
+from vad_engine import VadEngine
+from adaptive_vad import AdaptiveVad
+from silero_onnx import DEFAULT_MODEL_PATH, SileroOnnxModel, TorchValidator
+from camera_worker import CameraWorker
+from config import ConfigWatcher, RUNTIME_SETTINGS, changes, load_settings, load_positions, load_upload_settings
+from pipeline import Pipeline, Stage, parse_cpu_pinning
+from profiler import SamplingProfiler, budget_report, timing_report
 
 class AudioRecorder:
     def __init__(
@@ -27,192 +40,782 @@ class AudioRecorder:
         min_silence_duration_sec=15,
         upload=False,
         padding_ms=1000,
+        post_roll_ms=1000,
         min_record_time_sec=15,
-        record_video=False
+        record_video=False,
+        capture_mode='blocking',
+        sample_rate=44100,
+        upload_workers=2,
+        upload_manifest='upload_manifest.json',
+        stream_upload=False,
+        codec='wav',
+        bitrate=None,
+        vad_batch_windows=3,
+        vad_gate_dbfs=-60,
+        vad_model_path=DEFAULT_MODEL_PATH,
+        validate_torch=False,
+        cpu_pinning=None,
+        stats_interval=300,
+        vad_threshold=0.9965,
+        adaptive_vad=False,
+        adaptive_min_silence_sec=5,
+        input_file=None,
+        output_dir='/dev/shm/vad_audio',
+        spool_ram_mb=256,
+        spill_dir=None,
+        keep_uploaded_hours=0,
+        catalog_path=None,
+        post_filter=False,
+        loudness=False,
+        normalize_lufs=None,
+        normalize_settle_sec=30,
+        log_file=None,
+        metrics_file=None,
+        metrics_port=None,
+        status_interval=30,
+        channels=1,
+        vad_channel=0,
+        split_channels=False,
+        channel_names=None,
+        config_file=None,
+        profile_sec=None,
+        profile_dir='.'
     ):
         self.device_index = device_index
+        # One or more input devices, e.g. '1' or '1,3', each with `channels` channels
+        self.devices = [] if input_file else (list(device_index) if isinstance(device_index, (list, tuple)) else str(device_index).split(','))
         self.min_silence_duration_sec = min_silence_duration_sec
         self.padding_ms = padding_ms
-        self.model, self.utils = torch.hub.load(repo_or_dir='vendor/silero-vad-master',
-                                                source='local',
-                                                model='silero_vad',
-                                                onnx=True)
-
-        (self.get_speech_timestamps,
-         _,
-         self.read_audio,
-         self.VadIterator, _) = self.utils
+        self.post_roll_ms = post_roll_ms
+        self.capture_mode = capture_mode
+        self.stream_upload = upload and stream_upload
+        self.codec = codec
+        self.bitrate = bitrate
+        self.encoder = None
+        self.vad_batch_windows = vad_batch_windows
+        self.vad_gate_dbfs = vad_gate_dbfs
+        self.upload = upload
+        self.cpu_pinning = cpu_pinning or {}
+        self.stats_interval = stats_interval
+        self.vad_threshold = vad_threshold
+        self.adaptive_vad = adaptive_vad
+        self.adaptive_min_silence_sec = adaptive_min_silence_sec
+        self.input_file = input_file
+        self.detected_segments = []
+        # Seconds between the end of speech and the moment it was detected
+        self.close_delays = []
+        # onnxruntime only; torch is imported solely by --validate-torch
+        self.model = SileroOnnxModel(vad_model_path)
 
         self.FORMAT = pyaudio.paInt16
-        self.CHANNELS = 1
-        self.SAMPLE_RATE = 44100
+        self.CHANNELS = channels * max(1, len(self.devices))
+        self.DEVICE_CHANNELS = channels
+        check_channels(self.CHANNELS, vad_channel, channel_names)
+        self.SAMPLE_RATE = sample_rate
         self.VAD_TARGET_SAMPLE_RATE = 16000
         self.NUM_SAMPLES = 1536
+        self.VAD_WINDOW_SAMPLES = 512
         self.CHUNK = int(self.SAMPLE_RATE / 20)
         self.MIN_RECORD_TIME_SEC = min_record_time_sec
+        # Real-time deadline of a chunk: it has to be processed before the next one is captured
+        self.CHUNK_BUDGET_SEC = self.NUM_SAMPLES / self.SAMPLE_RATE
+
+        # Built once; carries filter history across chunks
+        self.resampler = StreamingResampler(self.SAMPLE_RATE, self.VAD_TARGET_SAMPLE_RATE)
+        # Conversion and resampling buffers reused for every chunk
+        self.dsp = DspContext(self.resampler, self.NUM_SAMPLES, self.CHANNELS, vad_channel if self.CHANNELS > 1 else 0)
+        # With several channels, segments are written as one aligned
+        # multi-channel file, or split into one file per channel when saved
+        self.split_channels = split_channels and self.CHANNELS > 1
+        self.channel_names = channel_names or [f"ch{channel + 1}" for channel in range(self.CHANNELS)]
+        # Post-processing applied to the segment audio before it is written and
+        # encoded; imported on demand as scipy adds tens of MB of RSS
+        self.post_filter = None
+        if(post_filter):
+            from post_processing import FilterChain
+            self.post_filter = FilterChain(self.SAMPLE_RATE, self.CHANNELS)
+        # Level and loudness metered per segment as it is captured; the
+        # encoder applies the normalization gain once it has settled
+        self.loudness = loudness or normalize_lufs is not None
+        self.normalize_lufs = normalize_lufs
+        self.normalize_settle_sec = normalize_settle_sec
+        self.meter = None
+        if(self.loudness):
+            from loudness import LoudnessMeter
+            self.LoudnessMeter = LoudnessMeter
 
-        self.audio = pyaudio.PyAudio()
+        # A replayed file needs no audio device
+        self.audio = None if input_file else pyaudio.PyAudio()
+        self.SAMPLE_WIDTH = pyaudio.get_sample_size(self.FORMAT)
 
         self.logging_queue = queue.Queue()
-        self.logging_listener = threading.Thread(target=log_message, args=(self.logging_queue,))
+        self.logging_listener = threading.Thread(target=log_message, args=(self.logging_queue, log_file), daemon=True)
         self.logging_listener.start()
+        self.log = Logger(self.logging_queue, 'recorder')
+
+        # Counters and timings, written to `metrics_file` with the pipeline
+        # statistics and served on localhost:`metrics_port`
+        self.metrics = REGISTRY
+        self.metrics_file = metrics_file
+        if(metrics_port):
+            self.metrics.serve(metrics_port)
+        self.chunk_time = self.metrics.histogram('dsp_chunk_seconds')
+        self.chunk_wait_time = self.metrics.histogram('dsp_chunk_wait_seconds')
+        self.chunks_over_budget = self.metrics.counter('dsp_chunks_over_budget')
+        self.convert_time = self.metrics.histogram('convert_seconds')
+        self.resample_time = self.metrics.histogram('resample_seconds')
+        self.vad_time = self.metrics.histogram('vad_seconds')
+
+        if(validate_torch):
+            self.model = TorchValidator(self.model, self.log.child('vad'))
+
+        # Sampling profiler writing folded stacks, for the first `profile_sec`
+        # seconds and toggled by SIGUSR1; nothing is sampled while it is off
+        self.profile_sec = profile_sec
+        self.profile_dir = profile_dir
+        self.profiler = None
+        if(not input_file):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.toggle_profiler())
+
+        # Settings from `config_file` override the arguments, and changes to
+        # it, camera_positions.json and .env are applied while recording
+        self.config_file = config_file
+        self.pending_settings = None
+        self.collect_samples = False
+        self.config_watcher = ConfigWatcher(self.log.child('config'))
+        if(config_file):
+            if(os.path.exists(config_file)):
+                self.set_settings(load_settings(config_file))
+            self.config_watcher.watch(config_file, load_settings, self.queue_settings)
+
+        # Heartbeat to the status API, when STATUS_API_URL is configured
+        self.status = StatusReporter(self.log.child('status'), interval=status_interval)
+        self.segment_started = None
+        if(self.status.enabled and not input_file):
+            self.status.add_source(self.status_values)
+            self.status.start()
 
-        self.data_queue = queue.Queue()
         # Use tmpfs for temporary file storage (/dev/shm is a dedicated tmpfs mount)
-        self.tmpfs_dir = '/dev/shm/vad_audio'
-        self.save_listener = threading.Thread(target=self.save_audio, args=(self.data_queue, self.logging_queue, self.SAMPLE_RATE, upload, self.tmpfs_dir))
-        self.save_listener.start()
+        self.tmpfs_dir = output_dir
+
+        # Record of saved segments and their uploads, on persistent storage
+        self.catalog = Catalog(catalog_path) if(catalog_path) else None
+
+        self.upload_queue = None
+        if(upload):
+            # Files that cannot be uploaded right away wait in `spill_dir`, so a reboot does not lose them
+            self.upload_queue = UploadQueue(MinioUploader(self.log.child('uploader'), status=self.status, catalog=self.catalog), self.log.child('upload_queue'), upload_manifest, workers=upload_workers, remove_after_upload=not keep_uploaded_hours, persist_dir=spill_dir)
+            self.metrics.gauge('upload_backlog', lambda: self.upload_queue.backlog)
+
+        # Keeps saved segments within a RAM budget, spilling them to
+        # persistent storage while they cannot be uploaded
+        self.spool = Spool(self.tmpfs_dir, self.log.child('spool'), spool_ram_mb * 1024 * 1024, spill_dir, keep_uploaded_hours * 3600, self.upload_queue, catalog=self.catalog)
+        if(not input_file):
+            self.spool.recover()
+            self.spool.start()
+        if(self.upload_queue):
+            self.upload_queue.on_uploaded = self.spool.uploaded
+            self.upload_queue.on_moved = self.spool.moved
+            self.upload_queue.start()
+            if(os.path.exists('.env')):
+                self.config_watcher.watch('.env', load_upload_settings, self.upload_queue.uploader.reconfigure)
 
         # Initialize camera-related attributes
         self.myCam = None
+        self.camera_worker = None
         self.positions = None
 
+        if(not input_file):
+            self.config_watcher.start()
+
         if(not record_video):
             return
         
-        # Try to initialize the camera with retry logic
-        self.logging_queue.put("Initializing camera")
-        max_retries = 5
-        retry_delay = 2  # seconds
-        
-        for attempt in range(max_retries):
-            try:
-                self.myCam = ptz.ptzcam()
-                self.positions = from_json('camera_positions.json')
-                self.move_to(self.positions['prezbiterium'])
-                self.logging_queue.put("Camera initialized successfully")
-                break
-            except Exception as e:
-                if "timed out" in str(e).lower() or "timeout" in str(e).lower():
-                    if attempt < max_retries - 1:
-                        self.logging_queue.put(f"Camera connection timed out, retrying in {retry_delay} seconds... (attempt {attempt + 1}/{max_retries})")
-                        time.sleep(retry_delay)
-                        retry_delay *= 1.5  # Exponential backoff
-                    else:
-                        self.logging_queue.put(f"Failed to connect to camera after {max_retries} attempts: {e}")
-                else:
-                    self.logging_queue.put(f"Failed to instantiate camera: {e}")
+        # The session connects on the camera worker's first move and again
+        # after a failed one, so a missing camera never delays recording;
+        # imported on demand as onvif/zeep are only needed with a camera
+        import ptz
+        self.positions = load_positions('camera_positions.json')
+        self.config_watcher.watch('camera_positions.json', load_positions, self.update_positions)
+        self.myCam = ptz.CameraSession(self.positions, self.log.child('camera'))
+        self.camera_worker = CameraWorker(self.myCam, self.log.child('camera'))
+        self.camera_worker.start()
+        self.move_to('prezbiterium')
+
+    def finish_segment(self, segment):
+        """Encoder stage: finish encoding a closed segment or drop it if too short."""
+        pathname, frames, encoder, meter = segment
+        filename = os.path.basename(encoder.output_path if encoder else pathname)
+        duration = frames / self.SAMPLE_RATE
+        minutes = floor(duration/60)
+        seconds = round(duration % 60)
+
+        if(duration < self.MIN_RECORD_TIME_SEC):
+            self.metrics.counter('segments_discarded').inc()
+            self.log.info(f"Too short speech duration of {seconds}s, it has to be at least {self.MIN_RECORD_TIME_SEC}s. Skipping...", duration=round(duration, 1))
+            os.remove(pathname)
+            if(encoder):
+                encoder.abort()
+            if(self.stream_upload):
+                self.upload_queue.abort_stream(filename)
+            return None
+
+        output_file = pathname
+        if(encoder):
+            output_file = self.finish_encoding(encoder, pathname, frames)
+            filename = os.path.basename(output_file)
+        self.metrics.counter('segments_saved').inc()
+        self.metrics.counter('segment_seconds').inc(duration)
+        self.log.info(f"Saved detected speech of {minutes}m{seconds}s to a file {output_file}", file=output_file, duration=round(duration, 1))
+        statistics = None
+        extra_files = []
+        if(meter):
+            statistics, statistics_file = self.save_statistics(meter, output_file, encoder if output_file != pathname else None)
+            extra_files.append(statistics_file)
+        audio_files = [output_file]
+        if(self.split_channels):
+            audio_files = self.split_segment(output_file)
+            output_file, filename = audio_files[0], os.path.basename(audio_files[0])
+            extra_files += audio_files[1:]
+        if(self.catalog):
+            self.catalog_segment(audio_files, duration, statistics)
+        if(self.upload):
+            return (output_file, filename, extra_files)
+        self.spool.add([output_file] + extra_files)
+        return None
+
+    def upload_segment(self, segment):
+        """Uploader stage: hand a finished segment to the upload queue."""
+        output_file, filename, extra_files = segment
+        if(self.stream_upload and self.upload_queue.streams.get(filename)):
+            self.upload_queue.finish_stream(filename, output_file)
+        else:
+            self.upload_queue.put(output_file, filename)
+        for extra_file in extra_files:
+            self.upload_queue.put(extra_file, os.path.basename(extra_file))
+        self.spool.add([output_file] + extra_files)
+
+    def split_segment(self, pathname, block_frames=65536):
+        """Split a multi-channel WAV segment into one file per channel, named after the source."""
+        import wave
+        base = os.path.splitext(pathname)[0]
+        paths = [f"{base}-{name}.wav" for name in self.channel_names]
+        with wave.open(pathname, 'rb') as source:
+            outputs = [wave.open(path, 'wb') for path in paths]
+            for output in outputs:
+                output.setnchannels(1)
+                output.setsampwidth(self.SAMPLE_WIDTH)
+                output.setframerate(self.SAMPLE_RATE)
+            while True:
+                block = np.frombuffer(source.readframes(block_frames), np.int16).reshape(-1, self.CHANNELS)
+                if not len(block):
                     break
+                for channel, output in enumerate(outputs):
+                    output.writeframes(block[:, channel].tobytes())
+            for output in outputs:
+                output.close()
+        os.remove(pathname)
+        self.log.info(f"Split {pathname} into {', '.join(paths)}", files=paths)
+        return paths
+
+    def save_statistics(self, meter, output_file, encoder):
+        """Write the segment's level statistics to `<segment>.json` and log suspicious levels."""
+        statistics = meter.statistics(self.normalize_lufs)
+        statistics['applied_gain_db'] = round(encoder.gain_db, 2) if encoder else 0.0
+        # Samples the encoder's soft clipper kept below -1 dBFS after the gain
+        statistics['limited_samples'] = encoder.limited_samples if encoder else 0
+        if(statistics['limited_samples']):
+            self.metrics.counter('samples_limited').inc(statistics['limited_samples'])
+        statistics_file = os.path.splitext(output_file)[0] + '.json'
+        with open(statistics_file, 'w') as f:
+            json.dump(statistics, f, indent=2)
+        self.log.info(f"Segment level: {statistics['integrated_lufs']} LUFS, peak {statistics['peak_dbfs']} dBFS, gain {statistics['applied_gain_db']} dB, {statistics['limited_samples']} samples limited", file=output_file, **statistics)
+        if(statistics['clipped']):
+            self.metrics.counter('segments_clipped').inc()
+            self.log.warning(f"{statistics['clipped_samples']} clipped samples in {output_file}, the input gain is too high", file=output_file)
+        if(statistics['near_silent']):
+            self.metrics.counter('segments_near_silent').inc()
+            self.log.warning(f"{output_file} is nearly silent, check the microphone", file=output_file)
+        return statistics, statistics_file
 
-    def save_audio(self, data_queue, logging_queue, sample_rate, upload, folder_name='/dev/shm/vad_audio'):
-        while True:
+    def catalog_segment(self, audio_files, duration, statistics):
+        for audio_file in audio_files:
             try:
-                audio_data, filename = data_queue.get()
-                duration = len(audio_data) / sample_rate * 1000
-                minutes = floor(duration/60)
-                seconds = round(duration % 60)
-                
-                if(duration < self.MIN_RECORD_TIME_SEC):
-                    logging_queue.put(f"Too short speech duration of {seconds}s, it has to be at least {self.MIN_RECORD_TIME_SEC}s. Skipping...")
-                else:
-                    create_folder_if_not_exists(folder_name)
-                    pathname = os.path.join(folder_name, filename)
-                    
-                    with wave.open(pathname, 'wb') as wf:
-                        wf.setnchannels(self.CHANNELS)
-                        wf.setsampwidth(self.audio.get_sample_size(self.FORMAT))
-                        wf.setframerate(self.SAMPLE_RATE)
-                        wf.writeframes(b''.join(audio_data))
-                    
-                    output_file = pathname
-                    logging_queue.put(f"Saved detected speech of {minutes}m{seconds}s to a file {output_file}")
-                    if(upload):
-                        upload_success = upload_file(output_file, os.path.basename(output_file), logging_queue)
-                        if upload_success:
-                            try:
-                                os.remove(output_file)
-                                logging_queue.put(f"Removed local WAV file after successful upload: {output_file}")
-                            except Exception as e:
-                                logging_queue.put(f"Error removing local WAV file {output_file}: {e}")
-                
-                data_queue.task_done()
+                segment_id = self.catalog.add(audio_file, duration=duration, statistics=statistics)
+                self.log.debug(f"Cataloged {audio_file} as segment {segment_id}", file=audio_file, id=segment_id)
             except Exception as e:
-                logging_queue.put(f"Error in save_audio: {e}")
-                data_queue.task_done()
+                self.log.error(f"Could not add {audio_file} to the catalog: {e}", file=audio_file)
 
+    def segment_gain(self, meter):
+        """Normalization gain for the encoder, decided once enough of the segment was metered."""
+        def gain(final=False):
+            if(final or meter.seconds() >= self.normalize_settle_sec):
+                return meter.gain_db(self.normalize_lufs)
+            return None
+        return gain
+
+    def finish_encoding(self, encoder, pathname, frames):
+        try:
+            output_file = encoder.finish(frames * self.CHANNELS * self.SAMPLE_WIDTH)
+        except Exception as e:
+            self.metrics.counter('encoding_failures').inc()
+            self.log.error(f"Encoding {encoder.output_path} failed, keeping the WAV file: {e}", file=encoder.output_path)
+            encoder.abort()
+            if(self.stream_upload):
+                self.upload_queue.abort_stream(os.path.basename(encoder.output_path))
+            return pathname
+        os.remove(pathname)
+        return output_file
 
     def start_recording(self):
-        self.vad_iterator = self.VadIterator(self.model, min_silence_duration_ms=self.min_silence_duration_sec * 1000, threshold=0.9965)
-        self.stream = self.open_stream(self.device_index)
+        adaptive = None
+        if(self.adaptive_vad):
+            adaptive = AdaptiveVad(self.log.child('vad'), min_silence_floor_sec=self.adaptive_min_silence_sec)
+        self.vad_iterator = VadEngine(
+            lambda audio: self.model(audio, self.VAD_TARGET_SAMPLE_RATE),
+            self.model.reset_states,
+            threshold=self.vad_threshold,
+            sampling_rate=self.VAD_TARGET_SAMPLE_RATE,
+            min_silence_duration_ms=self.min_silence_duration_sec * 1000,
+            window_size_samples=self.VAD_WINDOW_SAMPLES,
+            batch_windows=self.vad_batch_windows,
+            gate_dbfs=self.vad_gate_dbfs,
+            adaptive=adaptive
+        )
+        if(adaptive):
+            self.metrics.gauge('vad_threshold', lambda: self.vad_iterator.threshold)
+            self.metrics.gauge('vad_min_silence_seconds', lambda: adaptive.min_silence_sec)
+            self.metrics.gauge('vad_noise_floor_dbfs', lambda: adaptive.noise_floor_db)
+        self.stream = self.open_stream()
+        self.reopen_stream = False
 
-        self.audio_data = []
+        self.segment_writer = SegmentWriter(self.tmpfs_dir, self.CHANNELS, self.SAMPLE_WIDTH, self.SAMPLE_RATE)
         self.collect_samples = False
-        self.padding_s = self.padding_ms/1000
-        self.padding_chunks = int(self.SAMPLE_RATE * self.padding_s / self.CHUNK)
-        self.padding_buffer = deque(maxlen=self.padding_chunks)
-
-        self.logging_queue.put("Listening for voice activity...")
-        while True:
-            speech_dict = self.process_audio_chunk()
-            self.detect_speech_start(speech_dict)
-            self.detect_speech_end(speech_dict)
-
-    def process_audio_chunk(self):
-        audio_chunk = self.stream.read(self.NUM_SAMPLES, exception_on_overflow=False)
-        self.padding_buffer.append(audio_chunk)
+        self.segment_commands = []
+        self.segment_meter = None
+        self.last_segment_stamp = None
+        self.stamp_repeats = 0
+        # Segment boundaries are cut in capture frames at the VAD's timestamps;
+        # the history covers the pre-roll plus the audio the VAD still lags behind
+        self.padding_frames = int(self.SAMPLE_RATE * self.padding_ms / 1000)
+        self.post_roll_frames = int(self.SAMPLE_RATE * self.post_roll_ms / 1000)
+        self.history = RingBuffer(self.padding_frames + self.SAMPLE_RATE, self.CHANNELS)
+
+        # capture -> DSP/VAD -> segment sink -> encoder -> uploader; audio is
+        # never dropped between stages, a full queue blocks its producer
+        pin = self.cpu_pinning
+        timing = lambda name: self.metrics.histogram(f'stage_{name}_seconds')
+        self.pipeline = Pipeline([
+            Stage('capture', self.capture_chunk, cpu=pin.get('capture'), histogram=timing('capture')),
+            Stage('dsp', self.process_chunk, maxsize=64, cpu=pin.get('dsp'), histogram=timing('dsp')),
+            Stage('sink', self.sink_segment, maxsize=256, cpu=pin.get('sink'), histogram=timing('sink'), on_stop=self.close_open_segment),
+            Stage('encoder', self.finish_segment, maxsize=16, cpu=pin.get('encoder'), histogram=timing('encoder')),
+            Stage('uploader', self.upload_segment, maxsize=64, cpu=pin.get('uploader'), histogram=timing('uploader')),
+        ], log=self.log.child('pipeline'))
+
+        for stage in self.pipeline.stages:
+            self.metrics.gauge(f'pipeline_{stage.name}', stage.stats)
+        if(self.capture_mode == 'callback'):
+            self.metrics.gauge('capture_overruns', lambda: self.stream.overruns)
+            self.metrics.gauge('capture_dropped_frames', lambda: self.stream.dropped_frames)
+
+        self.log.info("Listening for voice activity...")
+        if(self.profile_sec):
+            self.start_profiler(self.profile_sec)
+        self.pipeline.start()
+        while self.pipeline.is_alive():
+            self.pipeline.join(self.stats_interval)
+            self.log.info("Pipeline statistics:\n" + self.pipeline.report())
+            self.log.info(self.timing_report())
+            if(self.metrics_file):
+                self.metrics.write(self.metrics_file)
+        if(self.status.is_alive()):
+            self.status.stop()
+        failed = self.pipeline.failed_stage()
+        if(failed):
+            # The stages before it are blocked on it; exit so cron restarts the recorder
+            self.log.error(f"The {failed.name} stage gave up after {failed.max_errors} errors in a row, stopping: {failed.failure!r}", stage=failed.name)
+            self.logging_queue.join()
+            raise RuntimeError(f"{failed.name} stage failed: {failed.failure!r}") from failed.failure
+
+    def capture_chunk(self):
+        """Capture stage: read the next block of audio."""
+        if(self.reopen_stream):
+            self.stream.close()
+            self.stream = self.open_stream()
+            self.reopen_stream = False
+        return self.stream.read(self.NUM_SAMPLES, exception_on_overflow=False)
+
+    def process_chunk(self, audio_chunk):
+        """DSP/VAD stage: run the VAD and turn its events into segment commands."""
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        self.segment_commands = []
+        # Between chunks, and never inside a segment whose hold-back and
+        # padding were sized with the previous values
+        if(self.pending_settings is not None and not self.collect_samples):
+            self.apply_settings()
+        speech_dict = self.process_audio_chunk(audio_chunk)
+        self.detect_speech_start(speech_dict)
+        self.detect_speech_end(speech_dict)
+        elapsed = time.perf_counter() - started
+        self.chunk_time.observe(elapsed)
+        # Time the thread was not running, e.g. waiting for the GIL
+        self.chunk_wait_time.observe(max(0.0, elapsed - (time.thread_time() - cpu_started)))
+        if(elapsed > self.CHUNK_BUDGET_SEC):
+            self.chunks_over_budget.inc()
+        return self.segment_commands or None
+
+    def process_audio_chunk(self, audio_chunk):
+        audio_int16 = self.dsp.load(audio_chunk)
+        self.history.write(audio_int16)
         if(self.collect_samples):
-            self.audio_data.append(audio_chunk)
+            self.segment_commands.append(('write', audio_chunk))
+            if(self.meter):
+                self.meter.push(audio_int16)
 
-        audio_int16 = np.frombuffer(audio_chunk, np.int16)
-        audio_float32 = int2float(audio_int16)
-        tensor_audio_chunk = torch.from_numpy(audio_float32)
-        tensor_audio_chunk_downsampled = functional.resample(tensor_audio_chunk, self.SAMPLE_RATE, self.VAD_TARGET_SAMPLE_RATE)
-        speech_dict = self.vad_iterator(tensor_audio_chunk_downsampled, return_seconds=True)
+        started = time.perf_counter()
+        vad_signal = self.dsp.vad_signal(audio_int16)
+        converted_at = time.perf_counter()
+        resampled = self.resampler.process(vad_signal)
+        resampled_at = time.perf_counter()
+        speech_dict = self.vad_iterator(resampled)
+        self.convert_time.observe(converted_at - started)
+        self.resample_time.observe(resampled_at - converted_at)
+        self.vad_time.observe(time.perf_counter() - resampled_at)
         return speech_dict
 
     def detect_speech_start(self, speech_dict):
         if(speech_dict and 'start' in speech_dict and not self.collect_samples):
-            self.logging_queue.put("Detected speech started.")
+            self.metrics.counter('speech_starts').inc()
+            self.segment_started = time.monotonic()
+            self.status.update(state='recording')
+            start_frame = self.vad_frame(speech_dict['start'])
+            self.log.info("Detected speech started.", start=round(start_frame / self.SAMPLE_RATE, 3), **self.vad_state())
             self.collect_samples = True
-            self.audio_data = list(self.padding_buffer)
-            if(self.myCam):
-                self.move_to(self.positions['ambona'])
+            self.detected_segments.append([round(start_frame / self.SAMPLE_RATE, 1), None])
+            filename = self.segment_filename(start_frame)
+            # Everything from the pre-roll before the detected start up to the
+            # current chunk, which was already written to the history
+            first_frame = max(self.history.oldest_position(), start_frame - self.padding_frames)
+            padding = self.history.read_at(first_frame, self.history.written - first_frame)
+            if(self.loudness):
+                self.meter = self.LoudnessMeter(self.SAMPLE_RATE, self.CHANNELS)
+                self.meter.push(padding.ravel())
+            self.segment_commands.append(('open', filename, padding.tobytes(), self.meter))
+            if(self.camera_worker):
+                self.move_to('ambona')
 
     def detect_speech_end(self, speech_dict):
         if(speech_dict and 'end' in speech_dict and self.collect_samples):
-            filename = 'speech-%s.wav' % datetime.now().strftime('%Y-%-m-%d-%M-%S')
-            trim_ending = (self.min_silence_duration_sec) # as there is min_silence_duration_sec to wait before audio ends
-            trim_ending_chunks = int(self.SAMPLE_RATE * trim_ending / self.CHUNK)
-            self.audio_data = self.audio_data[:-trim_ending_chunks]
-            self.data_queue.put((self.audio_data, filename))
-            self.logging_queue.put("Detected speech ended.")
+            end_frame = self.vad_frame(speech_dict['end'])
+            # The segment holds everything written so far; cut it at the
+            # detected end plus the post-roll
+            trim_frames = max(0, self.history.written - end_frame - self.post_roll_frames)
+            if(self.meter):
+                self.meter.trim(trim_frames)
+            self.segment_commands.append(('close', trim_frames, self.meter))
+            self.meter = None
+            self.detected_segments[-1][1] = round(end_frame / self.SAMPLE_RATE, 1)
+            self.close_delays.append(self.vad_iterator.current_sample / self.VAD_TARGET_SAMPLE_RATE - end_frame / self.SAMPLE_RATE)
+            self.log.info("Detected speech ended.", end=round(end_frame / self.SAMPLE_RATE, 3), trimmed_frames=trim_frames, **self.vad_state())
+            self.segment_started = None
+            self.status.update(state='idle', last_segment_end=time.time())
             self.collect_samples = False
-            self.audio_data = []
-            self.padding_buffer.clear()
-            self.stream.close()
-            self.stream = self.open_stream(self.device_index)
+            if(self.capture_mode == 'callback'):
+                self.log_overruns()
+            elif(not self.input_file):
+                self.reopen_stream = True
+
+            if(self.camera_worker):
+                self.move_to('prezbiterium')
+
+    def sink_segment(self, commands):
+        """Segment sink stage: write speech to disk, start encoding and streaming."""
+        segment = None
+        for command in commands:
+            if(command[0] == 'write'):
+                self.write_segment(command[1])
+            elif(command[0] == 'open'):
+                self.open_segment(command[1], command[2], command[3])
+            elif(command[0] == 'close'):
+                pathname, frames = self.segment_writer.close(command[1])
+                segment = (pathname, frames, self.encoder, command[2])
+                self.encoder = None
+                self.segment_meter = None
+        return segment
+
+    def close_open_segment(self):
+        """When the pipeline stops, e.g. at the end of a replayed file, finish the segment being recorded."""
+        if(not self.segment_writer.recording):
+            return None
+        self.log.info("Recording stopped during speech, saving the segment")
+        pathname, frames = self.segment_writer.close(0)
+        segment = (pathname, frames, self.encoder, self.segment_meter)
+        self.encoder = None
+        self.segment_meter = None
+        return segment
+
+    def open_segment(self, filename, padding, meter=None):
+        self.segment_meter = meter
+        self.segment_writer.open(filename, self.hold_back_frames())
+        upload_path, upload_size = self.segment_writer.pathname, self.segment_writer.stable_size
+        if(self.codec != 'wav'):
+            filename = encoded_filename(filename, self.codec)
+            gain = self.segment_gain(meter) if(meter and self.normalize_lufs is not None) else None
+            self.encoder = SegmentEncoder(self.segment_writer.pathname, os.path.join(self.tmpfs_dir, filename), self.codec, self.SAMPLE_RATE, self.CHANNELS, self.bitrate, gain=gain)
+            self.encoder.start(self.segment_writer.stable_size)
+            upload_path, upload_size = self.encoder.output_path, self.encoder.stable_size
+        if(self.stream_upload):
+            self.upload_queue.begin_stream(upload_path, filename, upload_size)
+        if(self.post_filter):
+            self.post_filter.reset()
+        self.write_segment(padding)
+
+    def write_segment(self, audio_chunk):
+        if(self.post_filter):
+            audio_chunk = self.post_filter.process_bytes(audio_chunk)
+        self.segment_writer.write(audio_chunk)
+
+    def timing_report(self):
+        """Per-chunk steps against the chunk's real-time budget, then the slower stages."""
+        chunk_steps = ['dsp_chunk_seconds', 'convert_seconds', 'resample_seconds', 'vad_seconds', 'dsp_chunk_wait_seconds', 'stage_sink_seconds']
+        other_steps = ['stage_encoder_seconds', 'upload_seconds', 'camera_move_seconds']
+        return "\n".join([budget_report(self.metrics, self.CHUNK_BUDGET_SEC, chunk_steps)] + timing_report(self.metrics, other_steps))
+
+    def start_profiler(self, duration=None):
+        path = os.path.join(self.profile_dir, datetime.now().strftime('profile-%Y%m%d-%H%M%S.folded'))
+        self.profiler = SamplingProfiler(path, duration=duration, log=self.log.child('profiler'))
+        self.profiler.start()
+        self.log.info(f"Profiling into {path}" + (f" for {duration}s" if duration else " until the next SIGUSR1"), file=path)
+
+    def toggle_profiler(self):
+        # Runs in the signal handler; the profiler writes its file on its own thread
+        if(self.profiler and self.profiler.is_alive()):
+            self.profiler.stop(wait=False)
+        else:
+            self.start_profiler()
+
+    def segment_filename(self, start_frame):
+        # A replay runs many times faster than real time, so its segments are
+        # named after their position in the file rather than the clock
+        started = datetime.fromtimestamp(self.stream.start_time + start_frame / self.SAMPLE_RATE) if(self.input_file) else datetime.now()
+        stamp = started.strftime('%Y-%-m-%d-%H-%M-%S')
+        # The name is also the object name of the upload; never reuse one
+        self.stamp_repeats = self.stamp_repeats + 1 if(stamp == self.last_segment_stamp) else 0
+        self.last_segment_stamp = stamp
+        return 'speech-%s%s.wav' % (stamp, f"-{self.stamp_repeats + 1}" if(self.stamp_repeats) else '')
+
+    def vad_state(self):
+        return self.vad_iterator.adaptive.state() if(self.vad_iterator.adaptive) else {}
+
+    def vad_frame(self, vad_sample):
+        # The streaming resampler adds no delay, so VAD sample k is capture frame k * SR / 16000
+        return max(0, int(vad_sample) * self.SAMPLE_RATE // self.VAD_TARGET_SAMPLE_RATE)
 
-            if(self.myCam):
-                self.move_to(self.positions['prezbiterium'])
+    def hold_back_frames(self):
+        # The end is detected min_silence_duration_sec after the speech ends,
+        # plus up to a chunk and a VAD batch of lag; that much may still be trimmed
+        return int(self.SAMPLE_RATE * self.min_silence_duration_sec) + self.SAMPLE_RATE
 
-    def open_stream(self, device_index):
+    def open_stream(self):
+        if(self.input_file):
+            from replay import FileSource
+            return FileSource(self.input_file, channels=self.CHANNELS)
+        self.reported_overruns = 0
+        if(len(self.devices) == 1):
+            return self.open_device(self.devices[0])
+        return MultiDeviceSource([self.open_device(device) for device in self.devices], [self.DEVICE_CHANNELS] * len(self.devices))
+
+    def open_device(self, device_index):
+        if(self.capture_mode == 'callback'):
+            return CallbackCapture(
+                self.audio,
+                device_index,
+                self.SAMPLE_RATE,
+                channels=self.DEVICE_CHANNELS,
+                format=self.FORMAT,
+                frames_per_buffer=self.CHUNK
+            )
         return self.audio.open(
             format=self.FORMAT,
-            channels=self.CHANNELS,
+            channels=self.DEVICE_CHANNELS,
             rate=self.SAMPLE_RATE,
             input=True,
             frames_per_buffer=self.CHUNK,
             input_device_index=int(device_index)
         )
     
-    def move_to(self, position):
-        self.myCam.move_abspantilt(position['pan'], position['tilt'], 1)
-        self.myCam.zoom(position['zoom'], 1) 
+    def log_overruns(self):
+        overruns = self.stream.overruns
+        if(overruns > self.reported_overruns):
+            self.log.warning(f"Capture overruns: {overruns} ({self.stream.dropped_frames} frames dropped by the reader)", overruns=overruns, dropped_frames=self.stream.dropped_frames)
+            self.reported_overruns = overruns
+
+    def status_values(self):
+        """Values read by the status reporter at each post."""
+        segment_started = self.segment_started
+        return {
+            'segment_seconds': round(time.monotonic() - segment_started) if segment_started else 0,
+            'upload_backlog': self.upload_queue.backlog if self.upload_queue else 0,
+        }
+
+    def runtime_settings(self):
+        return {key: getattr(self, attribute) for key, (attribute, *_) in RUNTIME_SETTINGS.items()}
+
+    def set_settings(self, settings):
+        for key, value in settings.items():
+            setattr(self, RUNTIME_SETTINGS[key][0], value)
+
+    def queue_settings(self, settings):
+        """Called by the config watcher; the DSP stage applies the settings between chunks."""
+        changed = changes(self.runtime_settings(), settings)
+        if(not changed):
+            self.log.info(f"{self.config_file} changed, but no setting differs")
+            return
+        if(self.collect_samples):
+            self.log.info(f"Will apply {', '.join(changed)} when the current segment ends")
+        self.pending_settings = settings
+
+    def apply_settings(self):
+        settings, self.pending_settings = self.pending_settings, None
+        changed = changes(self.runtime_settings(), settings)
+        self.set_settings(settings)
+        self.vad_iterator.configure(self.vad_threshold, self.min_silence_duration_sec * 1000, self.vad_gate_dbfs)
+        self.padding_frames = int(self.SAMPLE_RATE * self.padding_ms / 1000)
+        self.post_roll_frames = int(self.SAMPLE_RATE * self.post_roll_ms / 1000)
+        if(self.padding_frames + self.SAMPLE_RATE > self.history.capacity):
+            self.history = self.history.resized(self.padding_frames + self.SAMPLE_RATE)
+        if(changed):
+            self.log.info(f"Applied config changes: {', '.join(changed)}", **settings)
+
+    def update_positions(self, positions):
+        """Called by the config watcher with a validated camera_positions.json."""
+        changed = sorted(name for name in set(positions) | set(self.positions) if positions.get(name) != self.positions.get(name))
+        if(not changed):
+            return
+        self.positions = positions
+        self.myCam.update_presets(positions)
+        self.log.info(f"Camera positions changed: {', '.join(changed)}", positions=changed)
+
+    def move_to(self, name):
+        # Runs on the camera worker thread; capture never waits for the PTZ
+        position = self.positions.get(name)
+        if(position is None):
+            self.log.error(f"No camera position '{name}', not moving the camera", position=name)
+            return
+        self.camera_worker.move_to(name, position)
+
+def check_channels(channels, vad_channel, channel_names):
+    """Raise ValueError unless the VAD channel and channel names fit `channels` captured channels."""
+    if(channels < 1):
+        raise ValueError(f"at least one channel is needed, got {channels}")
+    if(vad_channel != 'mix' and not (isinstance(vad_channel, int) and 0 <= vad_channel < channels)):
+        raise ValueError(f"VAD channel {vad_channel} does not exist, there are {channels} channels (0-{channels - 1})")
+    if(channel_names is not None and len(channel_names) != channels):
+        raise ValueError(f"{len(channel_names)} channel names given for {channels} channels")
+
+def vad_channel(value):
+    if(value == 'mix'):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a channel number or 'mix', got '{value}'")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description='Record audio with voice activity detection (VAD)')
-    parser.add_argument('-d', '--device', help='input device index', required=True)
+    parser.add_argument('-d', '--device', help='input device index, or several separated by commas (e.g. 1,3)', required=True)
+    parser.add_argument('--channels', help='channels to capture from each device', default=1, type=int)
+    parser.add_argument('--vad-channel', help="channel the VAD listens to (0-based), or 'mix' for the average of all channels", default=0, type=vad_channel)
+    parser.add_argument('--split-channels', help='save one file per channel instead of one multi-channel file (WAV only)', action='store_true')
+    parser.add_argument('--channel-names', help='comma-separated names used for --split-channels files, e.g. pulpit,altar', default=None)
     parser.add_argument('-s', '--silence', help='period of silence (in seconds) after which recording gets saved', default=15, type=int)
     parser.add_argument('-u', '--upload', help='should be uploading', action='store_true')
     parser.add_argument('-m', '--min-record-time', help='minimum recording time (in seconds)', default=15, type=int)
+    parser.add_argument('--upload-workers', help='number of concurrent uploads', default=2, type=int)
+    parser.add_argument('--upload-manifest', help='file listing pending uploads, resumed at startup', default='upload_manifest.json')
+    parser.add_argument('--spool-ram-mb', help='tmpfs the saved segments may use before they are evicted or spilled (in MB)', default=256, type=int)
+    parser.add_argument('--spill-dir', help='directory on the SD card or a USB disk for segments that do not fit in the RAM budget', default=None)
+    parser.add_argument('--keep-uploaded-hours', help='keep uploaded segments in tmpfs for this long, as far as the RAM budget allows', default=0, type=float)
+    parser.add_argument('--catalog', help='SQLite catalog of saved segments and their uploads; query it with catalog.py', default='segments.db')
+    parser.add_argument('--stream-upload', help='upload segments in parts while they are still being recorded', action='store_true')
+    parser.add_argument('--codec', help='encode segments while recording before uploading them', choices=['wav', 'flac', 'opus', 'aac'], default='wav')
+    parser.add_argument('--bitrate', help='bitrate for opus/aac, e.g. 48k', default=None)
+    parser.add_argument('--vad-batch', help='512-sample VAD windows per model call (1-3)', choices=[1, 2, 3], default=3, type=int)
+    parser.add_argument('--vad-gate-db', help='skip VAD inference on windows quieter than this level in dBFS', default=-60, type=float)
+    parser.add_argument('--vad-model', help='path to the silero ONNX model', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--validate-torch', help='also run the torch silero model and log where it disagrees (slow, needs torch)', action='store_true')
+    parser.add_argument('--pin', help='pin pipeline stages to CPU cores, e.g. capture=0,dsp=1,sink=2,encoder=3,uploader=3', default=None)
+    parser.add_argument('--stats-interval', help='seconds between pipeline statistics in the log', default=300, type=float)
+    parser.add_argument('--vad-threshold', help='speech probability that starts a segment', default=0.9965, type=float)
+    parser.add_argument('--adaptive-vad', help='raise the VAD thresholds in noise and shorten the closing silence to the speakers\' pauses', action='store_true')
+    parser.add_argument('--adaptive-min-silence', help='shortest closing silence (in seconds) with --adaptive-vad', default=5, type=float)
+    parser.add_argument('--padding-ms', help='audio kept before the detected speech start (in milliseconds)', default=1000, type=int)
+    parser.add_argument('--post-roll-ms', help='audio kept after the detected speech end (in milliseconds)', default=1000, type=int)
+    parser.add_argument('--filter', help='apply the post-processing filter chain (hum notches, high-pass, low boost) while recording', action='store_true')
+    parser.add_argument('--loudness', help='meter level and EBU R128 loudness of each segment into <segment>.json', action='store_true')
+    parser.add_argument('--normalize', help='encode segments at this integrated loudness in LUFS, e.g. -16 (needs --codec other than wav)', default=None, type=float)
+    parser.add_argument('--profile', help='sample the Python stacks for this many seconds from the start into a flamegraph file (folded stacks); SIGUSR1 starts and stops it at any time', default=None, type=float)
+    parser.add_argument('--profile-dir', help='directory for the profile-*.folded files', default='.')
+    parser.add_argument('--log-file', help='also write the log as JSON lines to this file, rotated at 10 MB', default=None)
+    parser.add_argument('--metrics-file', help='write counters and timing histograms as JSON to this file every --stats-interval', default=None)
+    parser.add_argument('--metrics-port', help='serve the metrics as JSON on http://127.0.0.1:PORT/metrics', default=None, type=int)
+    parser.add_argument('--status-interval', help='seconds between posts to the status API (STATUS_API_URL)', default=30, type=float)
+    parser.add_argument('--config', help='JSON file with settings applied on start and whenever it changes (vad_threshold, silence, min_record_time, padding_ms, post_roll_ms, vad_gate_db)', default=None)
     parser.add_argument('-c', '--record-video', help='whether to record video', action='store_true')
+    parser.add_argument('-r', '--sample-rate', help='capture sample rate; 48000 resamples to the VAD rate with an integer 3:1 ratio', choices=[44100, 48000], default=44100, type=int)
+    parser.add_argument('--capture-mode', help='blocking reads, or gapless callback capture into a ring buffer', choices=['blocking', 'callback'], default='blocking')
     args = parser.parse_args()
+    if(args.split_channels and (args.codec != 'wav' or args.stream_upload)):
+        parser.error("--split-channels needs --codec wav and no --stream-upload")
+    channel_names = args.channel_names.split(',') if args.channel_names else None
+    try:
+        check_channels(args.channels * len(args.device.split(',')), args.vad_channel, channel_names)
+    except ValueError as e:
+        parser.error(str(e))
 
     audio_recorder = AudioRecorder(
         device_index=args.device,
         min_silence_duration_sec=args.silence,
         upload=args.upload,
         min_record_time_sec=args.min_record_time,
-        record_video=args.record_video
-    ).start_recording()
+        padding_ms=args.padding_ms,
+        post_roll_ms=args.post_roll_ms,
+        record_video=args.record_video,
+        capture_mode=args.capture_mode,
+        sample_rate=args.sample_rate,
+        upload_workers=args.upload_workers,
+        upload_manifest=args.upload_manifest,
+        spool_ram_mb=args.spool_ram_mb,
+        spill_dir=args.spill_dir,
+        keep_uploaded_hours=args.keep_uploaded_hours,
+        catalog_path=args.catalog,
+        stream_upload=args.stream_upload,
+        codec=args.codec,
+        bitrate=args.bitrate,
+        vad_batch_windows=args.vad_batch,
+        vad_gate_dbfs=args.vad_gate_db,
+        vad_model_path=args.vad_model,
+        validate_torch=args.validate_torch,
+        cpu_pinning=parse_cpu_pinning(args.pin),
+        stats_interval=args.stats_interval,
+        vad_threshold=args.vad_threshold,
+        adaptive_vad=args.adaptive_vad,
+        adaptive_min_silence_sec=args.adaptive_min_silence,
+        post_filter=args.filter,
+        loudness=args.loudness,
+        normalize_lufs=args.normalize,
+        log_file=args.log_file,
+        metrics_file=args.metrics_file,
+        metrics_port=args.metrics_port,
+        status_interval=args.status_interval,
+        channels=args.channels,
+        vad_channel=args.vad_channel,
+        split_channels=args.split_channels,
+        channel_names=channel_names,
+        config_file=args.config,
+        profile_sec=args.profile,
+        profile_dir=args.profile_dir
+    )
+    audio_recorder.start_recording()
@@ -0,0 +1,101 @@
+import queue
+import threading
+import time
+from metrics import REGISTRY
+
+
+class CameraWorker(threading.Thread):
+    """
+    Owns the PTZ camera and executes moves on its own thread, so the audio
+    capture loop only ever enqueues a command and returns immediately.
+
+    Pending moves are collapsed: if several positions are requested while the
+    camera is busy, only the most recent one is executed.
+
+    Args:
+        camera: Object exposing goto(name, position), e.g. ptz.CameraSession
+            or a fake for tests
+        logging_queue: Queue for logging messages
+        move_timeout: Maximum time in seconds a single move may take before
+            it is abandoned
+        settle_time: Time in seconds to wait for newer commands before
+            executing a move, so quick successive requests collapse into one
+        metrics: Registry receiving the camera_move_seconds histogram
+    """
+
+    def __init__(self, camera, logging_queue, move_timeout=10, settle_time=0.5, metrics=REGISTRY):
+        super().__init__(daemon=True)
+        self.camera = camera
+        self.logging_queue = logging_queue
+        self.move_timeout = move_timeout
+        self.settle_time = settle_time
+        self.move_time = metrics.histogram('camera_move_seconds')
+        self.commands = queue.Queue()
+        self.moves_done = 0
+        self.moves_collapsed = 0
+        self.moves_timed_out = 0
+        self._busy = None
+
+    def move_to(self, name, position):
+        """Request a move to a named position; never blocks."""
+        self.commands.put((name, position))
+
+    def stop(self):
+        self.commands.put(None)
+
+    def run(self):
+        while True:
+            command = self.commands.get()
+            if command is None:
+                return
+            if self.settle_time:
+                time.sleep(self.settle_time)
+            command = self._latest(command)
+            if command is None:
+                return
+            self._execute(*command)
+
+    def _latest(self, command):
+        while True:
+            try:
+                newer = self.commands.get_nowait()
+            except queue.Empty:
+                return command
+            if newer is None:
+                return None
+            self.moves_collapsed += 1
+            self.logging_queue.put(f"Camera move to '{command[0]}' superseded by '{newer[0]}'")
+            command = newer
+
+    def _execute(self, name, position):
+        # A previous move that exceeded its timeout may still be talking to
+        # the camera; wait for it rather than issuing overlapping ONVIF calls.
+        if self._busy is not None and self._busy.is_alive():
+            self._busy.join(self.move_timeout)
+            if self._busy.is_alive():
+                self.logging_queue.put(f"Camera still unresponsive, skipping move to '{name}'")
+                return
+
+        errors = []
+        call = threading.Thread(target=self._move, args=(name, position, errors), daemon=True)
+        started = time.monotonic()
+        call.start()
+        call.join(self.move_timeout)
+        elapsed = time.monotonic() - started
+        self.move_time.observe(elapsed)
+
+        if call.is_alive():
+            self._busy = call
+            self.moves_timed_out += 1
+            self.logging_queue.put(f"Camera move to '{name}' timed out after {self.move_timeout}s")
+        elif errors:
+            self.logging_queue.put(f"Camera move to '{name}' failed: {errors[0]}")
+        else:
+            self.moves_done += 1
+            self.logging_queue.put(f"Camera moved to '{name}' in {elapsed:.1f}s")
+
+    def _move(self, name, position, errors):
+        try:
+            self.camera.goto(name, position)
+        except Exception as e:
+            errors.append(e)
@@ -0,0 +1,107 @@
+import threading
+import numpy as np
+import pyaudio
+from ring_buffer import RingBuffer
+
+
+class CallbackCapture:
+    """
+    Captures audio with the PyAudio callback API into a RingBuffer.
+
+    The PortAudio thread only copies each block into preallocated memory, and
+    the stream stays open for the whole session, so no samples are lost
+    between segments. Consumers call read() at their own pace; if they fall
+    more than `buffer_seconds` behind, the skipped frames are counted in
+    `overruns`/`dropped_frames` instead of disappearing silently.
+
+    read() mirrors pyaudio.Stream.read so it can replace a blocking stream.
+    """
+
+    def __init__(self, audio, device_index, sample_rate, channels=1, format=pyaudio.paInt16, frames_per_buffer=1024, buffer_seconds=30):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.ring = RingBuffer(sample_rate * buffer_seconds, channels)
+        self.input_overflows = 0
+        self._data_ready = threading.Event()
+        self.stream = audio.open(
+            format=format,
+            channels=channels,
+            rate=sample_rate,
+            input=True,
+            frames_per_buffer=frames_per_buffer,
+            input_device_index=int(device_index),
+            stream_callback=self._callback
+        )
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        self.ring.write(np.frombuffer(in_data, np.int16))
+        if status & pyaudio.paInputOverflow:
+            self.input_overflows += 1
+        self._data_ready.set()
+        return (None, pyaudio.paContinue)
+
+    @property
+    def overruns(self):
+        return self.ring.overruns + self.input_overflows
+
+    @property
+    def dropped_frames(self):
+        return self.ring.dropped_frames
+
+    def read_frames(self, num_frames, out=None):
+        while self.ring.available() < num_frames:
+            self._data_ready.clear()
+            if self.ring.available() >= num_frames:
+                break
+            self._data_ready.wait(1)
+        return self.ring.read(num_frames, out)
+
+    def read(self, num_frames, exception_on_overflow=False):
+        return self.read_frames(num_frames).tobytes()
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+
+
+class MultiDeviceSource:
+    """
+    Reads the same number of frames from several input streams and
+    interleaves them into one multi-channel chunk, in the order the streams
+    are given. Each device runs on its own clock, so the channels are
+    aligned to the block, not to the sample, and drift slowly over hours.
+
+    read() mirrors pyaudio.Stream.read.
+
+    Args:
+        streams: Opened pyaudio streams or CallbackCaptures
+        channels: Number of channels of each stream
+    """
+
+    def __init__(self, streams, channels):
+        self.streams = streams
+        self.stream_channels = channels
+        self.channels = sum(channels)
+        self.buffer = np.zeros((0, self.channels), dtype=np.int16)
+
+    def read(self, num_frames, exception_on_overflow=False):
+        if len(self.buffer) != num_frames:
+            self.buffer = np.zeros((num_frames, self.channels), dtype=np.int16)
+        column = 0
+        for stream, channels in zip(self.streams, self.stream_channels):
+            data = stream.read(num_frames, exception_on_overflow=exception_on_overflow)
+            self.buffer[:, column:column + channels] = np.frombuffer(data, np.int16).reshape(-1, channels)
+            column += channels
+        return self.buffer.tobytes()
+
+    @property
+    def overruns(self):
+        return sum(getattr(stream, 'overruns', 0) for stream in self.streams)
+
+    @property
+    def dropped_frames(self):
+        return sum(getattr(stream, 'dropped_frames', 0) for stream in self.streams)
+
+    def close(self):
+        for stream in self.streams:
+            stream.close()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    path TEXT,
+    day TEXT,
+    recorded_at REAL,
+    duration REAL,
+    integrated_lufs REAL,
+    peak_dbfs REAL,
+    size INTEGER,
+    sha256 TEXT,
+    state TEXT NOT NULL DEFAULT 'saved',
+    bucket TEXT,
+    etag TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    uploaded_at REAL
+);
+CREATE INDEX IF NOT EXISTS segments_day ON segments (day);
+CREATE INDEX IF NOT EXISTS segments_sha256 ON segments (sha256);
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    checked_at REAL
+);
+"""
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Catalog:
+    """
+    Local SQLite record of every saved segment and its upload.
+
+    A row per file holds its name in the bucket, current path, duration,
+    loudness, size, SHA-256 and upload state with the object's ETag, so a
+    restart knows what was uploaded without listing the bucket, identical
+    content is never sent twice and a failed upload can be retried by id.
+    Buckets known to exist are remembered as well. One connection in WAL
+    mode is shared by the recorder's threads.
+
+    Args:
+        path: SQLite database file; keep it on persistent storage
+    """
+
+    def __init__(self, path='segments.db'):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def add(self, path, filename=None, duration=None, statistics=None, recorded_at=None):
+        """Record a saved file, hashing its content; returns the row id."""
+        filename = filename or os.path.basename(path)
+        statistics = statistics or {}
+        recorded_at = recorded_at or time.time() - (duration or 0)
+        self._execute("""
+            INSERT INTO segments (filename, path, day, recorded_at, duration, integrated_lufs, peak_dbfs, size, sha256)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (filename) DO UPDATE SET path = excluded.path, day = excluded.day, recorded_at = excluded.recorded_at,
+                duration = excluded.duration, integrated_lufs = excluded.integrated_lufs, peak_dbfs = excluded.peak_dbfs,
+                size = excluded.size, sha256 = excluded.sha256, state = 'saved', etag = NULL
+            """, (filename, path, datetime.fromtimestamp(recorded_at).strftime('%Y-%m-%d'), recorded_at, duration,
+                  statistics.get('integrated_lufs'), statistics.get('peak_dbfs'), os.path.getsize(path), file_sha256(path)))
+        return self.get(filename)['id']
+
+    def get(self, key):
+        """Row by id or by filename in the bucket."""
+        column = 'id' if isinstance(key, int) else 'filename'
+        rows = self._execute(f"SELECT * FROM segments WHERE {column} = ?", (key,))
+        return rows[0] if rows else None
+
+    def digest(self, path, filename):
+        """SHA-256 of a file, reused from the catalog while its size is unchanged."""
+        row = self.get(filename)
+        size = os.path.getsize(path)
+        if row and row['sha256'] and row['size'] == size:
+            if row['path'] != path:
+                self._execute("UPDATE segments SET path = ? WHERE id = ?", (path, row['id']))
+            return row['sha256']
+        sha256 = file_sha256(path)
+        self._execute("""
+            INSERT INTO segments (filename, path, day, recorded_at, size, sha256) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (filename) DO UPDATE SET path = excluded.path, size = excluded.size, sha256 = excluded.sha256
+            """, (filename, path, datetime.now().strftime('%Y-%m-%d'), time.time(), size, sha256))
+        return sha256
+
+    def find_uploaded(self, sha256, bucket, filename):
+        """An uploaded object with this content, preferring the one named `filename`."""
+        rows = self._execute("SELECT * FROM segments WHERE sha256 = ? AND bucket = ? AND state = 'uploaded' ORDER BY filename = ? DESC, uploaded_at",
+                             (sha256, bucket, filename))
+        return rows[0] if rows else None
+
+    def moved(self, old_path, new_path):
+        self._execute("UPDATE segments SET path = ? WHERE path = ?", (new_path, old_path))
+
+    def upload_started(self, filename):
+        self._execute("UPDATE segments SET state = 'uploading', attempts = attempts + 1 WHERE filename = ?", (filename,))
+
+    def uploaded(self, filename, bucket, etag):
+        self._execute("UPDATE segments SET state = 'uploaded', bucket = ?, etag = ?, error = NULL, uploaded_at = ? WHERE filename = ?",
+                      (bucket, etag, time.time(), filename))
+
+    def upload_failed(self, filename, error):
+        self._execute("UPDATE segments SET state = 'failed', error = ? WHERE filename = ?", (str(error), filename))
+
+    def knows_bucket(self, bucket):
+        return bool(self._execute("SELECT 1 FROM buckets WHERE name = ?", (bucket,)))
+
+    def bucket_checked(self, bucket):
+        self._execute("INSERT OR REPLACE INTO buckets (name, checked_at) VALUES (?, ?)", (bucket, time.time()))
+
+    def forget_bucket(self, bucket):
+        self._execute("DELETE FROM buckets WHERE name = ?", (bucket,))
+
+    def recorded_on(self, day):
+        """Segments recorded on `day` (YYYY-MM-DD), oldest first."""
+        return self._execute("SELECT * FROM segments WHERE day = ? AND duration IS NOT NULL ORDER BY recorded_at", (day,))
+
+    def not_uploaded(self):
+        return self._execute("SELECT * FROM segments WHERE state != 'uploaded' ORDER BY recorded_at")
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+def format_row(row):
+    started = datetime.fromtimestamp(row['recorded_at']).strftime('%H:%M:%S') if row['recorded_at'] else '-'
+    duration = f"{row['duration'] / 60:5.1f} min" if row['duration'] is not None else '        -'
+    loudness = f"{row['integrated_lufs']:6.1f} LUFS" if row['integrated_lufs'] is not None else '          -'
+    error = f"  ({row['error']})" if row['state'] == 'failed' and row['error'] else ''
+    return f"{row['id']:6d}  {started}  {duration}  {loudness}  {row['state']:<9} {row['filename']}{error}"
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Query the local catalog of recorded segments')
+    parser.add_argument('--db', help='catalog database', default='segments.db')
+    commands = parser.add_subparsers(dest='command', required=True)
+    day = commands.add_parser('day', help='segments recorded on a date')
+    day.add_argument('date', nargs='?', help='YYYY-MM-DD (default: today)', default=None)
+    commands.add_parser('pending', help='files that are not uploaded yet')
+    retry = commands.add_parser('retry', help='upload a file again by its catalog id')
+    retry.add_argument('id', type=int)
+    args = parser.parse_args()
+
+    catalog = Catalog(args.db)
+    if args.command == 'day':
+        rows = catalog.recorded_on(args.date or datetime.now().strftime('%Y-%m-%d'))
+        for row in rows:
+            print(format_row(row))
+        print(f"{len(rows)} segments, {sum(row['duration'] for row in rows) / 60:.1f} min")
+    elif args.command == 'pending':
+        for row in catalog.not_uploaded():
+            print(format_row(row))
+    elif args.command == 'retry':
+        import queue
+        from file_uploader import MinioUploader
+        from log import log_message
+        row = catalog.get(args.id)
+        if row is None:
+            parser.error(f"no segment with id {args.id}")
+        if not row['path'] or not os.path.exists(row['path']):
+            parser.error(f"{row['filename']} is no longer at {row['path']}")
+        logging_queue = queue.Queue()
+        threading.Thread(target=log_message, args=(logging_queue,), daemon=True).start()
+        success = MinioUploader(logging_queue, catalog=catalog).upload(row['path'], row['filename'])
+        logging_queue.join()
+        print(format_row(catalog.get(args.id)))
+        raise SystemExit(0 if success else 1)
@@ -0,0 +1,144 @@
+import os
+import threading
+from dotenv import dotenv_values
+from helpers import from_json
+from log import as_logger
+
+# Settings of the recorder that can change while it runs: key in the config
+# file -> (AudioRecorder attribute, type, minimum, maximum)
+RUNTIME_SETTINGS = {
+    'vad_threshold': ('vad_threshold', float, 0.0, 1.0),
+    'silence': ('min_silence_duration_sec', float, 0.5, 3600),
+    'min_record_time': ('MIN_RECORD_TIME_SEC', float, 0, 3600),
+    'padding_ms': ('padding_ms', int, 0, 60000),
+    'post_roll_ms': ('post_roll_ms', int, 0, 60000),
+    'vad_gate_db': ('vad_gate_dbfs', float, -120, 0),
+}
+
+# Camera positions the recorder moves to; camera_positions.json must have them
+CAMERA_POSITIONS = ('prezbiterium', 'ambona')
+
+UPLOAD_SETTINGS = ('MINIO_URL', 'MINIO_ACCESSKEY', 'MINIO_SECRETKEY', 'MINIO_BUCKET_NAME')
+
+
+def load_settings(path):
+    """Read and validate a runtime config file; raises ValueError if it is not valid."""
+    try:
+        settings = from_json(path)
+    except ValueError as e:
+        raise ValueError(f"not valid JSON: {e}")
+    if not isinstance(settings, dict):
+        raise ValueError("expected a JSON object")
+    validated = {}
+    for key, value in settings.items():
+        if key not in RUNTIME_SETTINGS:
+            raise ValueError(f"unknown setting '{key}', expected one of {', '.join(RUNTIME_SETTINGS)}")
+        attribute, kind, minimum, maximum = RUNTIME_SETTINGS[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or (kind is int and value != int(value)):
+            raise ValueError(f"{key} must be {'an integer' if kind is int else 'a number'}, got {value!r}")
+        if not minimum <= value <= maximum:
+            raise ValueError(f"{key} must be between {minimum} and {maximum}, got {value}")
+        validated[key] = kind(value)
+    return validated
+
+
+def load_positions(path):
+    """Read and validate camera_positions.json; raises ValueError if it is not valid."""
+    try:
+        positions = from_json(path)
+    except ValueError as e:
+        raise ValueError(f"not valid JSON: {e}")
+    if not isinstance(positions, dict) or not positions:
+        raise ValueError("expected an object of named positions")
+    missing = [name for name in CAMERA_POSITIONS if name not in positions]
+    if missing:
+        raise ValueError(f"missing position {', '.join(missing)}, the recorder moves to {', '.join(CAMERA_POSITIONS)}")
+    for name, position in positions.items():
+        if not isinstance(position, dict):
+            raise ValueError(f"position '{name}' must be an object with pan, tilt and zoom")
+        for axis, minimum in (('pan', -1), ('tilt', -1), ('zoom', 0)):
+            value = position.get(axis)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not minimum <= value <= 1:
+                raise ValueError(f"{axis} of position '{name}' must be a number between {minimum} and 1, got {value!r}")
+    return positions
+
+
+def load_upload_settings(path):
+    """Read the MinIO settings from a .env file; raises ValueError if any is missing."""
+    values = dotenv_values(path)
+    settings = {key: values.get(key) for key in UPLOAD_SETTINGS}
+    missing = [key for key, value in settings.items() if not value]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    if not settings['MINIO_URL'].startswith(('http://', 'https://')):
+        raise ValueError(f"MINIO_URL must start with http:// or https://, got {settings['MINIO_URL']}")
+    return settings
+
+
+def changes(old, new):
+    """Keys whose value differs, as 'key old -> new' for the log."""
+    return [f"{key} {old.get(key)} -> {value}" for key, value in new.items() if old.get(key) != value]
+
+
+class ConfigWatcher(threading.Thread):
+    """
+    Polls config files and hands their new content to the recorder.
+
+    Every `interval` seconds the modification time and size of each watched
+    file are compared with the last ones seen. When a file changed it is
+    read with its `load` function, which validates it and raises ValueError
+    (or OSError) if it cannot be used; the previous configuration then stays
+    in place and the error is logged. Valid content is passed to `apply`.
+    Editing a file in place or replacing it both count as a change; a file
+    that is missing is skipped until it appears.
+
+    Args:
+        logging_queue: Queue or Logger for logging messages
+        interval: Seconds between checks
+    """
+
+    def __init__(self, logging_queue, interval=2):
+        super().__init__(name='config', daemon=True)
+        self.log = as_logger(logging_queue, 'config')
+        self.interval = interval
+        self.watched = {}
+        self.reloads = 0
+        self.rejected = 0
+        self._stopped = threading.Event()
+
+    def watch(self, path, load, apply):
+        """Watch `path` from its current state on; call apply(load(path)) whenever it changes."""
+        self.watched[path] = (signature(path), load, apply)
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            for path, (seen, load, apply) in list(self.watched.items()):
+                current = signature(path)
+                if current is None or current == seen:
+                    continue
+                self.watched[path] = (current, load, apply)
+                self.reload(path, load, apply)
+
+    def reload(self, path, load, apply):
+        try:
+            value = load(path)
+        except (OSError, ValueError) as e:
+            self.rejected += 1
+            self.log.error(f"Ignoring the changed {path}: {e}", file=path)
+            return
+        self.reloads += 1
+        try:
+            apply(value)
+        except Exception as e:
+            self.log.error(f"Could not apply the changed {path}: {e}", file=path)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import numpy as np
+from helpers import int2float
+
+
+class DspContext:
+    """
+    Reusable buffers for the per-chunk path from captured bytes to VAD input.
+
+    The captured bytes are copied into an int16 buffer, converted in place
+    into a float32 buffer and resampled into the resampler's own output
+    buffer, so once the buffers have grown to the chunk size no array is
+    allocated per chunk. Returned arrays are views that stay valid until the
+    next chunk is loaded.
+
+    Multi-channel chunks are reduced to the one signal the VAD runs on:
+    either a single channel or the average of all of them.
+
+    Args:
+        resampler: StreamingResampler from the capture rate to the VAD rate
+        chunk_frames: Frames per captured chunk; longer chunks grow the buffers
+        channels: Interleaved channels per frame
+        vad_channel: Channel index fed to the VAD, or 'mix'
+    """
+
+    def __init__(self, resampler, chunk_frames, channels=1, vad_channel=0):
+        self.resampler = resampler
+        self.channels = channels
+        self.vad_channel = vad_channel
+        self._allocate(chunk_frames)
+
+    def _allocate(self, frames):
+        self.int16 = np.zeros(frames * self.channels, dtype=np.int16)
+        self.float32 = np.zeros(frames, dtype=np.float32)
+        self.mix = np.zeros(frames, dtype=np.float32)
+        self._bytes = memoryview(self.int16).cast('B')
+
+    def load(self, audio_chunk):
+        """Copy a chunk of captured int16 bytes into the buffer and return its interleaved samples."""
+        samples = len(audio_chunk) // 2
+        if samples > len(self.int16):
+            self._allocate(samples // self.channels)
+        self._bytes[:2 * samples] = audio_chunk
+        return self.int16[:samples]
+
+    def resample(self, samples):
+        """Scale the VAD signal of int16 samples to float32 and resample it to the VAD rate."""
+        return self.resampler.process(self.vad_signal(samples))
+
+    def vad_signal(self, samples):
+        """The channel or mix the VAD runs on, scaled to float32 in the reused buffer."""
+        if self.channels == 1:
+            return int2float(samples, out=self.float32[:len(samples)])
+
+        frames = samples.reshape(-1, self.channels)
+        float32 = self.float32[:len(frames)]
+        if self.vad_channel != 'mix':
+            return int2float(frames[:, self.vad_channel], out=float32)
+        mix = self.mix[:len(frames)]
+        np.copyto(float32, frames[:, 0], casting='safe')
+        for channel in range(1, self.channels):
+            np.copyto(mix, frames[:, channel], casting='safe')
+            float32 += mix
+        float32 *= 1 / (32768 * self.channels)
+        return float32
+
+
+def _benchmark(seconds, chunk, sample_rate):
+    import gc
+    import time
+    import tracemalloc
+    from resampler import StreamingResampler
+    from vad_engine import VadEngine
+
+    rng = np.random.default_rng(0)
+    signal = (rng.standard_normal(int(seconds * sample_rate)) * 3000).astype(np.int16)
+    chunks = [signal[i:i + chunk].tobytes() for i in range(0, len(signal) - chunk + 1, chunk)]
+
+    def previous_path():
+        # The per-chunk path as it was: a new view, an abs-max scan, a float
+        # copy, a freshly allocated resampler output and a growing VAD queue
+        resampler = StreamingResampler(sample_rate, 16000)
+        pending = np.zeros(0, dtype=np.float32)
+
+        def run(audio_chunk):
+            nonlocal pending
+            audio_int16 = np.frombuffer(audio_chunk, np.int16)
+            abs_max = np.abs(audio_int16).max()
+            audio_float32 = audio_int16.astype('float32')
+            if abs_max > 0:
+                audio_float32 *= 1/32768
+            pending = np.concatenate((pending, resampler(audio_float32.squeeze())))
+            while len(pending) >= 1536:
+                batch, pending = pending[:1536], pending[1536:]
+                np.sqrt(np.mean(batch.reshape(-1, 512) ** 2, axis=1))
+        return run
+
+    def context_path():
+        dsp = DspContext(StreamingResampler(sample_rate, 16000), chunk)
+        vad = VadEngine(lambda audio: 0.0, lambda: None, gate_dbfs=-60)
+
+        def run(audio_chunk):
+            vad(dsp.resample(dsp.load(audio_chunk)))
+        return run
+
+    print(f"{len(chunks)} chunks of {chunk} frames at {sample_rate} Hz, VAD inference stubbed out")
+    for label, make in (('previous path', previous_path), ('DspContext', context_path)):
+        run = make()
+        for audio_chunk in chunks[:50]:
+            run(audio_chunk)
+
+        collections = sum(stat['collections'] for stat in gc.get_stats())
+        latencies = np.zeros(len(chunks))
+        for i, audio_chunk in enumerate(chunks):
+            started = time.perf_counter()
+            run(audio_chunk)
+            latencies[i] = time.perf_counter() - started
+        collections = sum(stat['collections'] for stat in gc.get_stats()) - collections
+
+        tracemalloc.start()
+        transient = 0
+        for audio_chunk in chunks[:1000]:
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            run(audio_chunk)
+            transient += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+
+        print(f"{label:<14} median {np.median(latencies) * 1e6:7.1f} us, p99 {np.percentile(latencies, 99) * 1e6:7.1f} us per chunk, "
+              f"{transient / min(len(chunks), 1000):8.0f} bytes allocated per chunk (peak), {collections} GC collections")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the per-chunk DSP path with and without preallocated buffers')
+    parser.add_argument('-s', '--seconds', help='length of the synthetic test signal', default=600, type=float)
+    parser.add_argument('-c', '--chunk', help='frames per chunk', default=1536, type=int)
+    parser.add_argument('-r', '--sample-rate', help='capture sample rate', default=44100, type=int)
+    args = parser.parse_args()
+    _benchmark(args.seconds, args.chunk, args.sample_rate)
@@ -0,0 +1,182 @@
+import os
+import subprocess
+import threading
+import numpy as np
+from segment_writer import WAV_HEADER_SIZE
+
+# codec: (file extension, ffmpeg arguments or None for in-process FLAC, default bitrate)
+CODECS = {
+    'flac': ('.flac', None, None),
+    'opus': ('.opus', ['-c:a', 'libopus', '-application', 'voip'], '48k'),
+    'aac': ('.m4a', ['-c:a', 'aac'], '96k'),
+}
+
+
+def encoded_filename(filename, codec):
+    return os.path.splitext(filename)[0] + CODECS[codec][0]
+
+
+class SegmentEncoder:
+    """
+    Encodes a segment while it is being recorded.
+
+    The encoder follows the WAV file written by SegmentWriter and only reads
+    the part of it that can no longer be trimmed, so the encoded output never
+    contains the trailing silence. FLAC is encoded in-process with
+    soundfile; Opus and AAC are piped into a single ffmpeg process that
+    lives as long as the segment. When speech ends, only the held back tail
+    remains to be encoded.
+
+    A single gain can be applied while encoding. `gain` is called with
+    `final=False` before each read and returns None until the loudness of
+    the segment is known well enough; nothing is encoded until then. At the
+    latest it is called with `final=True` when the segment ends. The first
+    value returned is used for the whole segment. As it is decided from the
+    start of the segment, a louder passage later on may exceed full scale;
+    while a gain above 0 dB is applied, samples above `max_peak_dbfs - 2`
+    dB are soft-clipped so they stay below `max_peak_dbfs`, and counted in
+    `limited_samples`.
+
+    Args:
+        source_path: WAV file being written
+        output_path: Encoded file to create
+        codec: One of CODECS
+        sample_rate: Frames per second of the source
+        channels: Number of channels of the source
+        bitrate: Target bitrate for lossy codecs, e.g. '48k'
+        poll_interval: Seconds between reads of newly stable audio
+        gain: Callable returning the gain in dB, or None to apply no gain
+        max_peak_dbfs: Ceiling of the soft clipper
+    """
+
+    def __init__(self, source_path, output_path, codec, sample_rate, channels=1, bitrate=None, poll_interval=1, gain=None, max_peak_dbfs=-1.0):
+        self.output_path = output_path
+        self.codec = codec
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.bitrate = bitrate or CODECS[codec][2]
+        self.poll_interval = poll_interval
+        self.gain = gain
+        self.gain_db = None if gain else 0.0
+        self.gain_factor = 1.0
+        self.ceiling = 32768 * 10 ** (max_peak_dbfs / 20)
+        self.knee = 32768 * 10 ** ((max_peak_dbfs - 2) / 20)
+        self.limited_samples = 0
+        self.frame_size = 2 * channels
+        # The handle stays valid when SegmentWriter renames the file
+        self.source = open(source_path, 'rb')
+        self.source.seek(WAV_HEADER_SIZE)
+        self.offset = WAV_HEADER_SIZE
+        self.process = None
+        self.sound_file = None
+        self._finished = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, stable_size):
+        # The backend is opened on the encoder thread so that spawning ffmpeg
+        # does not delay the caller
+        self._thread = threading.Thread(target=self._follow, args=(stable_size,), daemon=True)
+        self._thread.start()
+
+    def _open_backend(self):
+        _, ffmpeg_args, _ = CODECS[self.codec]
+        if ffmpeg_args is None:
+            import soundfile
+            self.sound_file = soundfile.SoundFile(self.output_path, 'w', self.sample_rate, self.channels, format='FLAC', subtype='PCM_16')
+        else:
+            cmd = [
+                'ffmpeg', '-loglevel', 'error',
+                '-f', 's16le', '-ar', str(self.sample_rate), '-ac', str(self.channels), '-i', 'pipe:0',
+                *ffmpeg_args, '-b:a', self.bitrate,
+                '-y', self.output_path
+            ]
+            self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def stable_size(self):
+        """Bytes of the encoded file written so far."""
+        try:
+            return os.path.getsize(self.output_path)
+        except OSError:
+            return 0
+
+    def finish(self, data_size):
+        """Encode the rest of the `data_size` bytes of PCM and close the output."""
+        self._stop()
+        self._resolve_gain(final=True)
+        self._feed(WAV_HEADER_SIZE + data_size)
+        self.source.close()
+        if self.sound_file is not None:
+            self.sound_file.close()
+        else:
+            self.process.stdin.close()
+            error = self.process.stderr.read().decode(errors='replace')
+            if self.process.wait() != 0:
+                raise RuntimeError(f"ffmpeg exited with code {self.process.returncode}: {error.strip()}")
+        return self.output_path
+
+    def abort(self):
+        self._stop()
+        self.source.close()
+        if self.sound_file is not None:
+            self.sound_file.close()
+        elif self.process is not None:
+            self.process.kill()
+            self.process.wait()
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+    def _stop(self):
+        self._finished.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _follow(self, stable_size):
+        self._open_backend()
+        while not self._finished.wait(self.poll_interval):
+            self._feed(stable_size())
+
+    def _resolve_gain(self, final=False):
+        if self.gain_db is None:
+            self.gain_db = self.gain(final=final)
+            if self.gain_db is not None:
+                self.gain_factor = 10 ** (self.gain_db / 20)
+        return self.gain_db is not None
+
+    def _apply_gain(self, data):
+        if self.gain_factor == 1.0:
+            return data
+        samples = np.frombuffer(data, np.int16) * self.gain_factor
+        if self.gain_factor > 1.0:
+            over = np.abs(samples) > self.knee
+            if over.any():
+                self.limited_samples += int(np.count_nonzero(over))
+                loud = samples[over]
+                # tanh knee: slope 1 at the knee, never reaching the ceiling
+                headroom = self.ceiling - self.knee
+                samples[over] = np.copysign(self.knee + headroom * np.tanh((np.abs(loud) - self.knee) / headroom), loud)
+        return np.clip(np.round(samples), -32768, 32767).astype(np.int16).tobytes()
+
+    def _feed(self, end):
+        with self._lock:
+            if not self._resolve_gain():
+                return
+            while self.offset < end:
+                size = min(end - self.offset, 1 << 20)
+                size -= size % self.frame_size
+                if size <= 0:
+                    return
+                data = self.source.read(size)
+                partial = len(data) % self.frame_size
+                if partial:
+                    self.source.seek(-partial, os.SEEK_CUR)
+                    data = data[:-partial]
+                if not data:
+                    return
+                self.offset += len(data)
+                data = self._apply_gain(data)
+                if self.sound_file is not None:
+                    self.sound_file.write(np.frombuffer(data, np.int16).reshape(-1, self.channels))
+                    self.sound_file.flush()
+                else:
+                    self.process.stdin.write(data)
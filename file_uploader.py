@@ -1,13 +1,326 @@
 #!/usr/bin/env python3
 import time
 import os
+import json
+import random
 import queue
 import threading
-from log import log_message
+from log import Logger, as_logger, log_message
+from metrics import REGISTRY
 from dotenv import load_dotenv
 from minio import Minio
+from minio.commonconfig import CopySource
+from minio.datatypes import Part
 from minio.error import S3Error
 
+
+class MinioUploader:
+    """
+    Uploads files to MinIO through one long-lived client.
+
+    The client is created and the bucket checked on first use only, and
+    failed attempts are retried with jittered exponential backoff.
+
+    Args:
+        logging_queue: Queue or Logger for logging messages
+        retry_interval: Base time to wait between retries in seconds
+        max_attempts: Number of attempts per upload
+        max_retry_interval: Upper bound of the backoff in seconds
+        client: Optional pre-built client (e.g. a fake for tests)
+        bucket_name: Bucket to upload to, defaults to MINIO_BUCKET_NAME
+        metrics: MetricsRegistry receiving upload counters and timings
+        status: Optional StatusReporter told about finished and failed uploads
+        catalog: Optional catalog.Catalog; uploads of content already in the
+            bucket are skipped or copied server-side, and states, ETags and
+            known buckets are recorded
+    """
+
+    def __init__(self, logging_queue, retry_interval=30, max_attempts=10, max_retry_interval=600, client=None, bucket_name=None, metrics=REGISTRY, status=None, catalog=None):
+        load_dotenv()
+        self.log = as_logger(logging_queue, 'uploader')
+        self.metrics = metrics
+        self.status = status
+        self.catalog = catalog
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self.max_retry_interval = max_retry_interval
+        self.bucket_name = bucket_name or os.environ.get("MINIO_BUCKET_NAME")
+        self._client = client
+        self._bucket_checked = False
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                minio_url = os.environ.get("MINIO_URL")
+                self._client = Minio(
+                    minio_url.replace("http://", "").replace("https://", ""),
+                    access_key=os.environ.get("MINIO_ACCESSKEY"),
+                    secret_key=os.environ.get("MINIO_SECRETKEY"),
+                    secure=minio_url.startswith("https")
+                )
+            return self._client
+
+    def reconfigure(self, settings):
+        """Use new MINIO_* settings; the client is made again and the bucket checked by the next request."""
+        with self._lock:
+            os.environ.update(settings)
+            self.bucket_name = settings['MINIO_BUCKET_NAME']
+            self._client = None
+            self._bucket_checked = False
+        self.log.info(f"Uploading to {settings['MINIO_URL']} bucket {self.bucket_name} from now on", bucket=self.bucket_name)
+
+    def ensure_bucket(self):
+        if self._bucket_checked:
+            return
+        if self.catalog and self.catalog.knows_bucket(self.bucket_name):
+            self._bucket_checked = True
+            return
+        found = self.client.bucket_exists(self.bucket_name)
+        if not found:
+            self.client.make_bucket(self.bucket_name)
+            self.log.info(f"Created bucket {self.bucket_name}", bucket=self.bucket_name)
+        else:
+            self.log.info(f"Bucket {self.bucket_name} already exists", bucket=self.bucket_name)
+        self._bucket_checked = True
+        if self.catalog:
+            self.catalog.bucket_checked(self.bucket_name)
+
+    def deduplicate(self, filepath, target_name):
+        """
+        Finish the upload from the catalog if the same content is already
+        in the bucket: skip it if it is there under this name, copy it on
+        the server otherwise. Returns True if nothing needs to be sent.
+        """
+        sha256 = self.catalog.digest(filepath, target_name)
+        existing = self.catalog.find_uploaded(sha256, self.bucket_name, target_name)
+        if existing is None:
+            return False
+        if existing['filename'] == target_name:
+            self.log.info(f"{target_name} is already uploaded, skipping it", file=filepath, etag=existing['etag'])
+            etag = existing['etag']
+        else:
+            self.ensure_bucket()
+            result = self.client.copy_object(self.bucket_name, target_name, CopySource(self.bucket_name, existing['filename']))
+            etag = result.etag
+            self.log.info(f"{target_name} has the same content as {existing['filename']}, copied it in the bucket", file=filepath, source=existing['filename'])
+        self.metrics.counter('uploads_deduplicated').inc()
+        self.catalog.uploaded(target_name, self.bucket_name, etag)
+        return True
+
+    def backoff(self, attempt):
+        delay = min(self.max_retry_interval, self.retry_interval * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
+
+    def upload(self, filepath, target_name):
+        """
+        Upload a file with retries.
+
+        Args:
+            filepath: Path to the file to upload
+            target_name: Name of the file in the MinIO bucket
+
+        Returns:
+            True if the upload succeeded
+        """
+        for attempt_count in range(1, self.max_attempts + 1):
+            if self.attempt(filepath, target_name, attempt_count):
+                return True
+            if attempt_count < self.max_attempts:
+                time.sleep(self.retry_delay(filepath, attempt_count))
+        self.give_up(filepath, target_name)
+        return False
+
+    def attempt(self, filepath, target_name, attempt_count=1):
+        """Make one upload attempt without retrying; returns True if it succeeded."""
+        try:
+            if self.catalog:
+                if self.deduplicate(filepath, target_name):
+                    return True
+                self.catalog.upload_started(target_name)
+            self.ensure_bucket()
+            self.log.info(f"Uploading {filepath} to {self.bucket_name}/{target_name} (attempt {attempt_count})", file=filepath, attempt=attempt_count)
+            started = time.monotonic()
+            if os.path.exists(MultipartUpload.state_path_for(filepath, target_name)):
+                # Resume a streamed upload that was interrupted
+                multipart = MultipartUpload(self, filepath, target_name)
+                result = multipart.complete(os.path.getsize(filepath))
+            else:
+                result = self.client.fput_object(
+                    self.bucket_name,
+                    target_name,
+                    filepath,
+                    content_type=content_type_for(target_name)
+                )
+            self.record_upload(filepath, target_name, time.monotonic() - started)
+            if self.catalog:
+                self.catalog.uploaded(target_name, self.bucket_name, getattr(result, 'etag', None))
+            return True
+
+        except S3Error as e:
+            self.metrics.counter('upload_errors').inc()
+            self.log.warning(f"Upload failed for {filepath} (attempt {attempt_count}): {e}", file=filepath, attempt=attempt_count, code=e.code)
+            if e.code == 'NoSuchBucket':
+                self._bucket_checked = False
+                if self.catalog:
+                    self.catalog.forget_bucket(self.bucket_name)
+            if e.code == 'NoSuchUpload':
+                # The server dropped the multipart upload, start it over
+                MultipartUpload(self, filepath, target_name).forget()
+        except Exception as e:
+            self.metrics.counter('upload_errors').inc()
+            self.log.error(f"Unexpected error during upload: {e}", file=filepath, attempt=attempt_count)
+        return False
+
+    def retry_delay(self, filepath, attempt_count):
+        """Backoff before the attempt after `attempt_count`, counted and logged as a retry."""
+        delay = self.backoff(attempt_count)
+        self.metrics.counter('upload_retries').inc()
+        self.log.info(f"Retrying in {delay:.0f} seconds...", file=filepath, delay=round(delay, 1))
+        return delay
+
+    def give_up(self, filepath, target_name):
+        """Record that all `max_attempts` attempts failed."""
+        self.metrics.counter('upload_failures').inc()
+        self.log.error(f"Maximum retry attempts reached. Upload failed for {filepath}", file=filepath)
+        if self.catalog:
+            self.catalog.upload_failed(target_name, "maximum retry attempts reached")
+        if self.status:
+            self.status.update(last_upload_error=target_name, last_upload_error_time=time.time())
+
+    def record_upload(self, filepath, target_name, elapsed):
+        size = os.path.getsize(filepath)
+        self.metrics.counter('uploads').inc()
+        self.metrics.counter('upload_bytes').inc(size)
+        self.metrics.histogram('upload_seconds').observe(elapsed)
+        if self.status:
+            self.status.update(last_upload=target_name, last_upload_time=time.time())
+        if elapsed > 0:
+            self.metrics.histogram('upload_bytes_per_second', THROUGHPUT_BUCKETS).observe(size / elapsed)
+        self.log.info(f"Upload complete for {filepath} to {self.bucket_name}/{target_name}",
+                      file=filepath, bytes=size, seconds=round(elapsed, 2), bytes_per_second=round(size / elapsed) if elapsed > 0 else None)
+
+
+class MultipartUpload:
+    """
+    S3 multipart upload of a file that is still being written.
+
+    Parts are fixed `part_size` slices of the file. While recording, parts
+    2..N are uploaded as soon as they lie entirely below the stable size,
+    i.e. before the region the writer may still truncate. Part 1 holds the
+    WAV header, which is patched when the segment ends, so it is uploaded by
+    complete() together with the tail. Part ETags are persisted next to the
+    file, so an interrupted upload is resumed instead of restarted.
+
+    Args:
+        uploader: MinioUploader providing the client and bucket
+        filepath: File to upload; may be renamed before complete()
+        target_name: Name of the object in the bucket
+        part_size: Bytes per part, at least 5 MiB as required by S3
+    """
+
+    def __init__(self, uploader, filepath, target_name, part_size=8 * 1024 * 1024):
+        self.uploader = uploader
+        self.filepath = filepath
+        self.target_name = target_name
+        self.state_path = self.state_path_for(filepath, target_name)
+        self.state = {'upload_id': None, 'part_size': part_size, 'parts': {}}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+
+    @staticmethod
+    def state_path_for(filepath, target_name):
+        return os.path.join(os.path.dirname(filepath), '.%s.upload.json' % target_name)
+
+    @property
+    def part_size(self):
+        return self.state['part_size']
+
+    @property
+    def client(self):
+        return self.uploader.client
+
+    @property
+    def bucket_name(self):
+        return self.uploader.bucket_name
+
+    def upload_stable(self, stable_size):
+        """Upload every part after the first that lies below `stable_size`."""
+        for part_number in range(2, stable_size // self.part_size + 1):
+            self._upload_part(part_number, stable_size)
+
+    def complete(self, size):
+        """Upload the remaining parts of the finished file and complete the object."""
+        part_count = max(1, -(-size // self.part_size))
+        for part_number in range(1, part_count + 1):
+            self._upload_part(part_number, size)
+        parts = [Part(part_number, self.state['parts'][str(part_number)]) for part_number in range(1, part_count + 1)]
+        result = self.client._complete_multipart_upload(self.bucket_name, self.target_name, self.state['upload_id'], parts)
+        self.forget()
+        return result
+
+    def abort(self):
+        if self.state['upload_id']:
+            try:
+                self.client._abort_multipart_upload(self.bucket_name, self.target_name, self.state['upload_id'])
+            except S3Error as e:
+                self.uploader.log.warning(f"Could not abort multipart upload of {self.target_name}: {e}", target=self.target_name)
+        self.forget()
+
+    def _upload_part(self, part_number, size):
+        if str(part_number) in self.state['parts']:
+            return
+        if self.state['upload_id'] is None:
+            self.uploader.ensure_bucket()
+            self.state['upload_id'] = self.client._create_multipart_upload(
+                self.bucket_name, self.target_name, {'Content-Type': content_type_for(self.target_name)})
+            self._save_state()
+
+        offset = (part_number - 1) * self.part_size
+        with open(self.filepath, 'rb') as f:
+            f.seek(offset)
+            data = f.read(min(self.part_size, size - offset))
+        started = time.monotonic()
+        etag = self.client._upload_part(self.bucket_name, self.target_name, data, None, self.state['upload_id'], part_number)
+        elapsed = time.monotonic() - started
+        self.uploader.metrics.counter('upload_bytes').inc(len(data))
+        self.uploader.metrics.counter('upload_parts').inc()
+        if elapsed > 0:
+            self.uploader.metrics.histogram('upload_bytes_per_second', THROUGHPUT_BUCKETS).observe(len(data) / elapsed)
+        self.state['parts'][str(part_number)] = etag
+        self._save_state()
+
+    def _save_state(self):
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.state_path)
+
+    def forget(self):
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+
+# Upper bounds in bytes per second, from a weak mobile link to the LAN
+THROUGHPUT_BUCKETS = (1e4, 3e4, 1e5, 3e5, 1e6, 3e6, 1e7, 3e7, 1e8)
+
+CONTENT_TYPES = {
+    '.wav': "audio/wav",
+    '.flac': "audio/flac",
+    '.opus': "audio/ogg",
+    '.m4a': "audio/mp4",
+    '.json': "application/json",
+}
+
+def content_type_for(target_name):
+    extension = os.path.splitext(target_name.lower())[1]
+    return CONTENT_TYPES.get(extension, "application/octet-stream")
+
+
+_uploaders = {}
+
 def upload(filepath, target_name, logging_queue, retry_interval=30):
     """
     Upload a file to MinIO with retry functionality.
@@ -18,79 +331,10 @@ def upload(filepath, target_name, logging_queue, retry_interval=30):
         logging_queue: Queue for logging messages
         retry_interval: Time to wait between retries in seconds
     """
-    load_dotenv()
-    minio_url = os.environ.get("MINIO_URL")
-    access_key = os.environ.get("MINIO_ACCESSKEY")
-    secret_key = os.environ.get("MINIO_SECRETKEY")
-    bucket_name = os.environ.get("MINIO_BUCKET_NAME")
-    
-    # Determine content type based on file extension
-    content_type = "application/octet-stream"
-    if target_name.lower().endswith(('.wav')):
-        content_type = "audio/wav"
-    
-    # Create MinIO client
-    try:
-        minio_client = Minio(
-            minio_url.replace("http://", "").replace("https://", ""),
-            access_key=access_key,
-            secret_key=secret_key,
-            secure=minio_url.startswith("https")
-        )
-        
-        # Check if bucket exists
-        found = minio_client.bucket_exists(bucket_name)
-        if not found:
-            minio_client.make_bucket(bucket_name)
-            logging_queue.put(f"Created bucket {bucket_name}")
-        else:
-            logging_queue.put(f"Bucket {bucket_name} already exists")
-    except S3Error as e:
-        logging_queue.put(f"Error checking/creating bucket: {e}")
-        return
-    
-    # Upload with retries
-    max_attempts = 10
-    attempt_count = 0
-    upload_success = False
-    
-    while not upload_success and attempt_count < max_attempts:
-        try:
-            attempt_count += 1
-            logging_queue.put(f"Uploading {filepath} to {bucket_name}/{target_name} (attempt {attempt_count})")
-            
-            # Perform the upload
-            minio_client.fput_object(
-                bucket_name, 
-                target_name, 
-                filepath,
-                content_type=content_type
-            )
-            
-            upload_success = True
-            logging_queue.put(f"Upload complete for {filepath} to {bucket_name}/{target_name}")
-            
-        except S3Error as e:
-            logging_queue.put(f"Upload failed for {filepath} (attempt {attempt_count}): {e}")
-            
-            if attempt_count < max_attempts:
-                logging_queue.put(f"Retrying in {retry_interval} seconds...")
-                time.sleep(retry_interval)
-            else:
-                logging_queue.put(f"Maximum retry attempts reached. Upload failed for {filepath}")
-                break
-                
-        except Exception as e:
-            logging_queue.put(f"Unexpected error during upload: {e}")
-            
-            if attempt_count < max_attempts:
-                logging_queue.put(f"Retrying in {retry_interval} seconds...")
-                time.sleep(retry_interval)
-            else:
-                logging_queue.put(f"Maximum retry attempts reached. Upload failed for {filepath}")
-                break
-    
-    return upload_success
+    key = (id(logging_queue), retry_interval)
+    if key not in _uploaders:
+        _uploaders[key] = MinioUploader(logging_queue, retry_interval=retry_interval)
+    return _uploaders[key].upload(filepath, target_name)
 
 def main():
     """
@@ -128,14 +372,15 @@ if __name__ == "__main__":
     logging_listener.daemon = True
     logging_listener.start()
 
+    log = Logger(logging_queue, 'upload')
     try:
-        success = upload(args.file, target_name, logging_queue)
+        success = upload(args.file, target_name, log)
         if success:
-            logging_queue.put(f"Upload process completed successfully")
+            log.info("Upload process completed successfully")
         else:
-            logging_queue.put(f"Upload process failed")
+            log.error("Upload process failed")
     except Exception as e:
-        logging_queue.put(f"Error occurred: {e}")
+        log.error(f"Error occurred: {e}")
     
     # Wait for logging to complete
     logging_queue.join()
\ No newline at end of file
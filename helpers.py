@@ -9,11 +9,17 @@ def create_folder_if_not_exists(folder_name):
         os.makedirs(folder_name)
         print(f"Folder '{folder_name}' created.")
 
-def int2float(sound):
-    abs_max = np.abs(sound).max()
-    sound = sound.astype('float32')
-    if abs_max > 0:
-        sound *= 1/32768
+INT16_SCALE = np.float32(1/32768)
+
+def int2float(sound, out=None):
+    if out is None:
+        sound = sound.astype('float32')
+    else:
+        # Cast into the caller's buffer; a mixed-type multiply would
+        # allocate a temporary cast buffer on every call
+        np.copyto(out, sound, casting='safe')
+        sound = out
+    sound *= INT16_SCALE
     sound = sound.squeeze()  # depends on the use case
     return sound
 
@@ -52,8 +58,8 @@ def convert_to_m4a(input_file):
         print(f"Error during audio conversion: {e}")
         return input_file  # Return original file on error
 
-def calculateRms(sound):
-    rms = np.sqrt(np.mean(sound**2))
+def calculateRms(sound, axis=None):
+    rms = np.sqrt(np.mean(sound**2, axis=axis))
     return rms
 
 def from_json(json_path):
@@ -1,5 +1,118 @@
-def log_message(logging_queue):
+import json
+import os
+import queue
+import sys
+import time
+
+class Logger:
+    """
+    Puts structured records on the logging queue for log_message to write.
+
+    A record is the message plus its level, component and any keyword
+    fields, so it can be filtered and parsed later. put() makes a Logger a
+    drop-in replacement for a plain logging queue in classes that only call
+    `logging_queue.put(message)`.
+
+    Args:
+        logging_queue: Queue read by log_message
+        component: Name of the part of the recorder that logs
+    """
+
+    def __init__(self, logging_queue, component='recorder'):
+        self.queue = logging_queue
+        self.component = component
+
+    def child(self, component):
+        return Logger(self.queue, component)
+
+    def log(self, level, message, **fields):
+        record = {'time': time.time(), 'level': level, 'component': self.component, 'message': message}
+        record.update(fields)
+        self.queue.put(record)
+
+    def debug(self, message, **fields):
+        self.log('debug', message, **fields)
+
+    def info(self, message, **fields):
+        self.log('info', message, **fields)
+
+    def warning(self, message, **fields):
+        self.log('warning', message, **fields)
+
+    def error(self, message, **fields):
+        self.log('error', message, **fields)
+
+    def put(self, message):
+        self.info(message)
+
+    def join(self):
+        self.queue.join()
+
+
+def as_logger(logging_queue, component):
+    """Wrap a plain logging queue, or pass a Logger through unchanged."""
+    if isinstance(logging_queue, Logger):
+        return logging_queue
+    return Logger(logging_queue, component)
+
+
+class RotatingFile:
+    """Append-only file rotated to `<path>.1` .. `<path>.<backups>` when it grows past `max_bytes`."""
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backups=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, text):
+        self.file.write(text)
+        self.file.flush()
+        if self.file.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+
+def format_record(record):
+    # Fields are only kept in the JSON file; the console shows the message
+    level = '' if record['level'] == 'info' else record['level'].upper() + ': '
+    return f"{level}{record['message']}"
+
+
+def log_message(logging_queue, path=None, max_bytes=10 * 1024 * 1024, backups=5, batch_size=256, echo=True):
+    """
+    Write records from the logging queue until the process exits.
+
+    Everything queued at the moment is written in one batch: as JSON lines
+    to the rotating file at `path`, and as readable lines to stdout when
+    `echo` is set. Plain strings are accepted as info records.
+    """
+    log_file = RotatingFile(path, max_bytes, backups) if path else None
     while True:
-        message = logging_queue.get()
-        print(message, flush=True)
-        logging_queue.task_done()
\ No newline at end of file
+        batch = [logging_queue.get()]
+        while len(batch) < batch_size:
+            try:
+                batch.append(logging_queue.get_nowait())
+            except queue.Empty:
+                break
+        records = [item if isinstance(item, dict) else {'time': time.time(), 'level': 'info', 'component': 'recorder', 'message': str(item)} for item in batch]
+        try:
+            if log_file:
+                log_file.write(''.join(json.dumps(record, default=str) + '\n' for record in records))
+            if echo:
+                sys.stdout.write(''.join(format_record(record) + '\n' for record in records))
+                sys.stdout.flush()
+        except Exception as e:
+            print(f"Logging failed: {e}", file=sys.stderr, flush=True)
+        for _ in batch:
+            logging_queue.task_done()
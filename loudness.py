@@ -0,0 +1,135 @@
+import numpy as np
+from math import log10, pi, tan
+from scipy.signal import sosfilt
+
+ABSOLUTE_GATE_LUFS = -70
+RELATIVE_GATE_LU = -10
+CLIP_LEVEL = 32767
+
+
+def k_weighting(sample_rate):
+    """
+    BS.1770 K-weighting (high shelf, then high-pass) as two SOS rows. The
+    analog prototypes are re-derived for any sample rate as in libebur128;
+    at 48 kHz this gives the coefficients tabled in the standard.
+    """
+    K = tan(pi * 1681.974450955533 / sample_rate)
+    Q = 0.7071752369554196
+    Vh = 10 ** (3.999843853973347 / 20)
+    Vb = Vh ** 0.4996667741545416
+    a0 = 1 + K / Q + K * K
+    shelf = [(Vh + Vb * K / Q + K * K) / a0, 2 * (K * K - Vh) / a0, (Vh - Vb * K / Q + K * K) / a0,
+             1, 2 * (K * K - 1) / a0, (1 - K / Q + K * K) / a0]
+    K = tan(pi * 38.13547087602444 / sample_rate)
+    Q = 0.5003270373238773
+    a0 = 1 + K / Q + K * K
+    high_pass = [1, -2, 1, 1, 2 * (K * K - 1) / a0, (1 - K / Q + K * K) / a0]
+    return np.array([shelf, high_pass])
+
+
+def to_db(value, floor=-120.0):
+    return 10 * log10(value) if value > 0 else floor
+
+
+class LoudnessMeter:
+    """
+    Incremental level and loudness statistics of one segment.
+
+    Samples are pushed as they are captured and summarised into 100 ms
+    sub-blocks (K-weighted energy, plain energy, peak, clipped samples), so
+    memory grows by a few floats per 100 ms and no second pass over the
+    audio is needed. Integrated loudness follows EBU R128: 400 ms blocks
+    with 75% overlap, an absolute gate at -70 LUFS and a relative gate
+    10 LU below the absolutely gated loudness. Trailing sub-blocks can be
+    dropped when the segment's silent tail is trimmed.
+
+    Args:
+        sample_rate: Frames per second
+        channels: Number of interleaved channels, all weighted equally
+    """
+
+    def __init__(self, sample_rate, channels=1):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sos = k_weighting(sample_rate)
+        self.hop = sample_rate // 10
+        self.reset()
+
+    def reset(self):
+        self.state = np.zeros((len(self.sos), 2, self.channels))
+        self.weighted = []
+        self.energy = []
+        self.peaks = []
+        self.clips = []
+        self.partial = np.zeros((0, self.channels))
+
+    def push(self, samples):
+        """Add int16 samples, shape (frames,) or (frames, channels)."""
+        samples = samples.reshape(-1, self.channels).astype(np.float64)
+        weighted, self.state = sosfilt(self.sos, samples / 32768, axis=0, zi=self.state)
+        block = np.concatenate((self.partial, np.concatenate((samples, weighted), axis=1))) if len(self.partial) else np.concatenate((samples, weighted), axis=1)
+        complete = len(block) // self.hop * self.hop
+        if complete:
+            sub_blocks = block[:complete].reshape(-1, self.hop, 2 * self.channels)
+            raw = sub_blocks[:, :, :self.channels]
+            self.energy.extend(np.mean((raw / 32768) ** 2, axis=(1, 2)))
+            self.weighted.extend(np.sum(np.mean(sub_blocks[:, :, self.channels:] ** 2, axis=1), axis=1))
+            self.peaks.extend(np.max(np.abs(raw), axis=(1, 2)))
+            self.clips.extend(np.sum(np.abs(raw) >= CLIP_LEVEL, axis=(1, 2)))
+        self.partial = block[complete:]
+
+    def trim(self, frames):
+        """Forget the last `frames` frames (rounded to 100 ms sub-blocks)."""
+        self.partial = self.partial[:0]
+        drop = min(len(self.energy), int(round(frames / self.hop)))
+        if drop:
+            for values in (self.weighted, self.energy, self.peaks, self.clips):
+                del values[-drop:]
+
+    def integrated_loudness(self):
+        weighted = np.array(self.weighted)
+        if len(weighted) < 4:
+            return None
+        # 400 ms blocks every 100 ms
+        blocks = np.convolve(weighted, np.ones(4) / 4, mode='valid')
+        loudness = -0.691 + 10 * np.log10(np.maximum(blocks, 1e-20))
+        gated = blocks[loudness > ABSOLUTE_GATE_LUFS]
+        if not len(gated):
+            return None
+        relative_gate = -0.691 + 10 * np.log10(np.mean(gated)) + RELATIVE_GATE_LU
+        gated = blocks[(loudness > ABSOLUTE_GATE_LUFS) & (loudness > relative_gate)]
+        return -0.691 + 10 * np.log10(np.mean(gated))
+
+    def peak_dbfs(self):
+        return 20 * log10(max(self.peaks) / 32768) if self.peaks and max(self.peaks) > 0 else -120.0
+
+    def rms_dbfs(self):
+        return to_db(float(np.mean(self.energy))) if self.energy else -120.0
+
+    def seconds(self):
+        return len(self.energy) * self.hop / self.sample_rate
+
+    def gain_db(self, target_lufs, max_peak_dbfs=-1.0):
+        """Gain reaching `target_lufs` without pushing the peak above `max_peak_dbfs`."""
+        loudness = self.integrated_loudness()
+        if loudness is None:
+            return 0.0
+        return float(min(target_lufs - loudness, max_peak_dbfs - self.peak_dbfs()))
+
+    def statistics(self, target_lufs=None, silent_lufs=-45.0):
+        loudness = self.integrated_loudness()
+        samples = len(self.energy) * self.hop * self.channels
+        clipped = int(sum(self.clips))
+        statistics = {
+            'duration_sec': round(self.seconds(), 1),
+            'integrated_lufs': None if loudness is None else round(float(loudness), 2),
+            'rms_dbfs': round(self.rms_dbfs(), 2),
+            'peak_dbfs': round(self.peak_dbfs(), 2),
+            'clipped_samples': clipped,
+            'clipped': bool(samples > 0 and clipped / samples > 1e-5),
+            'near_silent': bool(loudness is None or loudness < silent_lufs),
+        }
+        if target_lufs is not None:
+            statistics['target_lufs'] = target_lufs
+            statistics['suggested_gain_db'] = round(self.gain_db(target_lufs), 2)
+        return statistics
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENVELOPE = """<?xml version="1.0" encoding="UTF-8"?>
+<env:Envelope xmlns:env="http://www.w3.org/2003/05/soap-envelope" xmlns:tt="http://www.onvif.org/ver10/schema"
+ xmlns:tds="http://www.onvif.org/ver10/device/wsdl" xmlns:trt="http://www.onvif.org/ver10/media/wsdl"
+ xmlns:tptz="http://www.onvif.org/ver20/ptz/wsdl"><env:Body>{}</env:Body></env:Envelope>"""
+
+FAULT = """<env:Fault><env:Code><env:Value>env:Receiver</env:Value></env:Code>
+<env:Reason><env:Text xml:lang="en">{} is not supported by the mock</env:Text></env:Reason></env:Fault>"""
+
+
+def position_xml(tag, position):
+    return (f'<{tag}><tt:PanTilt x="{position["pan"]}" y="{position["tilt"]}"/>'
+            f'<tt:Zoom x="{position["zoom"]}"/></{tag}>')
+
+
+class MockCamera:
+    """
+    Minimal ONVIF PTZ camera answering the SOAP calls CameraSession makes.
+
+    It keeps a position and named presets, counts every operation it is
+    asked for in `calls`, and can delay answers by `delay` seconds to try
+    out timeouts. Security headers are ignored.
+
+    Args:
+        host: Address to listen on
+        port: Port to listen on; 0 picks a free one
+        delay: Seconds to wait before every answer
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0):
+        self.position = {'pan': 0.0, 'tilt': 0.0, 'zoom': 0.0}
+        self.presets = {}
+        self.calls = {}
+        self.delay = delay
+        self._lock = threading.Lock()
+        camera = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                request = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                status, body = camera.handle(request, self.headers.get('Host'))
+                if camera.delay:
+                    threading.Event().wait(camera.delay)
+                data = ENVELOPE.format(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/soap+xml; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='onvif-mock', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def handle(self, request, host):
+        body = request.split('Body', 1)[1]
+        operation = re.search(r'<(?:[\w-]+:)?(\w+)[\s/>]', body).group(1)
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            answer = getattr(self, 'do_' + operation, None)
+            if answer is None:
+                return 500, FAULT.format(operation)
+            return 200, answer(body, host)
+
+    def do_GetCapabilities(self, body, host):
+        return (f'<tds:GetCapabilitiesResponse><tds:Capabilities>'
+                f'<tt:Media><tt:XAddr>http://{host}/onvif/media</tt:XAddr><tt:StreamingCapabilities/></tt:Media>'
+                f'<tt:PTZ><tt:XAddr>http://{host}/onvif/ptz</tt:XAddr></tt:PTZ>'
+                f'</tds:Capabilities></tds:GetCapabilitiesResponse>')
+
+    def do_GetProfiles(self, body, host):
+        return ('<trt:GetProfilesResponse><trt:Profiles token="profile_1" fixed="true"><tt:Name>main</tt:Name>'
+                '<tt:PTZConfiguration token="ptz_1"><tt:Name>ptz</tt:Name><tt:UseCount>1</tt:UseCount><tt:NodeToken>node_1</tt:NodeToken></tt:PTZConfiguration>'
+                '</trt:Profiles></trt:GetProfilesResponse>')
+
+    def do_GetPresets(self, body, host):
+        presets = ''.join(f'<tptz:Preset token="{token}"><tt:Name>{name}</tt:Name>{position_xml("tt:PTZPosition", position)}</tptz:Preset>'
+                          for token, (name, position) in self.presets.items())
+        return f'<tptz:GetPresetsResponse>{presets}</tptz:GetPresetsResponse>'
+
+    def do_SetPreset(self, body, host):
+        name = re.search(r'PresetName>([^<]*)<', body).group(1)
+        token = re.search(r'PresetToken>([^<]*)<', body)
+        token = token.group(1) if token else str(len(self.presets) + 1)
+        self.presets[token] = (name, dict(self.position))
+        return f'<tptz:SetPresetResponse><tptz:PresetToken>{token}</tptz:PresetToken></tptz:SetPresetResponse>'
+
+    def do_GotoPreset(self, body, host):
+        token = re.search(r'PresetToken>([^<]*)<', body).group(1)
+        self.position = dict(self.presets[token][1])
+        return '<tptz:GotoPresetResponse/>'
+
+    def do_AbsoluteMove(self, body, host):
+        pan, tilt = re.search(r'PanTilt[^>]*?x="([^"]+)"[^>]*?y="([^"]+)"', body).groups()
+        zoom = re.search(r'Zoom[^>]*?x="([^"]+)"', body).group(1)
+        self.position = {'pan': float(pan), 'tilt': float(tilt), 'zoom': float(zoom)}
+        return '<tptz:AbsoluteMoveResponse/>'
+
+    def do_Stop(self, body, host):
+        return '<tptz:StopResponse/>'
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description='Run a mock ONVIF PTZ camera, e.g. for CAMERA_IP=127.0.0.1 CAMERA_PORT=8899 python ptz.py ambona')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', default=8899, type=int)
+    parser.add_argument('--delay', help='seconds to wait before every answer', default=0, type=float)
+    args = parser.parse_args()
+    camera = MockCamera(args.host, args.port, args.delay).start()
+    print(f"Mock ONVIF camera on http://{args.host}:{camera.port}/onvif/device_service")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"position {camera.position}, calls {camera.calls}", flush=True)
+    except KeyboardInterrupt:
+        camera.stop()
@@ -0,0 +1,242 @@
+import os
+import queue
+import threading
+import time
+import traceback
+
+STOP = object()
+
+
+class Stage(threading.Thread):
+    """
+    One step of the recording pipeline running on its own thread.
+
+    A stage takes items from a bounded inbox, calls `handler` on each one and
+    records how long it took, in wall-clock and in thread CPU time; the
+    difference is time spent waiting, e.g. for the GIL or for I/O. A stage
+    without an inbox is a source: its handler is called in a loop and
+    produces items until it raises EOFError. Whatever a handler returns, if
+    not None, is put into the `output` stage. STOP is forwarded down the
+    pipeline when a source ends; a stage with `on_stop` first forwards what
+    it returns, e.g. to flush work in progress.
+
+    An item whose handler raises any other exception is logged, counted and
+    dropped. After `max_errors` failures in a row the stage gives up: it
+    forwards STOP, stores the exception in `failure` and sets the pipeline's
+    `failed` event, so the pipeline stops instead of blocking on it.
+
+    Backpressure policies of the inbox:
+        block: the producer waits for room (nothing is lost)
+        drop_oldest: the oldest queued item is discarded to make room
+        drop_newest: the new item is discarded
+
+    Args:
+        name: Stage name used in statistics
+        handler: Callable processing one item (or producing one, for sources)
+        maxsize: Inbox capacity; None makes the stage a source
+        policy: Backpressure policy when the inbox is full
+        cpu: CPU core to pin the stage's thread to, or None
+        histogram: Optional metrics.Histogram receiving each service time
+        max_errors: Consecutive failed items after which the stage stops
+        log: Logger for failed items; set by Pipeline if not given
+        on_stop: Optional callable run when STOP arrives; its result, if not
+            None, is put into the `output` stage before STOP
+    """
+
+    def __init__(self, name, handler, maxsize=None, policy='block', cpu=None, histogram=None, max_errors=10, log=None, on_stop=None):
+        super().__init__(name=name, daemon=True)
+        self.handler = handler
+        self.inbox = None if maxsize is None else queue.Queue(maxsize)
+        self.policy = policy
+        self.cpu = cpu
+        self.histogram = histogram
+        self.max_errors = max_errors
+        self.log = log
+        self.on_stop = on_stop
+        self.errors = 0
+        self.failure = None
+        self.failed = None
+        self.output = None
+        self.processed = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.busy_time = 0.0
+        self.cpu_time = 0.0
+        self.max_service_time = 0.0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.started_at = None
+
+    def connect(self, stage):
+        self.output = stage
+        return stage
+
+    def put(self, item):
+        entry = (time.monotonic(), item)
+        if self.policy == 'block' or item is STOP:
+            self.inbox.put(entry)
+        else:
+            while True:
+                try:
+                    self.inbox.put_nowait(entry)
+                    break
+                except queue.Full:
+                    self.dropped += 1
+                    if self.policy == 'drop_newest':
+                        return
+                    try:
+                        self.inbox.get_nowait()
+                    except queue.Empty:
+                        pass
+        self.max_depth = max(self.max_depth, self.inbox.qsize())
+
+    def run(self):
+        if self.cpu is not None and hasattr(os, 'sched_setaffinity'):
+            # On Linux pid 0 refers to the calling thread
+            os.sched_setaffinity(0, {self.cpu})
+        self.started_at = time.monotonic()
+        consecutive_errors = 0
+        while True:
+            if self.inbox is None:
+                queued_at, item = time.monotonic(), None
+            else:
+                queued_at, item = self.inbox.get()
+                if item is STOP:
+                    self._finish()
+                    return
+
+            started, cpu_started = time.monotonic(), time.thread_time()
+            try:
+                result = self.handler() if self.inbox is None else self.handler(item)
+            except EOFError:
+                self._forward(STOP)
+                return
+            except Exception as e:
+                self.errors += 1
+                consecutive_errors += 1
+                if self.log:
+                    self.log.error(f"{self.name} stage failed on an item ({consecutive_errors} in a row): {e!r}", stage=self.name, traceback=traceback.format_exc())
+                if consecutive_errors >= self.max_errors:
+                    self.failure = e
+                    self._forward(STOP)
+                    if self.failed is not None:
+                        self.failed.set()
+                    return
+                continue
+            consecutive_errors = 0
+            finished = time.monotonic()
+
+            service_time = finished - started
+            self.cpu_time += time.thread_time() - cpu_started
+            if self.histogram is not None:
+                self.histogram.observe(service_time)
+            latency = finished - queued_at
+            self.processed += 1
+            self.busy_time += service_time
+            self.max_service_time = max(self.max_service_time, service_time)
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if result is not None:
+                self._forward(result)
+
+    def _finish(self):
+        if self.on_stop is not None:
+            try:
+                result = self.on_stop()
+                if result is not None:
+                    self._forward(result)
+            except Exception as e:
+                self.errors += 1
+                if self.log:
+                    self.log.error(f"{self.name} stage failed to stop cleanly: {e!r}", stage=self.name, traceback=traceback.format_exc())
+        self._forward(STOP)
+
+    def _forward(self, item):
+        if self.output is not None:
+            self.output.put(item)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0
+        processed = max(self.processed, 1)
+        return {
+            'stage': self.name,
+            'processed': self.processed,
+            'per_second': self.processed / elapsed if elapsed else 0.0,
+            'utilization': self.busy_time / elapsed if elapsed else 0.0,
+            'cpu_utilization': self.cpu_time / elapsed if elapsed else 0.0,
+            'depth': self.inbox.qsize() if self.inbox else 0,
+            'max_depth': self.max_depth,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'mean_service_ms': self.busy_time / processed * 1000,
+            'max_service_ms': self.max_service_time * 1000,
+            'mean_latency_ms': self.total_latency / processed * 1000,
+            'max_latency_ms': self.max_latency * 1000,
+        }
+
+
+class Pipeline:
+    """
+    Chain of stages started and stopped together.
+
+    If a stage gives up after repeated errors the pipeline is no longer
+    alive, even though the stages before it may still be running or
+    blocked on it; failed_stage() tells which one it was.
+    """
+
+    def __init__(self, stages, log=None):
+        self.stages = stages
+        self.failed = threading.Event()
+        for stage, following in zip(stages, stages[1:]):
+            stage.connect(following)
+        for stage in stages:
+            stage.failed = self.failed
+            if stage.log is None:
+                stage.log = log
+
+    def start(self):
+        # Start consumers first so the source never feeds a stopped stage
+        for stage in reversed(self.stages):
+            stage.start()
+
+    def join(self, timeout=None):
+        """Wait until all stages ended, a stage failed or `timeout` seconds passed."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for stage in self.stages:
+            while stage.is_alive() and not self.failed.is_set():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return
+                stage.join(0.5 if remaining is None else min(0.5, remaining))
+
+    def is_alive(self):
+        return not self.failed.is_set() and any(stage.is_alive() for stage in self.stages)
+
+    def failed_stage(self):
+        for stage in self.stages:
+            if stage.failure is not None:
+                return stage
+        return None
+
+    def stats(self):
+        return [stage.stats() for stage in self.stages]
+
+    def report(self):
+        lines = []
+        for s in self.stats():
+            lines.append(
+                f"{s['stage']:<8} {s['processed']:>8} items {s['per_second']:7.1f}/s busy {s['utilization']:5.1%} cpu {s['cpu_utilization']:5.1%} "
+                f"queue {s['depth']}/{s['max_depth']} dropped {s['dropped']} errors {s['errors']} "
+                f"service {s['mean_service_ms']:.2f}/{s['max_service_ms']:.2f}ms latency {s['mean_latency_ms']:.2f}/{s['max_latency_ms']:.2f}ms"
+            )
+        return "\n".join(lines)
+
+
+def parse_cpu_pinning(value):
+    """Parse 'capture=0,dsp=1' into {'capture': 0, 'dsp': 1}."""
+    pinning = {}
+    if value:
+        for item in value.split(','):
+            name, cpu = item.split('=')
+            pinning[name.strip()] = int(cpu)
+    return pinning
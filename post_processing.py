@@ -1,30 +1,150 @@
-import sox
 import argparse
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from math import cos, pi, sin
+from scipy.signal import sosfilt
 
-class AudioPostProcessor:
-    def __init__(self):
-        self.tfm = sox.Transformer()
+# The chain previously run through sox: (effect, frequency, Q, gain in dB)
+EFFECTS = [
+    ('bandreject', 50, 40, 0),
+    ('bandreject', 150, 30, 0),
+    ('bandreject', 250, 10, 0),
+    ('highpass', 35, 0.707, 0),
+    ('equalizer', 60, 0.5, 3),
+]
+
+# Largest expected difference from sox's 16-bit output, which is TPDF dithered
+TOLERANCE_LSB = 2
+
+
+def biquad(effect, frequency, q, gain_db, sample_rate):
+    """
+    One second-order section with the coefficients sox's biquad effects
+    use when the width is given as a Q factor (the RBJ cookbook formulas).
+    """
+    w0 = 2 * pi * frequency / sample_rate
+    alpha = sin(w0) / (2 * q)
+    if effect == 'bandreject':
+        b = [1, -2 * cos(w0), 1]
+        a = [1 + alpha, -2 * cos(w0), 1 - alpha]
+    elif effect == 'highpass':
+        b = [(1 + cos(w0)) / 2, -(1 + cos(w0)), (1 + cos(w0)) / 2]
+        a = [1 + alpha, -2 * cos(w0), 1 - alpha]
+    elif effect == 'equalizer':
+        A = 10 ** (gain_db / 40)
+        b = [1 + alpha * A, -2 * cos(w0), 1 - alpha * A]
+        a = [1 + alpha / A, -2 * cos(w0), 1 - alpha / A]
+    else:
+        raise ValueError(f"Unknown effect {effect}")
+    return np.array(b + a) / a[0]
+
+
+class FilterChain:
+    """
+    The post-processing chain as cascaded biquads with persistent state.
+
+    Blocks of any length can be pushed one after another and the result is
+    the same as filtering the whole signal at once, so the chain can run
+    inline on chunks as they are recorded.
+
+    Args:
+        sample_rate: Frames per second
+        channels: Number of interleaved channels
+        effects: List of (effect, frequency, Q, gain in dB)
+    """
+
+    def __init__(self, sample_rate, channels=1, effects=EFFECTS):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sos = np.array([biquad(*effect, sample_rate) for effect in effects])
+        self.reset()
+
+    def reset(self):
+        self.state = np.zeros((len(self.sos), 2, self.channels))
+
+    def process(self, block):
+        """Filter a float block of shape (frames, channels)."""
+        filtered, self.state = sosfilt(self.sos, block, axis=0, zi=self.state)
+        return filtered
+
+    def process_int16(self, block):
+        filtered = self.process(block.reshape(-1, self.channels).astype(np.float64))
+        return np.clip(np.round(filtered), -32768, 32767).astype(np.int16)
+
+    def process_bytes(self, data):
+        return self.process_int16(np.frombuffer(data, np.int16)).tobytes()
 
-    def apply_effects(self):
-        self.tfm.bandreject(50, 40)
-        self.tfm.bandreject(150, 30)
-        self.tfm.bandreject(250, 10)
 
-        self.tfm.highpass(frequency=35)
+class AudioPostProcessor:
+    def __init__(self, block_frames=65536):
+        self.block_frames = block_frames
+        self.effects = []
 
-        self.tfm.equalizer(frequency=60, width_q=0.5, gain_db=3)
+    def apply_effects(self):
+        self.effects = list(EFFECTS)
 
     def process_file(self, input_file, output_file):
-        self.tfm.build(input_file, output_file)
+        import soundfile
+        with soundfile.SoundFile(input_file) as source:
+            chain = FilterChain(source.samplerate, source.channels, self.effects)
+            with soundfile.SoundFile(output_file, 'w', source.samplerate, source.channels, subtype='PCM_16', format=source.format) as target:
+                for block in source.blocks(self.block_frames, dtype='int16', always_2d=True):
+                    target.write(chain.process_int16(block))
         print(f"Processed {input_file} and saved to {output_file}")
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Process an audio file.")
-    parser.add_argument("input_file", help="The input audio file")
-    parser.add_argument("output_file", help="The output audio file")
-    args = parser.parse_args()
 
+def _process_one(files):
     processor = AudioPostProcessor()
     processor.apply_effects()
-    processor.process_file(args.input_file, args.output_file)
+    processor.process_file(*files)
+
+
+def process_files(pairs, workers=None):
+    """Filter (input, output) pairs of files in parallel worker processes."""
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(_process_one, pairs))
+
+
+def compare_with_sox(input_file, output_file):
+    """Run the same chain through sox and report how far our output is from it."""
+    import sox
+    import soundfile
+    sox_file = output_file + '.sox.wav'
+    tfm = sox.Transformer()
+    for effect, frequency, q, gain_db in EFFECTS:
+        if effect == 'bandreject':
+            tfm.bandreject(frequency, q)
+        elif effect == 'highpass':
+            tfm.highpass(frequency=frequency, width_q=q)
+        else:
+            tfm.equalizer(frequency=frequency, width_q=q, gain_db=gain_db)
+    tfm.build(input_file, sox_file)
+    ours, _ = soundfile.read(output_file, dtype='int16', always_2d=True)
+    theirs, _ = soundfile.read(sox_file, dtype='int16', always_2d=True)
+    os.remove(sox_file)
+    length = min(len(ours), len(theirs))
+    difference = np.abs(ours[:length].astype(np.int32) - theirs[:length])
+    verdict = 'within' if difference.max() <= TOLERANCE_LSB else 'OUTSIDE'
+    print(f"Max difference from sox {difference.max()} LSB, mean {difference.mean():.3f} LSB ({verdict} the {TOLERANCE_LSB} LSB tolerance)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process an audio file.")
+    parser.add_argument("input_file", help="The input audio file, or a directory with --batch")
+    parser.add_argument("output_file", help="The output audio file, or a directory with --batch")
+    parser.add_argument("--batch", help="process every WAV file of the input directory", action="store_true")
+    parser.add_argument("-j", "--workers", help="worker processes for --batch (default: all cores)", default=None, type=int)
+    parser.add_argument("--compare", help="also run sox and report the difference", action="store_true")
+    args = parser.parse_args()
 
+    if args.batch:
+        os.makedirs(args.output_file, exist_ok=True)
+        names = sorted(name for name in os.listdir(args.input_file) if name.lower().endswith('.wav'))
+        process_files([(os.path.join(args.input_file, name), os.path.join(args.output_file, name)) for name in names], args.workers)
+    else:
+        processor = AudioPostProcessor()
+        processor.apply_effects()
+        processor.process_file(args.input_file, args.output_file)
+        if args.compare:
+            compare_with_sox(args.input_file, args.output_file)
@@ -0,0 +1,104 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler(threading.Thread):
+    """
+    Samples the Python stacks of all threads and writes them as folded stacks.
+
+    Every `interval` seconds the current frame of each thread is taken from
+    sys._current_frames() and its stack counted as one line of
+    `thread;outer;...;inner`. Threads idle in a threading wait are left out,
+    so the counts show where CPU and GIL time go. When stopped, the counts
+    are written to `path` in the folded format read by flamegraph.pl,
+    speedscope and inferno. Nothing runs while the profiler is not started.
+
+    Args:
+        path: File the folded stacks are written to
+        interval: Seconds between samples
+        duration: Seconds after which the profiler stops by itself, or None
+        log: Logger told where the stacks were written; None disables logging
+    """
+
+    def __init__(self, path, interval=0.005, duration=None, log=None):
+        super().__init__(name='profiler', daemon=True)
+        self.path = path
+        self.interval = interval
+        self.duration = duration
+        self.log = log
+        self.stacks = Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._written = threading.Event()
+
+    def run(self):
+        started = time.monotonic()
+        names = {}
+        while not self._stopped.wait(self.interval):
+            if self.duration is not None and time.monotonic() - started >= self.duration:
+                break
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            self.sample(names)
+        self.write()
+        self._written.set()
+        if self.log:
+            self.log.info(f"Wrote {self.samples} profile samples to {self.path}", file=self.path)
+
+    def sample(self, names):
+        me = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == me or idle(frame):
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def write(self):
+        with open(self.path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def stop(self, wait=True, timeout=5):
+        """Stop sampling and, with `wait`, wait until the file is written."""
+        self._stopped.set()
+        if wait:
+            self._written.wait(timeout)
+
+
+def idle(frame):
+    code = frame.f_code
+    return code.co_name in ('wait', '_wait_for_tstate_lock') and os.path.basename(code.co_filename) == 'threading.py'
+
+
+def timing_report(metrics, names, budget=None):
+    """
+    Mean, 99th percentile (upper bound of its bucket) and maximum of each
+    histogram in `names` that has observations, in milliseconds and, with
+    `budget` seconds, as a fraction of it.
+    """
+    lines = []
+    for name in names:
+        histogram = metrics.histogram(name).snapshot()
+        if not histogram['count']:
+            continue
+        values = zip(('mean', 'p99', 'max'), (histogram['mean'], histogram['p99'], histogram['max']))
+        lines.append(f"{name:<24} {histogram['count']:>8}  " + "  ".join(
+            f"{label} {value * 1000:8.2f}ms" + (f" {value / budget:6.1%}" if budget else '') for label, value in values))
+    return lines
+
+
+def budget_report(metrics, budget, names, over_budget='dsp_chunks_over_budget'):
+    """Timings of the per-chunk steps against the real-time budget of one chunk in seconds."""
+    chunks = metrics.histogram(names[0]).count
+    over = metrics.counter(over_budget).value
+    header = f"Chunk budget {budget * 1000:.1f}ms, {over} of {chunks} chunks over it:"
+    return "\n".join([header] + timing_report(metrics, names, budget))
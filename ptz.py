@@ -1,224 +1,243 @@
 #*****************************************************************************
 #IP Camera control
 #Control methods:
-#   rtsp video streaming via OpenCV for frame capture
-#   ONVIF for PTZ control
-#   ONVIF for setup selections
+#   ONVIF for PTZ control, positions stored as camera presets
 #
 # Starting point for this code was from:
 # https://github.com/quatanium/python-onvif
 #*****************************************************************************
 
-from onvif import ONVIFCamera
-from time import sleep
-import logging
 import os
+import threading
+import time
+import requests
 from dotenv import load_dotenv
-import signal
-
-# Define a timeout handler
-class TimeoutError(Exception):
-    pass
-
-def timeout_handler(signum, frame):
-    raise TimeoutError("Connection timed out")
-
-class ptzcam():
-    def __init__(self, verbose=False, timeout=5):
-        self.verbose = verbose
-        if(self.verbose):
-            logging.basicConfig(level=logging.DEBUG)
-        
-        logging.debug('IP camera initialization')
-
+from onvif import ONVIFCamera, ONVIFService
+from zeep.cache import SqliteCache
+from zeep.transports import Transport
+from log import as_logger
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'onvif-zeep.db')
+
+class CachedONVIFCamera(ONVIFCamera):
+    """
+    ONVIFCamera that takes the zeep clients of its services from
+    `zeep_clients`, so a reconnect reuses the parsed WSDLs instead of
+    parsing them again.
+    """
+
+    def __init__(self, *args, zeep_clients=None, **kwargs):
+        self.zeep_clients = {} if zeep_clients is None else zeep_clients
+        super().__init__(*args, **kwargs)
+
+    def create_onvif_service(self, name, from_template=True, portType=None):
+        name = name.lower()
+        xaddr, wsdl_file, binding_name = self.get_definition(name, portType)
+        key = (wsdl_file, binding_name)
+        zeep_client = self.zeep_clients.get(key)
+        with self.services_lock:
+            service = ONVIFService(xaddr, self.user, self.passwd, wsdl_file, self.encrypt, self.daemon,
+                                   zeep_client=zeep_client, no_cache=self.no_cache, portType=portType,
+                                   dt_diff=self.dt_diff, binding_name=binding_name, transport=self.transport)
+            self.services[name] = service
+            setattr(self, name, service)
+        self.zeep_clients.setdefault(key, service.zeep_client)
+        return service
+
+
+class CameraSession:
+    """
+    Thread-safe ONVIF PTZ session that connects lazily and moves with presets.
+
+    Nothing is sent to the camera until the first move. Connecting takes the
+    device capabilities and the media profile and looks up the ONVIF presets
+    named after the positions, so switching to a position is a single
+    GotoPreset. A position that is not stored on the camera, or stored at a
+    different place, is reached with an AbsoluteMove instead. Presets are
+    only stored by register_presets(), i.e. `python ptz.py --register`,
+    which drives the camera to each of them; moving and reconnecting never
+    do. All calls go through one pooled HTTP session with
+    per-call socket timeouts, so the session can be used from any thread.
+    The parsed WSDLs are kept for the life of the session and the XML
+    schemas they import are cached on disk at `cache_path`. When a call
+    fails the connection is dropped and made again by the next call.
+
+    Args:
+        presets: Dict of position name to {'pan', 'tilt', 'zoom'}, e.g. from
+            camera_positions.json
+        logging_queue: Queue or Logger for logging messages
+        host: Camera address, defaults to CAMERA_IP
+        port: ONVIF port, defaults to CAMERA_PORT
+        user: Defaults to CAMERA_USERNAME
+        password: Defaults to CAMERA_PASSWORD
+        timeout: Socket timeout of every call in seconds
+        cache_path: SQLite file caching downloaded XML schemas
+        settle_time: Seconds to let the camera reach a position before
+            storing it as a preset
+        tolerance: Largest difference between a preset on the camera and
+            its configured position for the preset to be used
+    """
+
+    def __init__(self, presets=None, logging_queue=None, host=None, port=None, user=None, password=None, timeout=5, cache_path=DEFAULT_CACHE_PATH, settle_time=3, tolerance=0.01):
         load_dotenv()
-        
-        # Set up the timeout
-        signal.signal(signal.SIGALRM, timeout_handler)
-        signal.alarm(timeout)  # Set a timeout
-        
+        self.presets = presets or {}
+        self.log = as_logger(logging_queue, 'camera') if logging_queue is not None else None
+        self.host = host or os.getenv('CAMERA_IP')
+        self.port = int(port or os.getenv('CAMERA_PORT', 80))
+        self.user = user or os.getenv('CAMERA_USERNAME', '')
+        self.password = password or os.getenv('CAMERA_PASSWORD', '')
+        self.timeout = timeout
+        self.cache_path = cache_path
+        self.settle_time = settle_time
+        self.tolerance = tolerance
+        self.camera = None
+        self.ptz = None
+        self.profile_token = None
+        self.preset_tokens = {}
+        self.connects = 0
+        self._transport = None
+        self._zeep_clients = {}
+        self._lock = threading.RLock()
+
+    def _info(self, message, **fields):
+        if self.log:
+            self.log.info(message, **fields)
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            cache = None
+            if self.cache_path:
+                os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+                cache = SqliteCache(path=self.cache_path, timeout=None)
+            self._transport = Transport(cache=cache, timeout=self.timeout, operation_timeout=self.timeout, session=requests.Session())
+        return self._transport
+
+    def connect(self):
+        with self._lock:
+            if self.ptz is not None:
+                return
+            started = time.monotonic()
+            camera = CachedONVIFCamera(self.host, self.port, self.user, self.password, transport=self.transport, zeep_clients=self._zeep_clients)
+            media = camera.create_media_service()
+            profile_token = media.GetProfiles()[0].token
+            ptz = camera.create_ptz_service()
+            self.camera, self.ptz, self.profile_token = camera, ptz, profile_token
+            self.connects += 1
+            self._info(f"Connected to camera {self.host}:{self.port} in {time.monotonic() - started:.1f}s", host=self.host)
+            try:
+                self.lookup_presets()
+            except Exception:
+                self.disconnect()
+                raise
+
+    def disconnect(self):
+        with self._lock:
+            self.camera = self.ptz = self.profile_token = None
+            self.preset_tokens = {}
+
+    def update_presets(self, presets):
+        """Use changed positions; their presets are looked up again on the next move."""
+        with self._lock:
+            self.presets = presets
+            self.disconnect()
+
+    def existing_presets(self):
+        return {preset.Name: preset for preset in self.ptz.GetPresets({'ProfileToken': self.profile_token}) or []}
+
+    def lookup_presets(self):
+        """Take the tokens of the presets that match the configured positions; never moves the camera."""
+        existing = self.existing_presets()
+        missing = []
+        for name, position in self.presets.items():
+            preset = existing.get(name)
+            if preset is not None and self._matches(preset, position):
+                self.preset_tokens[name] = preset.token
+            else:
+                missing.append(name)
+        if missing:
+            self._info(f"Camera positions {', '.join(missing)} are not stored as presets, moving there with AbsoluteMove; run 'python ptz.py --register' to store them", missing=missing)
+
+    def register_presets(self):
+        """
+        Store every configured position as a preset on the camera, unless it
+        is there already. The camera is driven to each position it stores,
+        so only call this while nothing is being recorded.
+        """
+        with self._lock:
+            self.connect()
+            existing = self.existing_presets()
+            for name, position in self.presets.items():
+                preset = existing.get(name)
+                if preset is not None and self._matches(preset, position):
+                    continue
+                self._absolute_move(position)
+                time.sleep(self.settle_time)
+                request = {'ProfileToken': self.profile_token, 'PresetName': name}
+                if preset is not None:
+                    request['PresetToken'] = preset.token
+                self.preset_tokens[name] = self.ptz.SetPreset(request)
+                self._info(f"Stored camera position '{name}' as preset {self.preset_tokens[name]}", preset=name)
+
+    def _matches(self, preset, position):
         try:
-            self.mycam = ONVIFCamera(os.getenv('CAMERA_IP'), int(os.getenv('CAMERA_PORT')), os.getenv('CAMERA_USERNAME'), os.getenv('CAMERA_PASSWORD'))
-            logging.debug('Connected to ONVIF camera')
-            # Create media service object
-            self.media = self.mycam.create_media_service()
-            logging.debug('Created media service object')
-            # Get target profile
-            self.media_profile = self.media.GetProfiles()[0]
-            # Use the first profile and Profiles have at least one
-            token = self.media_profile.token
-
-            #PTZ controls  -------------------------------------------------------------
-            logging.debug('Creating PTZ object')
-            self.ptz = self.mycam.create_ptz_service()
-            logging.debug('Created PTZ service object')
-
-
-            #Get available PTZ services
-            request = self.ptz.create_type('GetServiceCapabilities')
-            Service_Capabilities = self.ptz.GetServiceCapabilities(request)
-            logging.debug('PTZ service capabilities:')
-            logging.debug(Service_Capabilities)
-
-            #Get PTZ status
-            status = self.ptz.GetStatus({'ProfileToken':token})
-            logging.debug('PTZ status:')
-            logging.debug(status)
-            logging.debug('Pan position:', status.Position.PanTilt.x)
-            logging.debug('Tilt position:', status.Position.PanTilt.y)
-            logging.debug('Zoom position:', status.Position.Zoom.x)
-            logging.debug('Pan/Tilt Moving?:', status.MoveStatus.PanTilt)
-
-            # Get PTZ configuration options for getting option ranges
-            request = self.ptz.create_type('GetConfigurationOptions')
-            request.ConfigurationToken = self.media_profile.PTZConfiguration.token
-            ptz_configuration_options = self.ptz.GetConfigurationOptions(request)
-            logging.debug('PTZ configuration options:')
-            logging.debug(ptz_configuration_options)
-
-            self.requestc = self.ptz.create_type('ContinuousMove')
-            self.requestc.ProfileToken = self.media_profile.token
-            self.requestc.Velocity = {}
-
-            self.requesta = self.ptz.create_type('AbsoluteMove')
-            self.requesta.ProfileToken = self.media_profile.token
-            logging.debug('Absolute move options')
-            logging.debug(self.requesta)
-
-            self.requestr = self.ptz.create_type('RelativeMove')
-            self.requestr.ProfileToken = self.media_profile.token
-            logging.debug('Relative move options')
-            logging.debug(self.requestr)
-
-            self.requests = self.ptz.create_type('Stop')
-            self.requests.ProfileToken = self.media_profile.token
-
-            self.requestp = self.ptz.create_type('SetPreset')
-            self.requestp.ProfileToken = self.media_profile.token
-
-            self.requestg = self.ptz.create_type('GotoPreset')
-            self.requestg.ProfileToken = self.media_profile.token
-
-            logging.debug('Initial PTZ stop')
-            self.stop()
-
-            # Cancel the alarm if everything went well
-            signal.alarm(0)
-            
-        except TimeoutError as e:
-            logging.error(f"Camera connection timed out: {e}")
-            signal.alarm(0)  # Cancel the alarm
-            raise
-        except Exception as e:
-            logging.error(f"Failed to initialize camera: {e}")
-            signal.alarm(0)  # Cancel the alarm
-            raise
-
-#Stop pan, tilt and zoom
+            current = preset.PTZPosition
+            values = (current.PanTilt.x, current.PanTilt.y, current.Zoom.x)
+        except AttributeError:
+            return False
+        return all(abs(a - b) <= self.tolerance for a, b in zip(values, (position['pan'], position['tilt'], position['zoom'])))
+
+    def _absolute_move(self, position):
+        self.ptz.AbsoluteMove({
+            'ProfileToken': self.profile_token,
+            'Position': {'PanTilt': {'x': position['pan'], 'y': position['tilt']}, 'Zoom': {'x': position['zoom']}},
+        })
+
+    def goto(self, name, position=None):
+        """Move to a named position: one GotoPreset, or one AbsoluteMove if it is not a preset."""
+        with self._lock:
+            try:
+                self.connect()
+                token = self.preset_tokens.get(name)
+                if token is not None:
+                    self.ptz.GotoPreset({'ProfileToken': self.profile_token, 'PresetToken': token})
+                else:
+                    self._absolute_move(position or self.presets[name])
+            except Exception:
+                self.disconnect()
+                raise
+
     def stop(self):
-        self.requests.PanTilt = True
-        self.requests.Zoom = True
-        logging.debug('Stop:')
-        #logging.debug(self.requests)
-        self.ptz.Stop(self.requests)
-        logging.debug('Stopped')
-
-#Continuous move functions
-    def perform_move(self, timeout):
-        # Start continuous move
-        # self.requestc.ProfileToken = self.media_profile.token
-        ret = self.ptz.ContinuousMove(self.requestc)
-        logging.debug('Continuous move completed', ret)
-        # Wait a certain time
-        sleep(timeout)
-        # Stop continuous move
-        self.stop()
-        sleep(2)
-
-    def move_tilt(self, velocity, timeout):
-        logging.debug('Move tilt...', velocity)
-        self.requestc.Velocity = {
-            "PanTilt": {
-                "x": 0.0,
-                "y": velocity
-            }
-        }
-        self.perform_move(timeout)
-
-    def move_pan(self, velocity, timeout):
-        logging.debug('Move pan...', velocity)
-        self.requestc.Velocity = {
-            "PanTilt": {
-                "x": velocity,
-                "y": 0.0
-            }
-        }
-        self.perform_move(timeout)
-
-    def zoom(self, velocity, timeout=0):
-        logging.debug('Zoom...', velocity)
-        self.requestc.Velocity = {
-            "Zoom": {
-                "x": velocity
-            }
-        }
-        self.perform_move(timeout)
-
-#Absolute move functions --NO ERRORS BUT CAMERA DOES NOT MOVE
-    def move_abspantilt(self, pan, tilt, velocity):
-        self.requesta.Position = {
-            "PanTilt": {
-                "x": pan,
-                "y": tilt
-            }
-        }
-        self.requesta.Speed = {
-            "PanTilt": {
-                "x": velocity,
-                "y": velocity
-            }
-        }
-        logging.debug('Absolute move to:', self.requesta.Position)
-        logging.debug('Absolute speed:',self.requesta.Speed)
-        ret = self.ptz.AbsoluteMove(self.requesta)
-        logging.debug('Absolute move pan-tilt requested:', pan, tilt, velocity)
-        logging.debug('Absolute move completed', ret)
-
-
-#Relative move functions --NO ERRORS BUT CAMERA DOES NOT MOVE
-    def move_relative(self, pan, tilt, velocity):
-        self.requestr.Translation = {
-            "PanTilt": {
-                "x": pan,
-                "y": tilt
-            }
-        }
-        self.requestr.Speed = {
-            "PanTilt": {
-                "x": velocity,
-                "y": velocity
-            }
-        }
-        self.ptz.RelativeMove(self.requestr)
-        logging.debug('Relative move pan-tilt', pan, tilt, velocity)
-        sleep(2.0)
-        logging.debug('Relative move completed')
-
-#Sets preset set, query and and go to
-    def set_preset(self, name):
-        self.requestp.PresetName = name
-        self.requestp.PresetToken = '1'
-        self.preset = self.ptz.SetPreset(self.requestp)  #returns the PresetToken
-        logging.debug('Set Preset:')
-        logging.debug(self.preset)
-
-    def get_preset(self):
-        self.ptzPresetsList = self.ptz.GetPresets({'ProfileToken': self.media_profile.token})
-        logging.debug('Got preset:')
-        logging.debug(self.ptzPresetsList[0])
-
-    def goto_preset(self, name):
-        self.requestg.PresetToken = '1'
-        self.ptz.GotoPreset(self.requestg)
-        logging.debug('Going to Preset:')
-        logging.debug(name)
+        with self._lock:
+            if self.ptz is not None:
+                self.ptz.Stop({'ProfileToken': self.profile_token, 'PanTilt': True, 'Zoom': True})
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import queue
+    from log import log_message
+    parser = argparse.ArgumentParser(description='Move the PTZ camera to a position from camera_positions.json')
+    parser.add_argument('name', nargs='?', help='position to move to', default=None)
+    parser.add_argument('--register', help='store the positions that are missing or moved as presets on the camera first; this drives the camera to each of them', action='store_true')
+    parser.add_argument('--host', help='camera address (default: CAMERA_IP)', default=None)
+    parser.add_argument('--port', help='ONVIF port (default: CAMERA_PORT)', default=None, type=int)
+    parser.add_argument('--positions', help='JSON file with the named positions', default='camera_positions.json')
+    parser.add_argument('--settle', help='seconds to wait at a position before storing it as a preset', default=3, type=float)
+    args = parser.parse_args()
+
+    with open(args.positions) as f:
+        positions = json.load(f)
+    logging_queue = queue.Queue()
+    threading.Thread(target=log_message, args=(logging_queue,), daemon=True).start()
+    session = CameraSession(positions, logging_queue, host=args.host, port=args.port, settle_time=args.settle)
+    started = time.monotonic()
+    session.connect()
+    if args.register:
+        session.register_presets()
+    connected = time.monotonic()
+    if args.name:
+        session.goto(args.name)
+        print(f"Connected in {connected - started:.2f}s, moved to '{args.name}' in {time.monotonic() - connected:.3f}s")
+    logging_queue.join()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+import numpy as np
+
+
+class FileSource:
+    """
+    Stands in for a PyAudio input stream and plays back a 16-bit WAV file.
+
+    read() has the same signature as pyaudio.Stream.read and raises EOFError
+    at the end of the file, which stops the recorder's pipeline. Only the
+    first `channels` channels of the file are returned. By default the file
+    is read as fast as the recorder can consume it; `realtime` paces it like
+    a device. `start_time` is the wall-clock time the replay started; the
+    recorder names segments after it plus their position in the file.
+    """
+
+    def __init__(self, path, realtime=False, channels=1):
+        self.wave = wave.open(path, 'rb')
+        if self.wave.getsampwidth() != 2:
+            raise ValueError(f"{path} must be 16-bit PCM")
+        self.file_channels = self.wave.getnchannels()
+        if channels > self.file_channels:
+            raise ValueError(f"{path} has {self.file_channels} channels, {channels} requested")
+        self.channels = channels
+        self.sample_rate = self.wave.getframerate()
+        self.realtime = realtime
+        self.overruns = 0
+        self.frames_read = 0
+        self.started = time.monotonic()
+        self.start_time = time.time()
+
+    @staticmethod
+    def probe(path):
+        with wave.open(path, 'rb') as f:
+            return f.getframerate(), f.getnframes() / f.getframerate()
+
+    def read(self, num_frames, exception_on_overflow=False):
+        data = self.wave.readframes(num_frames)
+        if len(data) < num_frames * self.file_channels * 2:
+            raise EOFError
+        if self.file_channels > self.channels:
+            data = np.frombuffer(data, np.int16).reshape(-1, self.file_channels)[:, :self.channels].tobytes()
+        self.frames_read += num_frames
+        if self.realtime:
+            delay = self.started + self.frames_read / self.sample_rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return data
+
+    def close(self):
+        self.wave.close()
+
+
+def load_annotations(path):
+    """Read `<recording>.json` ground truth: [[start, end], ...] or [{'start', 'end'}, ...] in seconds."""
+    annotations = os.path.splitext(path)[0] + '.json'
+    if not os.path.exists(annotations):
+        return None
+    with open(annotations) as f:
+        segments = json.load(f)
+    if isinstance(segments, dict):
+        segments = segments['segments']
+    return [(s['start'], s['end']) if isinstance(s, dict) else tuple(s) for s in segments]
+
+
+def match_segments(detected, truth):
+    """Pair each true segment with the unused detected segment overlapping it most."""
+    used = set()
+    pairs = []
+    for t_start, t_end in truth:
+        best, best_overlap = None, 0
+        for i, (d_start, d_end) in enumerate(detected):
+            overlap = min(t_end, d_end) - max(t_start, d_start)
+            if i not in used and overlap > best_overlap:
+                best, best_overlap = i, overlap
+        if best is not None:
+            used.add(best)
+            pairs.append(((t_start, t_end), detected[best]))
+    return pairs, len(truth) - len(pairs), len(detected) - len(used)
+
+
+def run_file(path, options):
+    """Replay one file through AudioRecorder; runs in a worker process."""
+    import resource
+    from audio_recorder import AudioRecorder
+
+    sample_rate, duration = FileSource.probe(path)
+    with tempfile.TemporaryDirectory() as output_dir:
+        recorder = AudioRecorder(
+            device_index=None,
+            input_file=path,
+            sample_rate=sample_rate,
+            output_dir=output_dir,
+            min_silence_duration_sec=options['silence'],
+            min_record_time_sec=options['min_record_time'],
+            padding_ms=options['padding_ms'],
+            vad_threshold=options['threshold'],
+            vad_gate_dbfs=options['gate_db'],
+            adaptive_vad=options.get('adaptive', False),
+            adaptive_min_silence_sec=options.get('adaptive_min_silence', 5),
+            stats_interval=None
+        )
+        wall_started, cpu_started = time.perf_counter(), time.process_time()
+        recorder.start_recording()
+        wall, cpu = time.perf_counter() - wall_started, time.process_time() - cpu_started
+
+    return {
+        'file': path,
+        'duration': duration,
+        'wall': wall,
+        'cpu': cpu,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'inference_calls': recorder.vad_iterator.inference_calls,
+        'gated_batches': recorder.vad_iterator.gated_batches,
+        'segments': [(start, end if end is not None else duration) for start, end in recorder.detected_segments],
+        'close_delays': recorder.close_delays,
+        'vad_state': recorder.vad_state(),
+    }
+
+
+def replay(files, options, verbose=False):
+    results = []
+    for path in files:
+        with tempfile.NamedTemporaryFile(suffix='.json') as result:
+            # A fresh process per file keeps peak RSS per recording
+            cmd = [sys.executable, os.path.abspath(__file__), '--worker', result.name, '--options', json.dumps(options), path]
+            subprocess.run(cmd, check=True, stdout=None if verbose else subprocess.DEVNULL)
+            with open(result.name) as f:
+                results.append(json.load(f))
+    return results
+
+
+def report(results, tolerance):
+    total_duration = sum(r['duration'] for r in results)
+    start_errors, end_errors, misses, false_alarms, truths = [], [], 0, 0, 0
+    for r in results:
+        print(f"{os.path.basename(r['file'])}: {r['duration']:.0f}s audio, "
+              f"real-time factor {r['wall'] / r['duration']:.4f} ({r['duration'] / r['wall']:.0f}x), "
+              f"CPU {r['cpu'] / r['duration'] * 1000:.1f} ms per audio second, peak RSS {r['peak_rss_mb']:.0f} MB, "
+              f"{r['inference_calls']} VAD calls, {r['gated_batches']} gated")
+        if r['close_delays']:
+            print(f"    segments closed {np.mean(r['close_delays']):.1f}s after speech ended on average")
+        if r['vad_state']:
+            print(f"    adaptive VAD ended at {r['vad_state']}")
+        truth = load_annotations(r['file'])
+        for start, end in r['segments']:
+            print(f"    detected {start:9.1f}s - {end:9.1f}s")
+        if truth is None:
+            continue
+        pairs, missed, extra = match_segments(r['segments'], truth)
+        truths += len(truth)
+        misses += missed
+        false_alarms += extra
+        for (t_start, t_end), (d_start, d_end) in pairs:
+            start_errors.append(d_start - t_start)
+            end_errors.append(d_end - t_end)
+            flag = '' if abs(d_start - t_start) <= tolerance and abs(d_end - t_end) <= tolerance else '  <-- outside tolerance'
+            print(f"    truth {t_start:9.1f}s - {t_end:9.1f}s, start {d_start - t_start:+6.1f}s, end {d_end - t_end:+6.1f}s{flag}")
+        print(f"    {missed} missed, {extra} false alarms")
+
+    wall = sum(r['wall'] for r in results)
+    cpu = sum(r['cpu'] for r in results)
+    close_delays = [delay for r in results for delay in r['close_delays']]
+    print(f"\nTotal: {total_duration:.0f}s audio in {wall:.1f}s (real-time factor {wall / total_duration:.4f}), "
+          f"CPU {cpu / total_duration * 1000:.1f} ms per audio second, max peak RSS {max(r['peak_rss_mb'] for r in results):.0f} MB, "
+          f"mean close delay {np.mean(close_delays) if close_delays else 0:.1f}s")
+    if truths:
+        within = sum(1 for s, e in zip(start_errors, end_errors) if abs(s) <= tolerance and abs(e) <= tolerance)
+        print(f"Boundaries: {truths} annotated segments, {misses} missed, {false_alarms} false alarms, "
+              f"{within} within ±{tolerance}s, mean |start error| {np.mean(np.abs(start_errors)) if start_errors else 0:.2f}s, "
+              f"mean |end error| {np.mean(np.abs(end_errors)) if end_errors else 0:.2f}s")
+
+
+def find_recordings(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith('.wav'))
+        else:
+            files.append(path)
+    return files
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Replay recorded services through the recorder faster than real time and score the segmentation')
+    parser.add_argument('paths', nargs='+', help='WAV files or directories of WAV files; ground truth is read from <name>.json')
+    parser.add_argument('-s', '--silence', help='period of silence (in seconds) after which recording gets saved', default=15, type=int)
+    parser.add_argument('-m', '--min-record-time', help='minimum recording time (in seconds)', default=15, type=int)
+    parser.add_argument('--padding-ms', help='audio kept before the detected speech start (in milliseconds)', default=1000, type=int)
+    parser.add_argument('--vad-threshold', help='speech probability that starts a segment', default=0.9965, type=float)
+    parser.add_argument('--adaptive-vad', help='replay with the adaptive VAD thresholds and closing silence', action='store_true')
+    parser.add_argument('--adaptive-min-silence', help='shortest closing silence (in seconds) with --adaptive-vad', default=5, type=float)
+    parser.add_argument('--vad-gate-db', help='skip VAD inference on windows quieter than this level in dBFS', default=-60, type=float)
+    parser.add_argument('-t', '--tolerance', help='allowed boundary error in seconds', default=2.0, type=float)
+    parser.add_argument('-v', '--verbose', help='show the recorder log', action='store_true')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--options', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_file(args.paths[0], json.loads(args.options))
+        with open(args.worker, 'w') as f:
+            json.dump(result, f)
+        sys.exit(0)
+
+    options = {
+        'silence': args.silence,
+        'min_record_time': args.min_record_time,
+        'padding_ms': args.padding_ms,
+        'threshold': args.vad_threshold,
+        'gate_db': args.vad_gate_db,
+        'adaptive': args.adaptive_vad,
+        'adaptive_min_silence': args.adaptive_min_silence,
+    }
+    report(replay(find_recordings(args.paths), options, args.verbose), args.tolerance)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+import numpy as np
+from math import ceil, gcd
+from numpy.lib.stride_tricks import as_strided
+
+
+def sinc_kernel(orig_freq, new_freq, lowpass_filter_width=6, rolloff=0.99):
+    """
+    Polyphase windowed-sinc kernel, numerically the same as the one
+    torchaudio.functional.resample builds with its default
+    `sinc_interp_hann` method. Frequencies must already be reduced by their
+    gcd. Returns a (new_freq, taps) float32 matrix and the padding width.
+    """
+    base_freq = min(orig_freq, new_freq) * rolloff
+    width = ceil(lowpass_filter_width * orig_freq / base_freq)
+    idx = np.arange(-width, width + orig_freq, dtype=np.float64)[None, :] / orig_freq
+    t = (-np.arange(new_freq, dtype=np.float64)[:, None] / new_freq + idx) * base_freq
+    t = np.clip(t, -lowpass_filter_width, lowpass_filter_width)
+    window = np.cos(t * np.pi / lowpass_filter_width / 2) ** 2
+    t *= np.pi
+    scale = base_freq / orig_freq
+    with np.errstate(invalid='ignore', divide='ignore'):
+        kernels = np.where(t == 0, 1.0, np.sin(t) / t)
+    kernels *= window * scale
+    return kernels.astype(np.float32), width
+
+
+class StreamingResampler:
+    """
+    Stateful polyphase resampler for a continuous stream of float32 chunks.
+
+    The kernel is built once and the filter history is carried from one
+    chunk to the next, so a stream resampled chunk by chunk is identical to
+    resampling the whole recording at once with torchaudio. Chunks of any
+    length may be pushed; each call returns every output sample that can be
+    computed so far (a multiple of the reduced output rate, possibly empty).
+
+    Capturing at 48 kHz gives an integer 3:1 ratio to 16 kHz, which needs a
+    single 41-tap phase instead of 160 phases of 475 taps. That phase is
+    applied as one dot product over a strided view of the input, without
+    gathering the overlapping windows into a copy first. On the live path
+    the per-chunk copies dominate, so process() costs about the same at
+    either rate.
+
+    process() is the allocation-free variant used on the live path: it works
+    in two preallocated buffers that take turns holding the history and
+    returns a view of an output buffer that is overwritten by the next call.
+    """
+
+    def __init__(self, orig_freq, new_freq, lowpass_filter_width=6, rolloff=0.99):
+        divisor = gcd(int(orig_freq), int(new_freq))
+        self.orig = int(orig_freq) // divisor
+        self.new = int(new_freq) // divisor
+        self.kernel, self.width = sinc_kernel(self.orig, self.new, lowpass_filter_width, rolloff)
+        self.kernel_t = np.ascontiguousarray(self.kernel.T)
+        self.taps = self.kernel.shape[1]
+        # With an integer ratio there is one phase and every output sample is a dot product with it
+        self.phase = self.kernel[0].copy() if self.new == 1 else None
+        self._work = None
+        self._active = 0
+        self.reset()
+
+    def reset(self):
+        self.history = np.zeros(self.width, dtype=np.float32)
+        self.samples_in = 0
+        self.samples_out = 0
+
+    def __call__(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float32)
+        self.samples_in += len(chunk)
+        buffer = np.concatenate((self.history, chunk))
+        frames = (len(buffer) - self.taps) // self.orig + 1 if len(buffer) >= self.taps else 0
+        if frames <= 0:
+            self.history = buffer
+            return np.zeros(0, dtype=np.float32)
+        stride = buffer.strides[0]
+        windows = as_strided(buffer, shape=(frames, self.taps), strides=(self.orig * stride, stride), writeable=False)
+        out = np.dot(windows, self.phase) if self.phase is not None else (windows @ self.kernel_t).ravel()
+        self.history = buffer[frames * self.orig:].copy()
+        self.samples_out += len(out)
+        return out
+
+    def process(self, chunk):
+        """Same as calling the resampler, without allocating once the buffers fit the chunk size."""
+        history = len(self.history)
+        size = history + len(chunk)
+        if self._work is None or len(self._work[0]) < size:
+            self._work = [np.zeros(max(size, self.taps), dtype=np.float32) for _ in range(2)]
+            max_frames = (len(self._work[0]) - self.taps) // self.orig + 1
+            stride = self._work[0].strides[0]
+            self._strided = [as_strided(buffer, shape=(max_frames, self.taps), strides=(self.orig * stride, stride), writeable=False) for buffer in self._work]
+            self._out = np.zeros(max_frames * self.new, dtype=np.float32)
+            # matmul would copy the overlapping windows into a temporary
+            # array on every call; they are gathered here instead
+            self._windows = np.zeros((max_frames, self.taps), dtype=np.float32)
+        # The history is a view of the other buffer, so the copies never overlap
+        buffer, strided = self._work[self._active], self._strided[self._active]
+        self._active ^= 1
+        buffer[:history] = self.history
+        buffer[history:size] = chunk
+        self.samples_in += len(chunk)
+        frames = (size - self.taps) // self.orig + 1 if size >= self.taps else 0
+        if frames <= 0:
+            self.history = buffer[:size]
+            return self._out[:0]
+        out = self._out[:frames * self.new]
+        if self.phase is not None:
+            np.dot(strided[:frames], self.phase, out=out)
+        else:
+            gathered = self._windows[:frames]
+            np.copyto(gathered, strided[:frames])
+            np.matmul(gathered, self.kernel_t, out=out.reshape(frames, self.new))
+        self.history = buffer[frames * self.orig:size]
+        self.samples_out += len(out)
+        return out
+
+    def flush(self):
+        """Emit the tail of the stream, as torchaudio does at the end of a signal."""
+        expected = ceil(self.new * self.samples_in / self.orig)
+        tail = self(np.zeros(self.width + self.orig, dtype=np.float32))
+        self.samples_in -= self.width + self.orig
+        tail = tail[:max(0, expected - (self.samples_out - len(tail)))]
+        self.samples_out = expected
+        return tail
+
+
+def _benchmark(seconds, chunk, file=None):
+    import time
+    if file:
+        import soundfile
+        signal, rate = soundfile.read(file, dtype='float32', always_2d=True)
+        signal = signal[:, 0]
+    else:
+        rate = 44100
+        rng = np.random.default_rng(0)
+        t = np.arange(int(seconds * rate)) / rate
+        signal = (0.3 * np.sin(2 * np.pi * 220 * t) + 0.05 * rng.standard_normal(len(t))).astype(np.float32)
+    duration = len(signal) / rate
+    chunks = [signal[i:i + chunk] for i in range(0, len(signal), chunk)]
+
+    def measure(label, fn):
+        started = time.process_time()
+        out = fn()
+        cpu = time.process_time() - started
+        print(f"{label:<40} {cpu / duration * 1000:8.3f} ms CPU per audio second")
+        return out
+
+    resampler = StreamingResampler(rate, 16000)
+    streamed = measure(f"streaming polyphase {rate}->16000", lambda: np.concatenate([resampler(c) for c in chunks] + [resampler.flush()]))
+    live = StreamingResampler(rate, 16000)
+    measure(f"process() {rate}->16000", lambda: [live.process(c) for c in chunks])
+
+    if rate == 44100:
+        t48 = np.arange(int(duration * 48000)) / 48000
+        signal48 = np.interp(t48, np.arange(len(signal)) / rate, signal).astype(np.float32)
+        chunks48 = [signal48[i:i + chunk] for i in range(0, len(signal48), chunk)]
+        resampler48 = StreamingResampler(48000, 16000)
+        measure("streaming polyphase 48000->16000", lambda: np.concatenate([resampler48(c) for c in chunks48]))
+        live48 = StreamingResampler(48000, 16000)
+        measure("process() 48000->16000", lambda: [live48.process(c) for c in chunks48])
+
+    try:
+        import torch
+        from torchaudio import functional
+    except ImportError:
+        print("torch/torchaudio not installed, skipping comparison with the current path")
+        return
+    torch.set_num_threads(1)
+    per_chunk = measure("torchaudio resample per chunk (current)", lambda: np.concatenate(
+        [functional.resample(torch.from_numpy(c), rate, 16000).numpy() for c in chunks]))
+    whole = functional.resample(torch.from_numpy(signal), rate, 16000).numpy()
+
+    def compare(label, a, b):
+        n = min(len(a), len(b))
+        diff = a[:n] - b[:n]
+        snr = 10 * np.log10(np.sum(b[:n] ** 2) / max(np.sum(diff ** 2), 1e-30))
+        print(f"{label:<40} max abs diff {np.abs(diff).max():.2e}, SNR {snr:.1f} dB")
+
+    compare("streaming vs torchaudio whole signal", streamed, whole)
+    compare("per-chunk (current) vs whole signal", per_chunk, whole)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the streaming resampler against torchaudio')
+    parser.add_argument('-s', '--seconds', help='length of the synthetic test signal', default=60, type=float)
+    parser.add_argument('-c', '--chunk', help='samples per chunk', default=1536, type=int)
+    parser.add_argument('-f', '--file', help='benchmark on a WAV file instead of a synthetic signal', default=None)
+    args = parser.parse_args()
+    _benchmark(args.seconds, args.chunk, args.file)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+import os
+import struct
+import time
+import wave
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil, gcd
+from helpers import create_folder_if_not_exists
+from resampler import StreamingResampler
+from silero_onnx import DEFAULT_MODEL_PATH, SileroOnnxModel
+from vad_engine import VadEngine
+
+VAD_SAMPLE_RATE = 16000
+WINDOW = 512
+
+_model = None
+
+
+def open_wav_memmap(path):
+    """Memory-map the PCM data of a 16-bit WAV file as a (frames, channels) array."""
+    with open(path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(f"{path} is not a WAV file")
+        channels = sample_rate = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                fmt = f.read(size)
+                _, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+                if bits != 16:
+                    raise ValueError(f"{path} must be 16-bit PCM")
+            elif chunk_id == b'data':
+                offset = f.tell()
+                break
+            else:
+                f.seek(size + (size & 1), os.SEEK_CUR)
+    frames = (os.path.getsize(path) - offset) // (2 * channels)
+    data = np.memmap(path, dtype=np.int16, mode='r', offset=offset, shape=(frames, channels))
+    return data, sample_rate
+
+
+def _init_worker(model_path):
+    global _model
+    _model = SileroOnnxModel(model_path)
+
+
+def _chunk_probabilities(path, channel, start_batch, end_batch, warmup_batches, batch_windows, gate_dbfs):
+    """
+    Speech probabilities of model calls [start_batch, end_batch) of a file.
+
+    Each call scores `batch_windows` windows at once behind the RMS pre-gate,
+    exactly as the live VadEngine does. The model and the resampler start
+    `warmup_batches` earlier so that their state has settled by the first
+    call that is kept; the warm-up part overlaps the previous chunk and is
+    discarded.
+    """
+    data, sample_rate = open_wav_memmap(path)
+    resampler = StreamingResampler(sample_rate, VAD_SAMPLE_RATE)
+    batch = WINDOW * batch_windows
+    first_batch = max(0, start_batch - warmup_batches)
+    # Chunks start on batch indices where input and output samples align exactly
+    input_start = first_batch * batch // resampler.new * resampler.orig
+    input_end = min(len(data), ceil(end_batch * batch * resampler.orig / resampler.new) + resampler.taps)
+
+    audio = data[input_start:input_end, channel].astype(np.float32) / 32768
+    resampled = resampler(audio)
+    if input_end == len(data):
+        resampled = np.concatenate((resampled, resampler.flush()))
+
+    engine = VadEngine(lambda audio: _model(audio, VAD_SAMPLE_RATE), _model.reset_states, window_size_samples=WINDOW, batch_windows=batch_windows, gate_dbfs=gate_dbfs)
+    probabilities = [engine.probability(resampled[i * batch:(i + 1) * batch]) for i in range(end_batch - first_batch)]
+    return probabilities[start_batch - first_batch:]
+
+
+def resegment(path, model_path=DEFAULT_MODEL_PATH, channel=0, threshold=0.9965, min_silence_duration_sec=15, min_record_time_sec=15, padding_ms=1000, post_roll_ms=1000, batch_windows=3, gate_dbfs=-60, chunk_sec=600, overlap_sec=30, workers=None):
+    """
+    Find talks in a long recording with the live recorder's VAD rules.
+
+    The model calls are scored in parallel and then fed in order through the
+    same VadEngine start/end logic as a live recording, so the cuts, the
+    padding before the start and the post-roll after the end match what the
+    recorder would have saved. The adaptive VAD is not replayed. A talk still
+    open at the end of the file ends there.
+
+    Returns (segments, sample_rate) with segments as (start, end) frame
+    ranges of the original file.
+    """
+    data, sample_rate = open_wav_memmap(path)
+    resampler = StreamingResampler(sample_rate, VAD_SAMPLE_RATE)
+    batch = WINDOW * batch_windows
+    # The live engine keeps an incomplete last batch pending, so it is never scored
+    total_batches = len(data) * resampler.new // resampler.orig // batch
+
+    # Chunk and warm-up lengths are multiples of the batch count at which
+    # input and output sample positions line up
+    step = resampler.new // gcd(batch, resampler.new)
+    chunk_batches = max(step, int(chunk_sec * VAD_SAMPLE_RATE / batch) // step * step)
+    warmup_batches = int(overlap_sec * VAD_SAMPLE_RATE / batch) // step * step
+    chunks = [(start, min(start + chunk_batches, total_batches)) for start in range(0, total_batches, chunk_batches)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_path,)) as executor:
+        futures = [executor.submit(_chunk_probabilities, path, channel, start, end, warmup_batches, batch_windows, gate_dbfs) for start, end in chunks]
+        probabilities = [probability for future in futures for probability in future.result()]
+
+    engine = VadEngine(None, lambda: None, threshold=threshold, sampling_rate=VAD_SAMPLE_RATE, min_silence_duration_ms=min_silence_duration_sec * 1000, window_size_samples=WINDOW, batch_windows=batch_windows, gate_dbfs=None)
+    padding = int(sample_rate * padding_ms / 1000)
+    post_roll = int(sample_rate * post_roll_ms / 1000)
+    segments = []
+    start = None
+    for probability in probabilities:
+        speech_dict = engine.decide(probability, batch)
+        if speech_dict and 'start' in speech_dict:
+            start = max(0, vad_frame(speech_dict['start'], sample_rate) - padding)
+        elif speech_dict and 'end' in speech_dict:
+            segments.append((start, min(len(data), vad_frame(speech_dict['end'], sample_rate) + post_roll)))
+            start = None
+    if start is not None:
+        segments.append((start, len(data)))
+    return [(start, end) for start, end in segments if (end - start) / sample_rate >= min_record_time_sec], sample_rate
+
+
+def vad_frame(vad_sample, sample_rate):
+    return max(0, int(vad_sample) * sample_rate // VAD_SAMPLE_RATE)
+
+
+def write_segment(path, start, end, output_path, block_frames=441000):
+    data, sample_rate = open_wav_memmap(path)
+    with wave.open(output_path, 'wb') as wf:
+        wf.setnchannels(data.shape[1])
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        for block_start in range(start, end, block_frames):
+            wf.writeframes(data[block_start:min(end, block_start + block_frames)].tobytes())
+
+
+def format_time(seconds):
+    return '%dh%02dm%02ds' % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Split a long backup recording into talks with the recorder\'s VAD, using all cores')
+    parser.add_argument('input_file', help='16-bit WAV recording of the whole day')
+    parser.add_argument('-o', '--output-dir', help='where to write the segments', default='segments')
+    parser.add_argument('-s', '--silence', help='period of silence (in seconds) that ends a talk', default=15, type=int)
+    parser.add_argument('-m', '--min-record-time', help='minimum talk length (in seconds)', default=15, type=int)
+    parser.add_argument('--padding-ms', help='audio kept before the detected speech start (in milliseconds)', default=1000, type=int)
+    parser.add_argument('--post-roll-ms', help='audio kept after the detected speech end (in milliseconds)', default=1000, type=int)
+    parser.add_argument('--vad-threshold', help='speech probability that starts a talk', default=0.9965, type=float)
+    parser.add_argument('--vad-batch', help='512-sample VAD windows per model call (1-3), as set on the recorder', choices=[1, 2, 3], default=3, type=int)
+    parser.add_argument('--vad-gate-db', help='skip VAD inference on windows quieter than this level in dBFS, as set on the recorder', default=-60, type=float)
+    parser.add_argument('--vad-model', help='path to the silero ONNX model', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--channel', help='channel to run the VAD on', default=0, type=int)
+    parser.add_argument('--chunk', help='seconds of audio per worker task', default=600, type=int)
+    parser.add_argument('--overlap', help='seconds of warm-up overlap between chunks', default=30, type=int)
+    parser.add_argument('-j', '--workers', help='worker processes (default: all cores)', default=None, type=int)
+    parser.add_argument('-n', '--dry-run', help='only list the talks found', action='store_true')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    segments, sample_rate = resegment(
+        args.input_file,
+        model_path=args.vad_model,
+        channel=args.channel,
+        threshold=args.vad_threshold,
+        min_silence_duration_sec=args.silence,
+        min_record_time_sec=args.min_record_time,
+        padding_ms=args.padding_ms,
+        post_roll_ms=args.post_roll_ms,
+        batch_windows=args.vad_batch,
+        gate_dbfs=args.vad_gate_db,
+        chunk_sec=args.chunk,
+        overlap_sec=args.overlap,
+        workers=args.workers
+    )
+    print(f"Found {len(segments)} talks in {time.perf_counter() - started:.1f}s")
+
+    if not args.dry_run:
+        create_folder_if_not_exists(args.output_dir)
+    name = os.path.splitext(os.path.basename(args.input_file))[0]
+    for start, end in segments:
+        output_path = os.path.join(args.output_dir, f"speech-{name}-{format_time(start / sample_rate)}.wav")
+        print(f"{format_time(start / sample_rate)} - {format_time(end / sample_rate)} -> {output_path}")
+        if not args.dry_run:
+            write_segment(args.input_file, start, end, output_path)
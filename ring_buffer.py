@@ -0,0 +1,82 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Preallocated single-producer/single-consumer ring buffer of audio frames.
+
+    The producer only advances `written` and the consumer only advances
+    `read_position`, so neither side takes a lock. Both counters are absolute
+    frame positions since the buffer was created, which also lets callers
+    address past audio by position as long as it has not been overwritten.
+
+    Args:
+        capacity: Number of frames the buffer holds
+        channels: Number of interleaved channels per frame
+        dtype: Sample type
+    """
+
+    def __init__(self, capacity, channels=1, dtype=np.int16):
+        self.capacity = int(capacity)
+        self.channels = channels
+        self.buffer = np.zeros((self.capacity, channels), dtype=dtype)
+        self.written = 0
+        self.read_position = 0
+        self.overruns = 0
+        self.dropped_frames = 0
+
+    def write(self, frames):
+        frames = frames.reshape(-1, self.channels)
+        count = len(frames)
+        if count > self.capacity:
+            frames = frames[-self.capacity:]
+            self.written += count - self.capacity
+            count = self.capacity
+        start = self.written % self.capacity
+        first = min(count, self.capacity - start)
+        self.buffer[start:start + first] = frames[:first]
+        self.buffer[:count - first] = frames[first:]
+        # Publish only after the data is in place
+        self.written += count
+
+    def available(self):
+        return self.written - self.read_position
+
+    def oldest_position(self):
+        return max(0, self.written - self.capacity)
+
+    def read(self, count, out=None):
+        """Consume `count` frames, skipping ahead if the producer lapped us."""
+        behind = self.written - self.read_position
+        if behind > self.capacity:
+            self._overrun(behind - self.capacity)
+        frames = self.read_at(self.read_position, count, out)
+        # The producer may have wrapped over the region while we copied it
+        if self.written - self.read_position > self.capacity:
+            self._overrun(self.written - self.read_position - self.capacity)
+        self.read_position += count
+        return frames
+
+    def read_at(self, position, count, out=None):
+        """Copy `count` frames starting at absolute `position` without consuming."""
+        if out is None:
+            out = np.empty((count, self.channels), dtype=self.buffer.dtype)
+        start = position % self.capacity
+        first = min(count, self.capacity - start)
+        out[:first] = self.buffer[start:start + first]
+        out[first:count] = self.buffer[:count - first]
+        return out
+
+    def resized(self, capacity):
+        """A buffer of another capacity holding the most recent frames at the same positions."""
+        resized = RingBuffer(capacity, self.channels, self.buffer.dtype)
+        kept = min(self.written - self.oldest_position(), resized.capacity)
+        resized.written = self.written - kept
+        resized.write(self.read_at(resized.written, kept))
+        resized.read_position = max(self.read_position, resized.oldest_position())
+        return resized
+
+    def _overrun(self, lost):
+        self.overruns += 1
+        self.dropped_frames += lost
+        self.read_position = self.written - self.capacity
@@ -0,0 +1,94 @@
+import os
+import struct
+from datetime import datetime
+from helpers import create_folder_if_not_exists
+
+WAV_HEADER_SIZE = 44
+
+
+def wav_header(channels, sample_width, sample_rate, data_size):
+    block_align = channels * sample_width
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', WAV_HEADER_SIZE - 8 + data_size, b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate, sample_rate * block_align, block_align, sample_width * 8,
+        b'data', data_size
+    )
+
+
+class SegmentWriter:
+    """
+    Streams a speech segment to a WAV file as it is being recorded.
+
+    Chunks are appended to disk as they arrive, so memory use does not grow
+    with the length of the talk. When the segment ends, trailing silence is
+    cut off by truncating the file and the header sizes are patched in place.
+
+    While recording, everything but the last `hold_back_frames` frames is
+    final and may already be read by other consumers, see stable_size().
+
+    Args:
+        folder_name: Directory for the WAV files (tmpfs on the Pi)
+        channels: Number of channels
+        sample_width: Bytes per sample
+        sample_rate: Frames per second
+    """
+
+    def __init__(self, folder_name, channels, sample_width, sample_rate):
+        self.folder_name = folder_name
+        self.channels = channels
+        self.sample_width = sample_width
+        self.sample_rate = sample_rate
+        self.frame_size = channels * sample_width
+        self.file = None
+        self.pathname = None
+        self.filename = None
+        self.frames = 0
+        self.hold_back_frames = 0
+
+    @property
+    def recording(self):
+        return self.file is not None
+
+    def open(self, filename, hold_back_frames=0):
+        create_folder_if_not_exists(self.folder_name)
+        self.filename = filename
+        self.hold_back_frames = hold_back_frames
+        self.pathname = os.path.join(self.folder_name, '.recording-%s.wav' % datetime.now().strftime('%Y%m%d%H%M%S%f'))
+        self.file = open(self.pathname, 'wb')
+        self.file.write(wav_header(self.channels, self.sample_width, self.sample_rate, 0))
+        self.frames = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.frames += len(data) // self.frame_size
+
+    def stable_size(self):
+        """Bytes of the file, header included, that will not be truncated."""
+        return WAV_HEADER_SIZE + max(0, self.frames - self.hold_back_frames) * self.frame_size
+
+    def close(self, trim_frames=0):
+        """
+        Finish the segment, dropping its last `trim_frames` frames.
+
+        Returns the final path and the number of frames kept.
+        """
+        frames = max(0, self.frames - trim_frames)
+        data_size = frames * self.frame_size
+        self.file.truncate(WAV_HEADER_SIZE + data_size)
+        self.file.seek(0)
+        self.file.write(wav_header(self.channels, self.sample_width, self.sample_rate, data_size))
+        self.file.close()
+        self.file = None
+
+        pathname = os.path.join(self.folder_name, self.filename)
+        os.replace(self.pathname, pathname)
+        self.pathname = None
+        return pathname, frames
+
+    def discard(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            os.remove(self.pathname)
+            self.pathname = None
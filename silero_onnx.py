@@ -0,0 +1,168 @@
+import numpy as np
+import onnxruntime
+
+DEFAULT_MODEL_PATH = 'vendor/silero-vad-master/files/silero_vad.onnx'
+
+
+class SileroOnnxModel:
+    """
+    Silero VAD running directly on onnxruntime, without importing torch.
+
+    Mirrors the OnnxWrapper returned by torch.hub.load(..., onnx=True): the
+    recurrent state is kept between calls and reset with reset_states().
+    Both the v4 model (`h`/`c` state inputs) and the v5 model (`state` input,
+    512-sample windows with 64 samples of context) are supported.
+
+    Args:
+        path: Path to silero_vad.onnx
+    """
+
+    def __init__(self, path=DEFAULT_MODEL_PATH):
+        options = onnxruntime.SessionOptions()
+        options.inter_op_num_threads = 1
+        options.intra_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'], sess_options=options)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.stateful_v5 = 'state' in self.input_names
+        self.reset_states()
+
+    def reset_states(self):
+        self._h = np.zeros((2, 1, 64), dtype=np.float32)
+        self._c = np.zeros((2, 1, 64), dtype=np.float32)
+        self._state = np.zeros((2, 1, 128), dtype=np.float32)
+        self._context = np.zeros(64, dtype=np.float32)
+
+    def __call__(self, x, sr):
+        x = np.asarray(x, dtype=np.float32)
+        sr_input = np.array(sr, dtype=np.int64)
+        if not self.stateful_v5:
+            out, self._h, self._c = self.session.run(None, {'input': x[None, :], 'h': self._h, 'c': self._c, 'sr': sr_input})
+            return float(out[0][0])
+
+        # v5 only accepts 512 samples at 16 kHz; report the most speech-like window
+        probability = 0.0
+        for window in x.reshape(-1, 512):
+            framed = np.concatenate((self._context, window))[None, :]
+            out, self._state = self.session.run(None, {'input': framed, 'state': self._state, 'sr': sr_input})
+            self._context = window[-64:].copy()
+            probability = max(probability, float(out[0][0]))
+        return probability
+
+
+class TorchValidator:
+    """
+    Runs the torch.hub silero model next to the onnxruntime one and counts
+    windows where their probabilities disagree. Only used for validation,
+    torch is imported when this class is instantiated.
+
+    Args:
+        model: SileroOnnxModel used by the recorder
+        logging_queue: Queue for logging messages
+        tolerance: Largest accepted probability difference
+        report_every: Log a summary after this many calls
+    """
+
+    def __init__(self, model, logging_queue, tolerance=1e-3, report_every=1000):
+        import torch
+        torch.set_num_threads(1)
+        self.torch = torch
+        self.reference, _ = torch.hub.load(repo_or_dir='vendor/silero-vad-master',
+                                           source='local',
+                                           model='silero_vad',
+                                           onnx=True)
+        self.model = model
+        self.logging_queue = logging_queue
+        self.tolerance = tolerance
+        self.report_every = report_every
+        self.calls = 0
+        self.mismatches = 0
+        self.max_difference = 0.0
+
+    def reset_states(self):
+        self.model.reset_states()
+        self.reference.reset_states()
+
+    def __call__(self, x, sr):
+        probability = self.model(x, sr)
+        expected = self.reference(self.torch.from_numpy(x), sr).item()
+        difference = abs(probability - expected)
+        self.calls += 1
+        self.max_difference = max(self.max_difference, difference)
+        if difference > self.tolerance:
+            self.mismatches += 1
+        if self.calls % self.report_every == 0:
+            self.logging_queue.put(f"VAD validation: {self.mismatches}/{self.calls} windows differ by more than {self.tolerance}, max difference {self.max_difference:.2e}")
+        return probability
+
+
+def speech_probabilities(audio, model, sampling_rate=16000, window_size_samples=512):
+    """Speech probability of every window of `audio`, padding the last one with zeros."""
+    probabilities = np.empty(-(-len(audio) // window_size_samples), dtype=np.float32)
+    for i, start in enumerate(range(0, len(audio), window_size_samples)):
+        chunk = audio[start:start + window_size_samples]
+        if len(chunk) < window_size_samples:
+            chunk = np.pad(chunk, (0, window_size_samples - len(chunk)))
+        probabilities[i] = model(chunk, sampling_rate)
+    return probabilities
+
+
+def timestamps_from_probabilities(probabilities, audio_length_samples, threshold=0.5, sampling_rate=16000, min_speech_duration_ms=250, min_silence_duration_ms=100, window_size_samples=512, speech_pad_ms=30):
+    """
+    Turn per-window speech probabilities into speech segments (in samples)
+    with the rules of silero's get_speech_timestamps, without the optional
+    splitting of over-long speeches.
+    """
+    min_speech_samples = sampling_rate * min_speech_duration_ms / 1000
+    speech_pad_samples = sampling_rate * speech_pad_ms / 1000
+    min_silence_samples = sampling_rate * min_silence_duration_ms / 1000
+    neg_threshold = threshold - 0.15
+
+    triggered = False
+    speeches = []
+    current_speech = {}
+    temp_end = 0
+    for i, speech_prob in enumerate(probabilities):
+        position = window_size_samples * i
+        if (speech_prob >= threshold) and temp_end:
+            temp_end = 0
+        if (speech_prob >= threshold) and not triggered:
+            triggered = True
+            current_speech['start'] = position
+            continue
+        if (speech_prob < neg_threshold) and triggered:
+            if not temp_end:
+                temp_end = position
+            if position - temp_end < min_silence_samples:
+                continue
+            current_speech['end'] = temp_end
+            if (current_speech['end'] - current_speech['start']) > min_speech_samples:
+                speeches.append(current_speech)
+            current_speech = {}
+            temp_end = 0
+            triggered = False
+
+    if current_speech and (audio_length_samples - current_speech['start']) > min_speech_samples:
+        current_speech['end'] = audio_length_samples
+        speeches.append(current_speech)
+
+    for i, speech in enumerate(speeches):
+        if i == 0:
+            speech['start'] = int(max(0, speech['start'] - speech_pad_samples))
+        if i != len(speeches) - 1:
+            silence_duration = speeches[i + 1]['start'] - speech['end']
+            if silence_duration < 2 * speech_pad_samples:
+                speech['end'] += int(silence_duration // 2)
+                speeches[i + 1]['start'] = int(max(0, speeches[i + 1]['start'] - silence_duration // 2))
+            else:
+                speech['end'] = int(min(audio_length_samples, speech['end'] + speech_pad_samples))
+                speeches[i + 1]['start'] = int(max(0, speeches[i + 1]['start'] - speech_pad_samples))
+        else:
+            speech['end'] = int(min(audio_length_samples, speech['end'] + speech_pad_samples))
+    return speeches
+
+
+def get_speech_timestamps(audio, model, threshold=0.5, sampling_rate=16000, min_speech_duration_ms=250, min_silence_duration_ms=100, window_size_samples=512, speech_pad_ms=30):
+    """numpy counterpart of silero's get_speech_timestamps utility."""
+    model.reset_states()
+    probabilities = speech_probabilities(audio, model, sampling_rate, window_size_samples)
+    return timestamps_from_probabilities(probabilities, len(audio), threshold, sampling_rate, min_speech_duration_ms, min_silence_duration_ms, window_size_samples, speech_pad_ms)
@@ -0,0 +1,273 @@
+import os
+import shutil
+import threading
+import time
+from log import as_logger
+from metrics import REGISTRY
+
+
+class Spool(threading.Thread):
+    """
+    Keeps the segments saved in tmpfs within a RAM budget.
+
+    Finished files are registered with add(). Every `interval` seconds, or
+    right after a file is added, the spool enforces its limits:
+
+    - Uploaded files kept for `keep_uploaded_sec` are removed when they get
+      older than that, and sooner, least recently used first, when tmpfs is
+      over `ram_budget` bytes.
+    - If that is not enough, the oldest files still waiting for upload (or
+      all segments when uploading is off) are moved to `spill_dir` on the SD
+      card or a USB disk until tmpfs is back to `low_water` of the budget.
+      With uploading on, files are only moved through the upload queue,
+      which follows them to their new place and updates its manifest, and
+      files it no longer lists as pending are left alone.
+    - If tmpfs is still over the budget after that, an error is logged.
+
+    Files are never deleted before they were uploaded. When there is no
+    spill directory, or it has less than `spill_reserve` bytes free, the
+    spool logs an error instead of growing silently. Usage, free space and
+    backlog are exported as `spool_*` gauges.
+
+    Args:
+        directory: The tmpfs directory segments are saved to
+        logging_queue: Queue or Logger for logging messages
+        ram_budget: Bytes the spool may use in tmpfs
+        spill_dir: Directory on persistent storage for spilled segments
+        keep_uploaded_sec: Seconds uploaded files are kept; 0 if the upload
+            queue removes them itself
+        upload_queue: UploadQueue the pending files belong to, if uploading
+        interval: Seconds between checks
+        low_water: Fraction of the budget to get back to when spilling
+        spill_reserve: Bytes left free in `spill_dir`
+        catalog: Optional catalog.Catalog told where spilled files went
+        metrics: Registry for the gauges
+    """
+
+    def __init__(self, directory, logging_queue, ram_budget=256 * 1024 * 1024, spill_dir=None, keep_uploaded_sec=0, upload_queue=None, interval=10, low_water=0.8, spill_reserve=200 * 1024 * 1024, catalog=None, metrics=REGISTRY):
+        super().__init__(name='spool', daemon=True)
+        self.directory = directory
+        self.log = as_logger(logging_queue, 'spool')
+        self.ram_budget = ram_budget
+        self.spill_dir = spill_dir
+        self.keep_uploaded_sec = keep_uploaded_sec
+        self.upload_queue = upload_queue
+        self.interval = interval
+        self.low_water = low_water
+        self.spill_reserve = spill_reserve
+        self.catalog = catalog
+        self.metrics = metrics
+        # path -> time it was added or uploaded, oldest first
+        self.files = {}
+        self.uploaded_files = {}
+        self.ram_bytes = 0
+        self.pending_bytes = 0
+        self.warned = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+        for name, function in (
+            ('spool_ram_bytes', lambda: self.ram_bytes),
+            ('spool_ram_budget_bytes', lambda: self.ram_budget),
+            ('spool_pending_bytes', lambda: self.pending_bytes),
+            ('spool_pending_files', lambda: len(self.files)),
+            ('spool_spilled_files', lambda: sum(1 for path in list(self.files) if not self.in_ram(path))),
+            ('spool_tmpfs_free_bytes', lambda: free_bytes(self.directory)),
+            ('spool_spill_free_bytes', lambda: free_bytes(self.spill_dir)),
+        ):
+            metrics.gauge(name, function)
+
+    def add(self, paths):
+        """Register finished files that may be moved or, once uploaded, evicted."""
+        with self._lock:
+            for path in paths:
+                self.files.setdefault(path, time.time())
+        self._wake.set()
+
+    def uploaded(self, path):
+        """Called by the upload queue; uploaded files that are kept become evictable."""
+        with self._lock:
+            self.files.pop(path, None)
+            if os.path.exists(path):
+                self.uploaded_files[path] = time.time()
+
+    def moved(self, path, new_path):
+        """Follow a pending file that was moved, e.g. by the upload queue to persistent storage."""
+        with self._lock:
+            if path in self.files:
+                self.files[new_path] = self.files.pop(path)
+        if self.catalog:
+            self.catalog.moved(path, new_path)
+
+    def recover(self):
+        """
+        Register segments left in tmpfs or the spill directory by a previous
+        run; call before recording and before the upload queue starts.
+
+        With uploading on, files the upload manifest does not list (kept
+        after upload, or saved right before a crash) are looked up in the
+        catalog: uploaded ones become evictable, the others are queued for
+        upload. Temporary files of the previous run are removed.
+        """
+        queued, state_paths = self.upload_queue.resumable() if self.upload_queue else (set(), set())
+        paths = []
+        for directory in (self.directory, self.spill_dir):
+            if directory and os.path.isdir(directory):
+                self.remove_stale(directory, state_paths)
+                paths += [os.path.join(directory, name) for name in sorted(os.listdir(directory), key=lambda name: os.path.getmtime(os.path.join(directory, name))) if not name.startswith('.')]
+        if not paths:
+            return
+        self.log.info(f"Found {len(paths)} files from a previous run in the spool")
+        for path in paths:
+            if not self.upload_queue or path in queued:
+                self.add([path])
+            elif self.was_uploaded(path):
+                with self._lock:
+                    self.uploaded_files[path] = os.path.getmtime(path)
+                if not self.keep_uploaded_sec:
+                    self.evict(path)
+            else:
+                self.log.info(f"Queueing {path} from a previous run for upload", file=path)
+                self.add([path])
+                self.upload_queue.put(path, os.path.basename(path))
+
+    def was_uploaded(self, path):
+        row = self.catalog.get(os.path.basename(path)) if self.catalog else None
+        return bool(row) and row['state'] == 'uploaded' and row['size'] == file_size(path)
+
+    def remove_stale(self, directory, keep):
+        """Remove segments being recorded, partial copies and upload states a previous run left behind."""
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if (name.startswith('.recording-') or name.startswith('.') and name.endswith(('.part', '.upload.json'))) and path not in keep and os.path.isfile(path):
+                os.remove(path)
+                self.log.info(f"Removed {path} left by a previous run", file=path)
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.enforce()
+            except Exception as e:
+                self.log.error(f"Spool check failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def in_ram(self, path):
+        return os.path.dirname(path) == os.path.normpath(self.directory)
+
+    def enforce(self):
+        self.evict_expired()
+        self.ram_bytes = directory_size(self.directory)
+        if self.ram_bytes > self.ram_budget:
+            target = self.ram_budget * self.low_water
+            for path in self.least_recently_used():
+                if self.ram_bytes <= target:
+                    break
+                self.ram_bytes -= self.evict(path)
+            for path in [path for path in list(self.files) if self.in_ram(path)]:
+                if self.ram_bytes <= target:
+                    break
+                size = self.spill(path)
+                if size is None:
+                    break
+                self.ram_bytes -= size
+            if self.ram_bytes > self.ram_budget:
+                self.warn(f"Spool still uses {self.ram_bytes} bytes of tmpfs, over its budget of {self.ram_budget} bytes; {len(self.files)} files wait for upload")
+        else:
+            self.warned = False
+        self.pending_bytes = sum(file_size(path) for path in list(self.files))
+
+    def evict_expired(self):
+        if not self.keep_uploaded_sec:
+            return
+        expired = time.time() - self.keep_uploaded_sec
+        for path, uploaded in list(self.uploaded_files.items()):
+            if uploaded < expired:
+                self.evict(path)
+
+    def least_recently_used(self):
+        paths = [path for path in list(self.uploaded_files) if self.in_ram(path)]
+        return sorted(paths, key=lambda path: max(self.uploaded_files.get(path, 0), access_time(path)))
+
+    def evict(self, path):
+        """Remove an uploaded file and return the bytes freed."""
+        size = file_size(path)
+        with self._lock:
+            self.uploaded_files.pop(path, None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        self.metrics.counter('spool_evictions').inc()
+        self.log.debug(f"Evicted uploaded file {path}", file=path, size=size)
+        return size
+
+    def spill(self, path):
+        """Move a file that is not uploaded yet to persistent storage; returns the bytes freed or None."""
+        if not os.path.exists(path):
+            with self._lock:
+                self.files.pop(path, None)
+            return 0
+        size = file_size(path)
+        if not self.spill_dir:
+            return self.warn(f"Spool is over its tmpfs budget and no spill directory is configured, {path} stays in RAM")
+        if free_bytes(self.spill_dir) - size < self.spill_reserve:
+            return self.warn(f"Spill directory {self.spill_dir} is full, {path} stays in RAM")
+        try:
+            if self.upload_queue:
+                # Only the queue may move its files; one it no longer lists
+                # is being uploaded or was just uploaded, and leaves by itself
+                new_path = self.upload_queue.relocate(path, self.spill_dir)
+                if new_path is None:
+                    return 0
+            else:
+                new_path = shutil.move(path, os.path.join(self.spill_dir, os.path.basename(path)))
+        except OSError as e:
+            self.metrics.counter('spool_spill_failures').inc()
+            return self.warn(f"Could not move {path} to {self.spill_dir}: {e}")
+        self.moved(path, new_path)
+        self.metrics.counter('spool_spills').inc()
+        self.log.info(f"Moved {path} to {new_path} to free tmpfs", file=new_path, size=size)
+        return size
+
+    def warn(self, message):
+        if not self.warned:
+            self.log.error(message)
+            self.warned = True
+        return None
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def access_time(path):
+    try:
+        return os.stat(path).st_atime
+    except OSError:
+        return 0
+
+
+def directory_size(directory):
+    try:
+        return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+    except OSError:
+        return 0
+
+
+def free_bytes(directory):
+    if not directory:
+        return None
+    try:
+        return shutil.disk_usage(directory).free
+    except OSError:
+        return None
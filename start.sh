@@ -1,3 +1,3 @@
 #!/bin/bash
 
-/home/fsspx/.pyenv/shims/python audio_recorder.py -u -c -d 1 2> $HOME/`date +\%Y\%m\%d\%H\%M\%S`-cron.error.log
\ No newline at end of file
+/home/fsspx/.pyenv/shims/python audio_recorder.py -u -c -d 1 --log-file $HOME/recorder.log.jsonl --metrics-file $HOME/recorder.metrics.json --metrics-port 9108 --spill-dir $HOME/vad_spool 2> $HOME/`date +\%Y\%m\%d\%H\%M\%S`-cron.error.log
\ No newline at end of file
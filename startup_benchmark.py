@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+import os
+import subprocess
+import sys
+import time
+from statistics import median
+
+# Each scenario runs in a fresh interpreter and stops once the VAD model is ready
+SCENARIOS = {
+    'torch.hub (previous)': """
+import torch
+torch.set_num_threads(1)
+from torchaudio import functional
+model, utils = torch.hub.load(repo_or_dir='vendor/silero-vad-master', source='local', model='silero_vad', onnx=True)
+""",
+    'onnxruntime (current)': """
+import audio_recorder
+from silero_onnx import SileroOnnxModel
+model = SileroOnnxModel()
+""",
+}
+
+
+def measure(code):
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    if status != 0:
+        raise RuntimeError(process.stderr.read().decode(errors='replace').strip())
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, usage.ru_maxrss / 1024
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Measure recorder startup time and peak RSS with and without torch')
+    parser.add_argument('-n', '--runs', help='runs per scenario', default=5, type=int)
+    args = parser.parse_args()
+
+    for name, code in SCENARIOS.items():
+        try:
+            results = [measure(code) for _ in range(args.runs)]
+        except RuntimeError as e:
+            lines = str(e).splitlines()
+            print(f"{name:<24} failed: {lines[-1] if lines else 'unknown error'}")
+            continue
+        print(f"{name:<24} startup {median(r[0] for r in results):6.2f}s  peak RSS {median(r[1] for r in results):7.1f} MB")
@@ -1,29 +1,144 @@
-import requests
+import os
 import threading
-from config import get_config
+import time
+from collections import deque
+import requests
+from dotenv import load_dotenv
+from log import as_logger
+
+CPU_TEMPERATURE_PATH = '/sys/class/thermal/thermal_zone0/temp'
 
-def threadPost(url, data, timeout):
+
+def cpu_temperature():
     try:
-        requests.post(url, json=data, timeout=timeout)
-    except:
-        pass
-
-def asyncPost(url, data, timeout):
-    t = threading.Thread(target=threadPost, args=(url, data, timeout))
-    t.start()
-    return t
-
-def updateChunkStatus(chunks_read, chunks_total, previous_update = None, timeout=1.0):
-    # don't post if previous update didn't complete
-    if previous_update is not None and previous_update.is_alive():
-        return previous_update
-
-    config = get_config()['status_update']
-    url = config['api_url'] + "chunks"
-    data = {
-        "id": config['id'],
-        "password": config['password'],
-        "chunks_read": chunks_read,
-        "chunks_total": chunks_total
-    }
-    return asyncPost(url, data, timeout)
\ No newline at end of file
+        with open(CPU_TEMPERATURE_PATH) as f:
+            return int(f.read().strip()) / 1000
+    except (OSError, ValueError):
+        return None
+
+
+class StatusReporter(threading.Thread):
+    """
+    Posts the recorder's status to the status API from one long-lived thread.
+
+    Callers only update the latest state, which is cheap and never blocks;
+    updates between two posts are coalesced. Every `interval` seconds the
+    current state is snapshotted and posted through a pooled HTTP session.
+    Snapshots that could not be delivered are kept, up to `max_pending`,
+    and sent oldest first once the API is reachable again, so an offline
+    Pi keeps a bounded history instead of growing without limit.
+
+    The API location and credentials come from STATUS_API_URL, STATUS_ID
+    and STATUS_PASSWORD (or .env) unless given explicitly.
+
+    Args:
+        logging_queue: Queue or Logger for logging messages
+        api_url: Base URL of the status API; status is posted to `<api_url>status`
+        device_id: Identifier of this recorder
+        password: Password for the status API
+        interval: Seconds between posts
+        timeout: HTTP timeout in seconds
+        max_pending: Undelivered snapshots kept while offline
+        session: Optional requests.Session (e.g. pointed at a local stub)
+    """
+
+    def __init__(self, logging_queue, api_url=None, device_id=None, password=None, interval=30, timeout=5, max_pending=120, session=None):
+        super().__init__(name='status', daemon=True)
+        load_dotenv()
+        self.log = as_logger(logging_queue, 'status')
+        self.api_url = api_url or os.environ.get("STATUS_API_URL")
+        self.device_id = device_id or os.environ.get("STATUS_ID")
+        self.password = password or os.environ.get("STATUS_PASSWORD")
+        self.interval = interval
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self.state = {'state': 'idle'}
+        self.sources = []
+        self.pending = deque(maxlen=max_pending)
+        self.sent = 0
+        self.failures = 0
+        self.offline = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    @property
+    def enabled(self):
+        return bool(self.api_url)
+
+    def update(self, **state):
+        """Merge `state` into the status sent with the next post."""
+        with self._lock:
+            self.state.update(state)
+
+    def add_source(self, source):
+        """Register a callable returning a dict of values read at every post."""
+        self.sources.append(source)
+
+    def snapshot(self):
+        with self._lock:
+            status = dict(self.state)
+        for source in self.sources:
+            try:
+                status.update(source())
+            except Exception as e:
+                self.log.warning(f"Status source failed: {e}")
+        status.update({
+            'id': self.device_id,
+            'time': time.time(),
+            'cpu_temperature': cpu_temperature(),
+        })
+        return status
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.flush()
+
+    def stop(self, flush=True):
+        self._stopped.set()
+        if flush and self.enabled:
+            self.flush()
+
+    def flush(self):
+        """Queue a snapshot of the current state and post everything pending."""
+        with self._flush_lock:
+            self.pending.append(self.snapshot())
+            return self._post_pending()
+
+    def _post_pending(self):
+        while self.pending:
+            status = self.pending[0]
+            try:
+                response = self.session.post(self.api_url + "status", json={**status, 'password': self.password}, timeout=self.timeout)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                self.failures += 1
+                if not self.offline:
+                    self.log.warning(f"Status API unreachable, keeping up to {self.pending.maxlen} updates: {e}")
+                    self.offline = True
+                return False
+            self.pending.popleft()
+            self.sent += 1
+        if self.offline:
+            self.log.info("Status API reachable again")
+            self.offline = False
+        return True
+
+
+if __name__ == "__main__":
+    import argparse
+    import queue
+    from log import log_message
+    parser = argparse.ArgumentParser(description='Post one status update, e.g. to check the API or a local stub')
+    parser.add_argument('--url', help='status API base URL (default: STATUS_API_URL)', default=None)
+    parser.add_argument('--id', help='recorder id (default: STATUS_ID)', default=None)
+    args = parser.parse_args()
+
+    logging_queue = queue.Queue()
+    threading.Thread(target=log_message, args=(logging_queue,), daemon=True).start()
+    reporter = StatusReporter(logging_queue, api_url=args.url, device_id=args.id)
+    if not reporter.enabled:
+        parser.error("no status API URL, set STATUS_API_URL or pass --url")
+    delivered = reporter.flush()
+    logging_queue.join()
+    print(f"Status {'delivered' if delivered else 'not delivered'}: {reporter.snapshot()}")
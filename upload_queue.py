@@ -0,0 +1,302 @@
+import json
+import os
+import queue
+import shutil
+import threading
+from file_uploader import MultipartUpload
+
+
+class UploadQueue:
+    """
+    Uploads saved segments in the background with a small pool of workers.
+
+    Every pending upload is recorded in an on-disk manifest before it is
+    queued and removed only once it succeeds, so uploads interrupted by a
+    crash or reboot are resumed by start(). Each worker makes one attempt at
+    a time; a failed file is queued again by a timer after the uploader's
+    backoff, so workers never sleep and fresh files do not wait behind
+    failing ones. Files that exhaust the uploader's attempts are queued
+    again after `requeue_delay` seconds.
+
+    A file whose first attempt fails is moved to `persist_dir` before it
+    waits for its retry, so a file kept in tmpfs survives a reboot along
+    with its manifest entry.
+
+    Args:
+        uploader: Object with attempt(filepath, target_name, attempt) ->
+            bool, retry_delay(filepath, attempt), give_up(filepath,
+            target_name) and max_attempts, e.g. file_uploader.MinioUploader
+            or a fake for tests
+        logging_queue: Queue for logging messages
+        manifest_path: JSON file listing pending uploads; keep it on
+            persistent storage for uploads to survive a reboot
+        workers: Number of concurrent uploads
+        remove_after_upload: Delete local files once uploaded
+        requeue_delay: Seconds before a failed upload is attempted again
+        part_size: Part size in bytes for streamed multipart uploads
+        poll_interval: Seconds between checks for new parts of streamed files
+        on_uploaded: Optional callable receiving the path of every file
+            uploaded, e.g. spool.Spool.uploaded
+        persist_dir: Directory on persistent storage that files move to
+            when their first attempt fails; None keeps them where they are
+        on_moved: Optional callable receiving the old and new path of a
+            file moved to `persist_dir`, e.g. spool.Spool.moved
+    """
+
+    def __init__(self, uploader, logging_queue, manifest_path='upload_manifest.json', workers=2, remove_after_upload=True, requeue_delay=600, part_size=8 * 1024 * 1024, poll_interval=5, on_uploaded=None, persist_dir=None, on_moved=None):
+        self.uploader = uploader
+        self.logging_queue = logging_queue
+        self.manifest_path = manifest_path
+        self.workers = workers
+        self.remove_after_upload = remove_after_upload
+        self.requeue_delay = requeue_delay
+        self.part_size = part_size
+        self.poll_interval = poll_interval
+        self.on_uploaded = on_uploaded
+        self.persist_dir = persist_dir
+        self.on_moved = on_moved
+        self.streams = {}
+        self.queue = queue.Queue()
+        self.pending = {}
+        # Files being uploaded, and where queued files were moved to
+        self.active = set()
+        self.relocating = set()
+        self.moved = {}
+        self.uploaded = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._relocated = threading.Condition(self._lock)
+        self._threads = []
+
+    @property
+    def backlog(self):
+        return len(self.pending)
+
+    def resumable(self):
+        """Paths in the manifest, which start() resumes, and the state files of their streamed uploads."""
+        entries = self._load_manifest()
+        return {entry['path'] for entry in entries}, {MultipartUpload.state_path_for(entry['path'], entry['target']) for entry in entries}
+
+    def start(self):
+        for entry in self._load_manifest():
+            if entry['path'] in self.pending:
+                continue
+            if os.path.exists(entry['path']):
+                self.logging_queue.put(f"Resuming pending upload of {entry['path']}")
+                self.put(entry['path'], entry['target'])
+            else:
+                self.logging_queue.put(f"Pending upload {entry['path']} no longer exists, dropping it")
+        self._save_manifest()
+
+        for _ in range(self.workers):
+            worker = threading.Thread(target=self._work, daemon=True)
+            worker.start()
+            self._threads.append(worker)
+
+    def put(self, filepath, target_name):
+        with self._lock:
+            self.pending[filepath] = target_name
+            self._save_manifest()
+        self.queue.put((filepath, target_name, 1))
+
+    def begin_stream(self, filepath, target_name, stable_size):
+        """
+        Start uploading a file that is still being recorded.
+
+        `stable_size` is a callable returning how many bytes of the file
+        are final; parts below it are uploaded every `poll_interval` seconds.
+        """
+        multipart = MultipartUpload(self.uploader, filepath, target_name, self.part_size)
+        finished = threading.Event()
+        thread = threading.Thread(target=self._stream, args=(multipart, stable_size, finished), daemon=True)
+        self.streams[target_name] = (multipart, finished, thread)
+        thread.start()
+
+    def finish_stream(self, target_name, filepath):
+        """Hand a finished streamed file over to the workers to complete."""
+        self._stop_stream(target_name)
+        self.put(filepath, target_name)
+
+    def abort_stream(self, target_name):
+        multipart = self._stop_stream(target_name)
+        if multipart:
+            multipart.abort()
+
+    def _stop_stream(self, target_name):
+        if target_name not in self.streams:
+            return None
+        multipart, finished, thread = self.streams.pop(target_name)
+        finished.set()
+        thread.join()
+        return multipart
+
+    def _stream(self, multipart, stable_size, finished):
+        while not finished.wait(self.poll_interval):
+            try:
+                multipart.upload_stable(stable_size())
+            except Exception as e:
+                self.logging_queue.put(f"Streaming upload of {multipart.target_name} failed, will retry: {e}")
+
+    def relocate(self, filepath, directory):
+        """
+        Move a pending file, and the state of its streamed upload, to
+        `directory` unless it is being uploaded right now.
+
+        The copy is made without holding the lock, so put() and the workers
+        are not blocked while it runs; the lock is only taken to swap the
+        path and rewrite the manifest. A worker that gets to the file while
+        it is being copied waits for the copy and uploads it from its new
+        place.
+
+        Returns the new path, or None if the file was left where it is.
+        """
+        with self._lock:
+            if filepath in self.active or filepath in self.relocating or filepath not in self.pending:
+                return None
+            target_name = self.pending[filepath]
+            self.relocating.add(filepath)
+        state_path = MultipartUpload.state_path_for(filepath, target_name)
+        new_state_path = MultipartUpload.state_path_for(os.path.join(directory, os.path.basename(filepath)), target_name)
+        new_path = os.path.join(directory, os.path.basename(filepath))
+        swapped = False
+        try:
+            copy_into(filepath, directory)
+            if os.path.exists(state_path):
+                copy_into(state_path, directory)
+            with self._lock:
+                swapped = filepath in self.pending
+                if swapped:
+                    self.pending[new_path] = self.pending.pop(filepath)
+                    self.moved[filepath] = new_path
+                    self._save_manifest()
+        finally:
+            with self._lock:
+                self.relocating.discard(filepath)
+                self._relocated.notify_all()
+            for path in ((filepath, state_path) if swapped else (new_path, new_state_path)):
+                if os.path.exists(path):
+                    os.remove(path)
+        return new_path if swapped else None
+
+    def join(self):
+        self.queue.join()
+
+    def _work(self):
+        while True:
+            filepath, target_name, attempt = self.queue.get()
+            try:
+                self._upload(filepath, target_name, attempt)
+            except Exception as e:
+                self.logging_queue.put(f"Error in upload worker for {filepath}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _requeue(self, delay, filepath, target_name, attempt):
+        timer = threading.Timer(delay, self.queue.put, ((filepath, target_name, attempt),))
+        timer.daemon = True
+        timer.start()
+
+    def _upload(self, filepath, target_name, attempt):
+        with self._lock:
+            while filepath in self.relocating:
+                self._relocated.wait()
+            while filepath in self.moved:
+                filepath = self.moved.pop(filepath)
+            self.active.add(filepath)
+        try:
+            filepath = self._upload_file(filepath, target_name, attempt)
+        finally:
+            with self._lock:
+                self.active.discard(filepath)
+
+    def _upload_file(self, filepath, target_name, attempt):
+        """Make one attempt; returns where the file is afterwards."""
+        if not os.path.exists(filepath):
+            self.logging_queue.put(f"File {filepath} disappeared before upload, dropping it")
+            self._done(filepath)
+            return filepath
+
+        if not self.uploader.attempt(filepath, target_name, attempt):
+            if attempt == 1 and self.persist_dir:
+                filepath = self._persist(filepath, target_name)
+            if attempt < self.uploader.max_attempts:
+                self._requeue(self.uploader.retry_delay(filepath, attempt), filepath, target_name, attempt + 1)
+                return filepath
+            self.uploader.give_up(filepath, target_name)
+            self.failed += 1
+            self.logging_queue.put(f"Upload of {filepath} failed, trying again in {self.requeue_delay}s")
+            self._requeue(self.requeue_delay, filepath, target_name, 1)
+            return filepath
+
+        self.uploaded += 1
+        self._done(filepath)
+        if self.remove_after_upload:
+            try:
+                os.remove(filepath)
+                self.logging_queue.put(f"Removed local file after successful upload: {filepath}")
+            except Exception as e:
+                self.logging_queue.put(f"Error removing local file {filepath}: {e}")
+        if self.on_uploaded:
+            self.on_uploaded(filepath)
+        return filepath
+
+    def _persist(self, filepath, target_name):
+        """
+        Move a file this worker is uploading, with the state of its
+        streamed upload, to `persist_dir`; returns its path afterwards.
+        """
+        if os.path.dirname(os.path.abspath(filepath)) == os.path.abspath(self.persist_dir):
+            return filepath
+        state_path = MultipartUpload.state_path_for(filepath, target_name)
+        try:
+            new_path = copy_into(filepath, self.persist_dir)
+            if os.path.exists(state_path):
+                copy_into(state_path, self.persist_dir)
+        except OSError as e:
+            self.logging_queue.put(f"Could not move {filepath} to {self.persist_dir}, it stays there until uploaded: {e}")
+            return filepath
+        with self._lock:
+            self.pending[new_path] = self.pending.pop(filepath, target_name)
+            self.active.discard(filepath)
+            self.active.add(new_path)
+            self._save_manifest()
+        for path in (filepath, state_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.logging_queue.put(f"Moved {filepath} to {new_path} until its upload succeeds")
+        if self.on_moved:
+            self.on_moved(filepath, new_path)
+        return new_path
+
+    def _done(self, filepath):
+        with self._lock:
+            self.pending.pop(filepath, None)
+            self._save_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)['pending']
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            self.logging_queue.put(f"Could not read upload manifest {self.manifest_path}: {e}")
+            return []
+
+    def _save_manifest(self):
+        entries = [{'path': path, 'target': target} for path, target in self.pending.items()]
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'pending': entries}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.manifest_path)
+
+
+def copy_into(path, directory):
+    """Copy a file into `directory` under the same name, appearing there only once complete."""
+    new_path = os.path.join(directory, os.path.basename(path))
+    temp_path = os.path.join(directory, '.%s.part' % os.path.basename(path).lstrip('.'))
+    shutil.copy2(path, temp_path)
+    os.replace(temp_path, new_path)
+    return new_path
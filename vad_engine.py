@@ -0,0 +1,144 @@
+import numpy as np
+
+
+class VadEngine:
+    """
+    Streaming voice activity detector around the silero model.
+
+    Audio at 16 kHz of any chunk length is pushed in and split into fixed
+    512-sample windows. Several windows are sent to the model in one call
+    (silero accepts 512, 1024 or 1536 samples at 16 kHz and carries its
+    recurrent state from call to call, so a batch is simply a longer window).
+    Before that, a vectorized RMS pre-gate skips inference altogether when
+    every window of the batch is below `gate_dbfs`; such batches count as
+    silence and the model state is reset when sound comes back, as it would
+    be after a restart.
+
+    Start/end events follow silero's VADIterator: the same threshold,
+    `threshold - 0.15` hysteresis, minimum silence and speech padding, with
+    each model call treated as one iterator window. An `adaptive`
+    controller (see adaptive_vad.py) may move the thresholds and the minimum
+    silence while the stream runs and veto starts in noise.
+
+    Args:
+        predict: Callable taking a float32 numpy array and returning the
+            speech probability
+        reset_model: Callable resetting the model's recurrent state
+        threshold: Speech probability that starts a segment
+        sampling_rate: Sample rate of the pushed audio
+        min_silence_duration_ms: Silence needed before a segment ends
+        speech_pad_ms: Padding added to reported start/end timestamps
+        window_size_samples: Samples per VAD window
+        batch_windows: Windows per model call (1-3)
+        gate_dbfs: Windows quieter than this skip inference; None disables
+            the pre-gate
+        adaptive: Optional AdaptiveVad adjusting the engine to the room
+    """
+
+    def __init__(self, predict, reset_model, threshold=0.5, sampling_rate=16000, min_silence_duration_ms=100, speech_pad_ms=30, window_size_samples=512, batch_windows=3, gate_dbfs=-60, adaptive=None):
+        self.predict = predict
+        self.reset_model = reset_model
+        self.threshold = threshold
+        self.end_threshold = threshold - 0.15
+        self.sampling_rate = sampling_rate
+        self.min_silence_samples = sampling_rate * min_silence_duration_ms / 1000
+        self.speech_pad_samples = sampling_rate * speech_pad_ms / 1000
+        self.window_size_samples = window_size_samples
+        self.batch_samples = window_size_samples * batch_windows
+        self.gate_rms = None if gate_dbfs is None else 10 ** (gate_dbfs / 20)
+        # The gate compares per-window sums of squares with this
+        self.gate_energy = None if gate_dbfs is None else self.gate_rms ** 2 * window_size_samples
+        # Audio not yet sent to the model, kept in a reused buffer
+        self.pending = np.zeros(2 * self.batch_samples, dtype=np.float32)
+        self.pending_samples = 0
+        self.energy = np.zeros(batch_windows, dtype=np.float32)
+        self.adaptive = adaptive
+        if adaptive is not None:
+            adaptive.attach(self)
+        self.inference_calls = 0
+        self.gated_batches = 0
+        self.reset_states()
+
+    def configure(self, threshold, min_silence_duration_ms, gate_dbfs):
+        """Change the thresholds while running; an adaptive VAD restarts from the new values."""
+        self.threshold = threshold
+        self.end_threshold = threshold - 0.15
+        self.min_silence_samples = self.sampling_rate * min_silence_duration_ms / 1000
+        self.gate_rms = None if gate_dbfs is None else 10 ** (gate_dbfs / 20)
+        self.gate_energy = None if gate_dbfs is None else self.gate_rms ** 2 * self.window_size_samples
+        if self.adaptive is not None:
+            self.adaptive.attach(self)
+
+    def reset_states(self):
+        self.reset_model()
+        self.triggered = False
+        self.temp_end = 0
+        self.current_sample = 0
+        self.gated = False
+        self.last_probability = 0.0
+
+    def __call__(self, audio, return_seconds=False):
+        """Push audio and return the last start/end event it produced, if any."""
+        end = self.pending_samples + len(audio)
+        if end > len(self.pending):
+            self.pending = np.concatenate((self.pending[:self.pending_samples], np.zeros(end - self.pending_samples, dtype=np.float32)))
+        self.pending[self.pending_samples:end] = audio
+        speech_dict = None
+        start = 0
+        while end - start >= self.batch_samples:
+            event = self.step(self.pending[start:start + self.batch_samples], return_seconds)
+            start += self.batch_samples
+            if event:
+                speech_dict = event
+        if start:
+            # Fewer than batch_samples remain, so the move never overlaps
+            self.pending[:end - start] = self.pending[start:end]
+        self.pending_samples = end - start
+        return speech_dict
+
+    def step(self, batch, return_seconds=False):
+        speech_prob = self.probability(batch)
+        if self.adaptive is not None:
+            self.adaptive.update(batch, speech_prob, self.triggered)
+        return self.decide(speech_prob, len(batch), return_seconds)
+
+    def decide(self, speech_prob, window_size_samples, return_seconds=False):
+        """Advance by one model call of `window_size_samples` with its probability; resegment.py replays these offline."""
+        self.current_sample += window_size_samples
+        self.last_probability = speech_prob
+
+        if (speech_prob >= self.threshold) and self.temp_end:
+            self.temp_end = 0
+
+        if (speech_prob >= self.threshold) and not self.triggered:
+            if self.adaptive is not None and not self.adaptive.allows_start():
+                return None
+            self.triggered = True
+            speech_start = self.current_sample - self.speech_pad_samples - window_size_samples
+            return {'start': int(speech_start) if not return_seconds else round(speech_start / self.sampling_rate, 1)}
+
+        if (speech_prob < self.end_threshold) and self.triggered:
+            if not self.temp_end:
+                self.temp_end = self.current_sample
+            if self.current_sample - self.temp_end < self.min_silence_samples:
+                return None
+            speech_end = self.temp_end + self.speech_pad_samples - window_size_samples
+            self.temp_end = 0
+            self.triggered = False
+            return {'end': int(speech_end) if not return_seconds else round(speech_end / self.sampling_rate, 1)}
+
+        return None
+
+    def probability(self, batch):
+        if self.gate_rms is not None:
+            windows = batch.reshape(-1, self.window_size_samples)
+            energy = np.einsum('ij,ij->i', windows, windows, out=self.energy[:len(windows)])
+            if energy.max() < self.gate_energy:
+                self.gated_batches += 1
+                self.gated = True
+                return 0.0
+            if self.gated:
+                self.reset_model()
+                self.gated = False
+        self.inference_calls += 1
+        return self.predict(batch)